@@ -1,5 +1,10 @@
 from ai_chat_html_exporter.langchain_chat_html_exporter import HtmlExportCallbackHandler
-from ai_chat_html_exporter.openai_chat_html_exporter import with_html_logger
+from ai_chat_html_exporter.openai_chat_html_exporter import ExporterPool, with_html_logger
+from ai_chat_html_exporter.capture import render_capture
+from ai_chat_html_exporter.session import chat_session
+from ai_chat_html_exporter.metrics import MetricsHook, PrometheusMetrics
+from ai_chat_html_exporter.sampling import SamplingPolicy
 
 __version__ = "0.1.0"
-__all__ = ["HtmlExportCallbackHandler", "with_html_logger"]
\ No newline at end of file
+__all__ = ["HtmlExportCallbackHandler", "with_html_logger", "ExporterPool", "render_capture", "chat_session",
+           "MetricsHook", "PrometheusMetrics", "SamplingPolicy"]
\ No newline at end of file
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Iterable
+
+# 本进程已确认存在的资源文件，避免每次都访问文件系统
+_known_assets = set()
+_known_assets_lock = threading.Lock()
+
+
+def content_hash(data: bytes, length: int = 16) -> str:
+    """计算内容哈希，用作资源文件名"""
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def write_asset(asset_dir: str, data: bytes | str, suffix: str, prefix: str = "") -> str:
+    """以内容哈希命名写入共享资源文件，相同内容只写一次
+
+    Args:
+        asset_dir: 资源目录
+        data: 文件内容
+        suffix: 文件扩展名，例如 ".css"
+        prefix: 文件名前缀
+
+    Returns:
+        资源文件路径
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    path = os.path.join(asset_dir, f"{prefix}{content_hash(data)}{suffix}")
+    if path in _known_assets:
+        return path
+
+    with _known_assets_lock:
+        if path not in _known_assets:
+            if not os.path.exists(path):
+                os.makedirs(asset_dir, exist_ok=True)
+                # 先写临时文件再原子替换，多个进程同时写入也不会读到半个文件
+                fd, tmp_path = tempfile.mkstemp(dir=asset_dir, prefix=".tmp-")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            _known_assets.add(path)
+    return path
+
+
+def write_asset_chunks(asset_dir: str, chunks: Iterable[bytes | str], suffix: str, prefix: str = "") -> tuple:
+    """与 write_asset 相同，但逐块写入并计算哈希，适合不便整体放在内存中的大文件
+
+    Returns:
+        (资源文件路径, 字节数)
+    """
+    os.makedirs(asset_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=asset_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        path = os.path.join(asset_dir, f"{prefix}{digest.hexdigest()[:16]}{suffix}")
+        if path in _known_assets or os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        _known_assets.add(path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, size
+
+
+def relative_url(path: str, from_file: str) -> str:
+    """计算从 HTML 文件到资源文件的相对 URL"""
+    start = os.path.dirname(os.path.abspath(from_file))
+    return os.path.relpath(os.path.abspath(path), start).replace(os.sep, "/")
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+from typing import Any, Iterator
+
+from .compression import SUFFIXES, open_file, split_name
+
+
+def message_record(role: str, content: Any, name: str = None, model: str = None) -> dict:
+    """把 append_message 的参数规范化为一条紧凑的消息记录
+
+    用户消息附带的 tools 和助手消息的工具调用拆成独立字段，空字段不写入
+
+    Args:
+        role: 消息角色
+        content: 与 HtmlGenerator.append_message 相同格式的消息内容
+        name: 消息名称
+        model: 生成该消息的模型
+
+    Returns:
+        消息记录字典
+    """
+    record = {"type": "message", "ts": round(time.time(), 3), "role": role}
+    tools = None
+    tool_calls = None
+
+    if isinstance(content, dict):
+        if role == "user" or role == "system":
+            if "text" in content:
+                tools = content.get("tools")
+                content = content.get("text", "")
+        else:
+            tool_calls = [
+                {"name": tool_call["function_name"], "arguments": tool_call["function_args"]}
+                for tool_call in content.get("tool_calls") or []
+            ]
+            content = content.get("content", content.get("response", ""))
+
+    record["content"] = content
+    if name:
+        record["name"] = name
+    if model:
+        record["model"] = model
+    if tools:
+        record["tools"] = tools
+    if tool_calls:
+        record["tool_calls"] = tool_calls
+    return record
+
+
+def message_args(record: dict) -> tuple:
+    """把消息记录还原为 append_message 的 (role, content, name) 参数"""
+    role = record.get("role", "user")
+    content = record.get("content", "")
+    if record.get("tools"):
+        content = {"text": content, "tools": record["tools"]}
+    elif record.get("tool_calls"):
+        content = {
+            "response": content,
+            "tool_calls": [
+                {"function_name": tool_call.get("name", "unknown"), "function_args": tool_call.get("arguments", {})}
+                for tool_call in record["tool_calls"]
+            ],
+        }
+    return role, content, record.get("name")
+
+
+def tools_record(ref: str, tools: Any) -> dict:
+    """工具列表记录，同一文件中的消息通过 tools_ref 引用"""
+    return {"type": "tools", "ref": ref, "tools": tools}
+
+
+def divider_record(title: str, href: str = None) -> dict:
+    """分隔线记录"""
+    record = {"type": "divider", "ts": round(time.time(), 3), "title": title}
+    if href:
+        record["href"] = href
+    return record
+
+
+def dumps_record(record: dict) -> str:
+    """序列化为一行 JSON"""
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+
+
+def read_capture(capture_file: str) -> Iterator[dict]:
+    """逐行读取捕获文件，跳过无法解析的行（例如进程异常退出时写了一半的最后一行）
+
+    .gz 和 .zst 压缩文件会自动解压，压缩流被截断时读到截断处为止
+    """
+    with open_file(capture_file, "r") as f:
+        line_number = 0
+        try:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"跳过无法解析的记录 {capture_file}:{line_number}")
+        except EOFError:
+            print(f"压缩文件在第 {line_number} 行之后被截断: {capture_file}")
+
+
+def render_capture(capture_file: str, html_file: str = None, output_dir: str = None, **generator_options) -> str:
+    """把 JSONL 捕获文件渲染为与直接导出相同布局的 HTML 文件
+
+    Args:
+        capture_file: 捕获文件路径
+        html_file: 输出的 HTML 文件路径，默认与捕获文件同名、扩展名为 .html
+        output_dir: 共享资源所在的输出目录，默认为 HTML 文件所在目录
+        generator_options: 透传给 HtmlGenerator 的其他选项，例如 asset_mode、highlight_mode
+
+    Returns:
+        生成的 HTML 文件路径
+    """
+    from .html_generator import HtmlGenerator
+
+    if html_file is None:
+        html_file = split_name(capture_file)[0] + ".html"
+        if generator_options.get("compression") and generator_options.get("compress_mode", "stream") == "stream":
+            html_file += SUFFIXES[generator_options["compression"]]
+    generator_options["capture_format"] = "html"
+    generator_options.pop("async_write", None)
+
+    if output_dir is None:
+        output_dir = os.path.dirname(html_file) or "."
+
+    # 链接到的分叉或分卷文件同样会被渲染，扩展名与渲染结果一致（关闭时压缩的文件最终也带压缩扩展名）
+    link_suffix = ".html"
+    if generator_options.get("compression"):
+        link_suffix += SUFFIXES[generator_options["compression"]]
+    capture_suffixes = {".jsonl", *(".jsonl" + suffix for suffix in SUFFIXES.values())}
+
+    tools = {}
+    with HtmlGenerator(output_dir=output_dir, **generator_options) as generator:
+        generator.create_html_file(html_file)
+        for record in read_capture(capture_file):
+            if record.get("type") == "tools":
+                tools[record.get("ref")] = record.get("tools")
+            elif record.get("type") == "message":
+                if "tools_ref" in record:
+                    record["tools"] = tools.get(record["tools_ref"])
+                generator.append_message(*message_args(record))
+            elif record.get("type") == "divider":
+                href = record.get("href")
+                if href:
+                    stem, suffix = split_name(href)
+                    if suffix in capture_suffixes:
+                        href = stem + link_suffix
+                generator.append_divider(record.get("title", ""), href)
+        generator.close_html_file()
+    return html_file
@@ -0,0 +1,238 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator, List
+
+from .capture import render_capture
+from .html_generator import recover_html_file
+from .compression import SUFFIXES, split_name
+from .search_index import INDEX_NAME, SearchIndex
+
+# 默认匹配未压缩和压缩过的捕获文件和 HTML 文件
+CAPTURE_PATTERNS = ("*.jsonl", *(f"*.jsonl{suffix}" for suffix in SUFFIXES.values()))
+HTML_PATTERNS = ("*.html", *(f"*.html{suffix}" for suffix in SUFFIXES.values()))
+
+
+def _iter_captures(input_dir: str, pattern: str = None, patterns: tuple = CAPTURE_PATTERNS) -> Iterator[Path]:
+    """递归查找输入目录下的捕获文件"""
+    for item in ([pattern] if pattern else patterns):
+        yield from (path for path in Path(input_dir).rglob(item) if path.is_file())
+
+
+def _is_up_to_date(capture_file: str, html_file: str) -> bool:
+    """HTML 文件存在且不早于捕获文件时跳过"""
+    try:
+        return os.stat(html_file).st_mtime_ns >= os.stat(capture_file).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _render_one(task: tuple) -> tuple:
+    """在工作进程中渲染一个捕获文件，返回 (状态, 读取的字节数)"""
+    capture_file, html_file, output_dir, force, generator_options = task
+    try:
+        if not force and _is_up_to_date(capture_file, html_file):
+            return "skipped", 0
+        os.makedirs(os.path.dirname(html_file) or ".", exist_ok=True)
+        # 先写临时文件再替换，中途被打断时不会留下比捕获文件更新的半个 HTML
+        tmp_file = f"{html_file}.{os.getpid()}.tmp"
+        try:
+            render_capture(capture_file, tmp_file, output_dir, **generator_options)
+            os.replace(tmp_file, html_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return "rendered", os.path.getsize(capture_file)
+    except Exception as e:
+        print(f"渲染 {capture_file} 时出错: {e}", file=sys.stderr)
+        return "failed", 0
+
+
+def _render_chunk(tasks: list) -> list:
+    """在工作进程中依次渲染一批捕获文件"""
+    return [_render_one(task) for task in tasks]
+
+
+def render_directory(
+        input_dir: str,
+        output_dir: str = None,
+        pattern: str = None,
+        jobs: int = None,
+        force: bool = False,
+        chunksize: int = 64,
+        **generator_options,
+) -> dict:
+    """用进程池把目录下的捕获文件批量渲染为 HTML
+
+    输出文件保持与输入目录相同的相对路径，扩展名改为 .html（指定 compression 时为 .html.gz 等），
+    external 模式的共享资源统一写入 output_dir/assets
+
+    Args:
+        input_dir: 捕获文件所在目录
+        output_dir: 输出目录，默认与捕获文件放在一起
+        pattern: 捕获文件的匹配模式，默认匹配 .jsonl 以及 .jsonl.gz、.jsonl.zst 压缩文件
+        jobs: 工作进程数，默认为 CPU 核数
+        force: 是否重新渲染已是最新的文件
+        chunksize: 每次发给工作进程的文件数，同时提交的批次数不超过工作进程数的 4 倍，
+            文件再多内存中也只保留这些批次
+        generator_options: 透传给 HtmlGenerator 的其他选项，例如 highlight_mode
+
+    Returns:
+        各状态的文件数、读取的字节数和耗时
+    """
+    output_dir = output_dir or input_dir
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = ".html"
+    if generator_options.get("compression"):
+        # 输出文件在临时路径写完后再替换，只能边写边压缩
+        generator_options["compress_mode"] = "stream"
+        suffix += SUFFIXES[generator_options["compression"]]
+
+    def tasks():
+        for capture_file in _iter_captures(input_dir, pattern):
+            relative = split_name(str(capture_file.relative_to(input_dir)))[0] + suffix
+            yield str(capture_file), os.path.join(output_dir, relative), output_dir, force, generator_options
+
+    stats = {"rendered": 0, "skipped": 0, "failed": 0, "bytes": 0}
+    start = time.perf_counter()
+    last_report = start
+    pending = tasks()
+    jobs = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # executor.map 会一次性提交所有任务，这里只让有限的批次在途，完成一批再补一批
+        max_in_flight = jobs * 4
+        in_flight = set()
+        while True:
+            while len(in_flight) < max_in_flight:
+                chunk = list(itertools.islice(pending, chunksize))
+                if not chunk:
+                    break
+                in_flight.add(executor.submit(_render_chunk, chunk))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for status, size in future.result():
+                    stats[status] += 1
+                    stats["bytes"] += size
+            now = time.perf_counter()
+            if now - last_report >= 10:
+                last_report = now
+                _report(stats, now - start)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def recover_directory(input_dir: str, pattern: str = None) -> int:
+    """为目录下异常退出时没有写完的 HTML 文件补上页面结尾，返回修复的文件数"""
+    recovered = 0
+    for html_file in _iter_captures(input_dir, pattern, HTML_PATTERNS):
+        try:
+            if recover_html_file(str(html_file)):
+                recovered += 1
+                print(f"已修复: {html_file}")
+        except Exception as e:
+            print(f"修复 {html_file} 时出错: {e}", file=sys.stderr)
+    return recovered
+
+
+def _report(stats: dict, seconds: float) -> None:
+    """打印进度和吞吐量"""
+    seconds = max(seconds, 1e-9)
+    total = stats["rendered"] + stats["skipped"] + stats["failed"]
+    print(f"已处理 {total} 个文件（渲染 {stats['rendered']}，跳过 {stats['skipped']}，失败 {stats['failed']}），"
+          f"耗时 {seconds:.1f}s，{stats['rendered'] / seconds:.1f} 文件/s，"
+          f"{stats['bytes'] / seconds / 1024 / 1024:.2f} MB/s")
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ai-chat-html-exporter", description="AI 对话记录导出工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    render = subparsers.add_parser("render", help="把 JSONL 捕获文件批量渲染为 HTML")
+    render.add_argument("input_dir", help="捕获文件所在目录，会递归查找")
+    render.add_argument("-o", "--output-dir", help="输出目录，默认与捕获文件放在一起")
+    render.add_argument("-p", "--pattern", help="捕获文件的匹配模式，默认匹配 *.jsonl、*.jsonl.gz 和 *.jsonl.zst")
+    render.add_argument("-j", "--jobs", type=int, help="工作进程数，默认为 CPU 核数")
+    render.add_argument("-f", "--force", action="store_true", help="重新渲染已是最新的文件")
+    render.add_argument("--chunksize", type=int, default=64, help="每次发给工作进程的文件数")
+    render.add_argument("--asset-mode", choices=("inline", "external"), default="inline",
+                        help="样式和脚本的输出方式")
+    render.add_argument("--highlight-mode", choices=("cdn", "local", "server"), default="cdn",
+                        help="代码高亮方式")
+    render.add_argument("--image-mode", choices=("inline", "extract"), default="inline",
+                        help="Base64 图片的输出方式")
+    render.add_argument("--render-mode", choices=("dom", "lazy"), default="dom",
+                        help="页面渲染方式，lazy 在浏览器滚动到附近时才生成消息")
+    render.add_argument("--max-payload-chars", type=int,
+                        help="单段内容超过该字符数时只渲染开头部分，完整内容写入 assets 目录")
+    render.add_argument("--compression", choices=tuple(SUFFIXES), help="输出文件的压缩格式，默认不压缩")
+
+    recover = subparsers.add_parser("recover", help="为异常退出时没有写完的 HTML 文件补上页面结尾")
+    recover.add_argument("input_dir", help="HTML 文件所在目录，会递归查找")
+    recover.add_argument("-p", "--pattern", help="HTML 文件的匹配模式，默认匹配 *.html、*.html.gz 和 *.html.zst")
+
+    search = subparsers.add_parser("search", help="在开启 search_index 的输出目录中检索消息")
+    search.add_argument("output_dir", help="日志输出目录，其中的 search.db 为检索索引")
+    search.add_argument("query", nargs="+", help="检索词，多个词需要同时出现")
+    search.add_argument("-n", "--limit", type=int, default=20, help="最多显示的条数")
+    search.add_argument("--role", help="只显示该角色的消息，例如 user、assistant")
+    search.add_argument("--model", help="只显示该模型的消息")
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = _build_parser().parse_args(argv)
+
+    if args.command == "render":
+        if not os.path.isdir(args.input_dir):
+            print(f"目录不存在: {args.input_dir}", file=sys.stderr)
+            return 1
+        stats = render_directory(
+            args.input_dir,
+            args.output_dir,
+            pattern=args.pattern,
+            jobs=args.jobs,
+            force=args.force,
+            chunksize=args.chunksize,
+            asset_mode=args.asset_mode,
+            highlight_mode=args.highlight_mode,
+            image_mode=args.image_mode,
+            compression=args.compression,
+            render_mode=args.render_mode,
+            max_payload_chars=args.max_payload_chars,
+        )
+        _report(stats, stats["seconds"])
+        return 1 if stats["failed"] else 0
+
+    if args.command == "recover":
+        if not os.path.isdir(args.input_dir):
+            print(f"目录不存在: {args.input_dir}", file=sys.stderr)
+            return 1
+        print(f"共修复 {recover_directory(args.input_dir, args.pattern)} 个文件")
+
+    if args.command == "search":
+        index_file = os.path.join(args.output_dir, INDEX_NAME)
+        if not os.path.isfile(index_file):
+            print(f"索引不存在: {index_file}", file=sys.stderr)
+            return 1
+        index = SearchIndex(index_file)
+        start = time.perf_counter()
+        hits = index.search(" ".join(args.query), args.limit, args.role, args.model)
+        seconds = time.perf_counter() - start
+        index.close()
+        # 每条结果的文件路径和字节偏移可以直接用于定位，例如 tail -c +$((offset + 1)) 文件
+        for hit in hits:
+            labels = " ".join(filter(None, [hit["role"], hit["model"], ",".join(hit["tools"])]))
+            print(f"{hit['file']}:{hit['offset']}+{hit['length']}  [{labels}]  {hit['snippet']}")
+        print(f"共 {len(hits)} 条结果，耗时 {seconds * 1000:.1f} ms", file=sys.stderr)
+        return 0 if hits else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from typing import IO, Optional, Tuple
+
+# 压缩格式对应的扩展名
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+_FORMATS = {suffix: compression for compression, suffix in SUFFIXES.items()}
+
+
+def _zstd():
+    """按需导入可选依赖 zstandard"""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd 压缩需要安装 zstandard: pip install zstandard") from None
+    return zstandard
+
+
+def compression_of(path: str) -> Optional[str]:
+    """根据扩展名判断文件的压缩格式，未压缩时返回 None"""
+    return _FORMATS.get(os.path.splitext(path)[1])
+
+
+def split_name(path: str) -> Tuple[str, str]:
+    """拆分文件名和扩展名，压缩文件的扩展名包含原来的扩展名，例如 ("a/b", ".html.gz")"""
+    stem, suffix = os.path.splitext(path)
+    if suffix in _FORMATS:
+        stem, inner = os.path.splitext(stem)
+        suffix = inner + suffix
+    return stem, suffix
+
+
+def open_file(path: str, mode: str = "rb", compression: str = None, level: int = None) -> IO:
+    """打开可能经过压缩的文件
+
+    读取时按扩展名自动识别压缩格式；以追加方式写入压缩文件时会新增一个压缩成员（gzip member 或 zstd frame），
+    读取时会按顺序拼接，因此可以多次打开同一个文件继续写入。文本模式使用 UTF-8 编码
+
+    Args:
+        path: 文件路径
+        mode: "rb"、"wb"、"ab" 或对应的文本模式 "r"、"w"、"a"
+        compression: 压缩格式，"gzip" 或 "zstd"，默认按扩展名判断
+        level: 压缩级别，默认使用各格式的默认级别
+
+    Returns:
+        文件对象
+    """
+    if compression is None:
+        compression = compression_of(path)
+    binary_mode = mode[0] + "b"
+    if compression is None:
+        handle = open(path, binary_mode)
+    elif compression == "gzip":
+        handle = gzip.open(path, binary_mode, compresslevel=9 if level is None else level)
+    elif compression == "zstd":
+        zstandard = _zstd()
+        raw = open(path, binary_mode)
+        if binary_mode == "rb":
+            handle = io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True))
+        else:
+            handle = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw, closefd=True)
+    else:
+        raise ValueError(f"不支持的压缩格式: {compression}")
+
+    if "b" not in mode:
+        return io.TextIOWrapper(handle, encoding="utf-8")
+    return handle
+
+
+def compress_file(path: str, compression: str = "gzip", level: int = None) -> str:
+    """把文件压缩为同名加压缩扩展名的文件并删除原文件，保留原来的修改时间和权限
+
+    先写入临时文件再替换，中途失败时原文件保持不变。临时文件名各不相同，
+    共用输出目录的多个进程同时压缩同一个文件时不会写进同一个临时文件
+
+    Returns:
+        压缩后的文件路径
+    """
+    target = path + SUFFIXES[compression]
+    stat = os.stat(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(target) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(target) or ".")
+    os.close(fd)
+    try:
+        with open(path, "rb") as src, open_file(tmp_path, "wb", compression, level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        # mkstemp 创建的文件只有所有者可读写，改回原文件的权限
+        os.chmod(tmp_path, stat.st_mode & 0o777)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    os.remove(path)
+    return target
@@ -0,0 +1,229 @@
+import html
+import re
+
+# 语言别名
+_ALIASES = {
+    "js": "javascript",
+    "jsx": "javascript",
+    "ts": "javascript",
+    "typescript": "javascript",
+    "tsx": "javascript",
+    "py": "python",
+    "python3": "python",
+    "sh": "bash",
+    "shell": "bash",
+    "zsh": "bash",
+    "console": "bash",
+    "xml": "html",
+    "htm": "html",
+    "svg": "html",
+}
+
+# 正则分组名不能包含连字符，这里映射回 highlight.js 的类名
+_CLASS_NAMES = {"selector_class": "selector-class"}
+
+_STRING = r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\''
+_NUMBER = r'\b(?:0[xX][0-9a-fA-F]+|\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\b'
+
+
+def _words(words: str) -> str:
+    return r'\b(?:' + '|'.join(words.split()) + r')\b'
+
+
+def _compile(*rules: tuple) -> re.Pattern:
+    """把 (高亮类名, 正则) 列表合并成一个带命名分组的正则，靠前的规则优先"""
+    return re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in rules), re.S)
+
+
+_PATTERNS = {
+    "json": _compile(
+        ("attr", r'"(?:[^"\\]|\\.)*"(?=\s*:)'),
+        ("string", r'"(?:[^"\\]|\\.)*"'),
+        ("number", r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'),
+        ("literal", _words("true false null")),
+        ("punctuation", r'[{}\[\],:]'),
+    ),
+    "python": _compile(
+        ("comment", r'#[^\n]*'),
+        ("string", r'"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|' + _STRING),
+        ("number", _NUMBER),
+        ("literal", _words("True False None")),
+        ("keyword", _words(
+            "and as assert async await break class continue def del elif else except finally for from global "
+            "if import in is lambda nonlocal not or pass raise return try while with yield match case")),
+        ("built_in", _words("print len range str int float dict list set tuple open isinstance super self")),
+    ),
+    "javascript": _compile(
+        ("comment", r'//[^\n]*|/\*[\s\S]*?\*/'),
+        ("string", r'`(?:[^`\\]|\\.)*`|' + _STRING),
+        ("number", _NUMBER),
+        ("literal", _words("true false null undefined NaN")),
+        ("keyword", _words(
+            "async await break case catch class const continue default delete do else export extends finally for "
+            "from function if import in instanceof interface let new of return static switch this throw try type "
+            "typeof var void while yield")),
+        ("built_in", _words("console document window JSON Math Object Array Promise")),
+    ),
+    "bash": _compile(
+        ("comment", r'(?<![\w$])#[^\n]*'),
+        ("string", _STRING),
+        ("variable", r'\$\{[^}\n]*\}|\$\w+'),
+        ("keyword", _words("if then else elif fi for while do done case esac in function return export local")),
+        ("built_in", _words("echo cd ls cat grep sed awk pip python npm git curl sudo rm cp mv mkdir")),
+    ),
+    "css": _compile(
+        ("comment", r'/\*[\s\S]*?\*/'),
+        ("string", _STRING),
+        ("selector_class", r'\.[A-Za-z_][\w-]*(?=[^;{}]*\{)'),
+        ("attribute", r'[A-Za-z-]+(?=\s*:)'),
+        ("number", r'-?\d+(?:\.\d+)?(?:px|em|rem|%|vh|vw|s|ms)?'),
+    ),
+    "html": _compile(
+        ("comment", r'<!--[\s\S]*?-->'),
+        ("string", _STRING),
+        ("tag", r'</?[A-Za-z][\w:-]*|/?>'),
+    ),
+}
+
+# 离线模式下代替 CDN 主题的配色
+HIGHLIGHT_STYLE = """
+                /* 离线代码高亮配色 */
+                .hljs-comment {
+                    color: #6a737d;
+                    font-style: italic;
+                }
+
+                .hljs-keyword,
+                .hljs-tag {
+                    color: #d73a49;
+                }
+
+                .hljs-built_in,
+                .hljs-selector-class {
+                    color: #6f42c1;
+                }
+
+                .hljs-variable {
+                    color: #e36209;
+                }
+"""
+
+# 写入 output_dir 的精简高亮脚本，提供与 highlight.js 相同的 configure/highlightElement/highlightAll 接口
+LOCAL_HIGHLIGHT_SCRIPT = r"""(function () {
+    function words(list) {
+        return '\\b(?:' + list.split(' ').join('|') + ')\\b';
+    }
+    var STRING = '"(?:[^"\\\\\\n]|\\\\.)*"|\'(?:[^\'\\\\\\n]|\\\\.)*\'';
+    var NUMBER = '\\b(?:0[xX][0-9a-fA-F]+|\\d+(?:\\.\\d+)?(?:[eE][+-]?\\d+)?)\\b';
+    var RULES = {
+        json: [
+            ['attr', '"(?:[^"\\\\]|\\\\.)*"(?=\\s*:)'],
+            ['string', '"(?:[^"\\\\]|\\\\.)*"'],
+            ['number', '-?\\d+(?:\\.\\d+)?(?:[eE][+-]?\\d+)?'],
+            ['literal', words('true false null')],
+            ['punctuation', '[{}\\[\\],:]']
+        ],
+        python: [
+            ['comment', '#[^\\n]*'],
+            ['string', '"{3}[\\s\\S]*?"{3}|\'{3}[\\s\\S]*?\'{3}|' + STRING],
+            ['number', NUMBER],
+            ['literal', words('True False None')],
+            ['keyword', words('and as assert async await break class continue def del elif else except finally for from global if import in is lambda nonlocal not or pass raise return try while with yield')]
+        ],
+        javascript: [
+            ['comment', '//[^\\n]*|/\\*[\\s\\S]*?\\*/'],
+            ['string', '`(?:[^`\\\\]|\\\\.)*`|' + STRING],
+            ['number', NUMBER],
+            ['literal', words('true false null undefined NaN')],
+            ['keyword', words('async await break case catch class const continue default delete do else export extends finally for from function if import in instanceof let new of return static switch this throw try typeof var void while yield')]
+        ],
+        bash: [
+            ['comment', '#[^\\n]*'],
+            ['string', STRING],
+            ['variable', '\\$\\{[^}\\n]*\\}|\\$\\w+'],
+            ['keyword', words('if then else elif fi for while do done case esac in function return export local')]
+        ]
+    };
+    var ALIASES = {js: 'javascript', ts: 'javascript', typescript: 'javascript', py: 'python', sh: 'bash', shell: 'bash'};
+    var compiled = {};
+
+    function escapeHtml(text) {
+        return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    }
+
+    function compile(language) {
+        if (!(language in compiled)) {
+            var rules = RULES[language];
+            compiled[language] = rules ? {
+                names: rules.map(function (rule) { return rule[0]; }),
+                regex: new RegExp(rules.map(function (rule) { return '(' + rule[1] + ')'; }).join('|'), 'g')
+            } : null;
+        }
+        return compiled[language];
+    }
+
+    function highlight(text, language) {
+        var spec = compile(ALIASES[language] || language);
+        if (!spec) {
+            return escapeHtml(text);
+        }
+        var out = '', last = 0, match;
+        spec.regex.lastIndex = 0;
+        while ((match = spec.regex.exec(text)) !== null) {
+            if (match[0] === '') {
+                spec.regex.lastIndex++;
+                continue;
+            }
+            var index = 1;
+            while (match[index] === undefined) {
+                index++;
+            }
+            out += escapeHtml(text.slice(last, match.index)) +
+                '<span class="hljs-' + spec.names[index - 1] + '">' + escapeHtml(match[0]) + '</span>';
+            last = match.index + match[0].length;
+        }
+        return out + escapeHtml(text.slice(last));
+    }
+
+    function languageOf(element, text) {
+        var match = /(?:^|\s)language-([\w-]+)/.exec(element.className);
+        if (match) {
+            return match[1];
+        }
+        return /^\s*[\[{]/.test(text) ? 'json' : 'plaintext';
+    }
+
+    window.hljs = {
+        configure: function () {},
+        highlightElement: function (element) {
+            var text = element.textContent;
+            element.innerHTML = highlight(text, languageOf(element, text));
+            element.classList.add('hljs');
+            element.dataset.highlighted = 'yes';
+        },
+        highlightAll: function () {
+            document.querySelectorAll('pre code:not([data-highlighted])').forEach(window.hljs.highlightElement);
+        }
+    };
+})();
+"""
+
+
+def highlight(code: str, language: str) -> str:
+    """在服务端高亮一段原始代码，返回转义后的 HTML，不认识的语言只做转义"""
+    language = language.lower()
+    pattern = _PATTERNS.get(_ALIASES.get(language, language))
+    if pattern is None:
+        return html.escape(code)
+
+    result = []
+    last = 0
+    for match in pattern.finditer(code):
+        if match.start() == match.end():
+            continue
+        result.append(html.escape(code[last:match.start()]))
+        css_class = _CLASS_NAMES.get(match.lastgroup, match.lastgroup)
+        result.append(f'<span class="hljs-{css_class}">{html.escape(match.group())}</span>')
+        last = match.end()
+    result.append(html.escape(code[last:]))
+    return ''.join(result)
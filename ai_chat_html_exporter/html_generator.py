@@ -1,37 +1,32 @@
+import asyncio
+import atexit
+import base64
+import binascii
+import functools
 import html
+import itertools
 import json
 import os
-import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any, List, Dict
+from typing import Any, Callable, Dict, Iterable, List
 
+from .assets import content_hash, relative_url, write_asset, write_asset_chunks
+from .compression import SUFFIXES, compress_file, compression_of, open_file, split_name
+from .capture import divider_record, dumps_record, message_record, tools_record
+from .metrics import MetricsHook
+from .highlighter import HIGHLIGHT_STYLE, LOCAL_HIGHLIGHT_SCRIPT, highlight as highlight_code
+from .renderer import render_text
+from .retention import start_retention
+from .search_index import open_index
+from .writer import BackgroundWriter
 
-class HtmlGenerator:
-    """HTML 生成和导出工具，可复用于不同的日志收集场景"""
-    
-    def __init__(self, output_dir: str = "logs"):
-        """初始化 HTML 生成器
-        
-        Args:
-            output_dir: 输出目录，默认为 "logs"
-        """
-        self.output_dir = output_dir
-        self.html_file = None
-        
-        # 确保输出目录存在
-        Path(output_dir).mkdir(exist_ok=True)
-    
-    def create_html_file(self) -> str:
-        """创建新的 HTML 文件并添加基本样式"""
-        html_content = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>AI对话历史</title>
-            <style>
-                :root {
+# 对话页面的样式表，inline 模式内联到每个文件，external 模式写入共享资源文件
+_HTML_STYLE = """                :root {
                     --color-text: #1a1a1a;
                     --color-background: #ffffff;
                     --color-accent: #0070f3;
@@ -232,6 +227,12 @@ class HtmlGenerator:
                     color: #666;
                 }
 
+                .payload-truncated {
+                    margin: 6px 0;
+                    font-size: 0.85em;
+                    color: #6b7280;
+                }
+
                 .tool-call-container {
                     margin: 14px 0;
                     border-radius: var(--radius-sm);
@@ -470,15 +471,10 @@ class HtmlGenerator:
                 .hljs-punctuation {
                     color: #9e9e9e;
                 }
-            </style>
-            <!-- Inter 字体 -->
-            <link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap">
-            <!-- 代码高亮库 -->
-            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/styles/github.min.css">
-            <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/highlight.min.js"></script>
-            <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/languages/json.min.js"></script>
-            <script>
-            document.addEventListener('DOMContentLoaded', function() {
+"""
+
+# 工具弹出层、空消息样式和代码高亮的页面脚本
+_HTML_SCRIPT = """            document.addEventListener('DOMContentLoaded', function() {
                 // 全局弹出层，只创建一次
                 const popupContainer = document.createElement('div');
                 popupContainer.className = 'tools-popup';
@@ -513,8 +509,12 @@ class HtmlGenerator:
                     const toolsData = message.querySelector('.tools-data');
                     
                     if (toolsData) {
-                        // 获取工具数据
-                        const toolsJson = toolsData.getAttribute('data-tools');
+                        // 获取工具数据，data-tools-ref 指向页面中按哈希存放的工具列表
+                        let toolsJson = toolsData.getAttribute('data-tools');
+                        if (toolsData.dataset.toolsRef) {
+                            const schema = document.getElementById('tools-' + toolsData.dataset.toolsRef);
+                            toolsJson = schema ? JSON.stringify(JSON.parse(schema.textContent), null, 2) : '';
+                        }
                         
                         // 填充弹出层内容
                         const codeElement = popupContainer.querySelector('code');
@@ -585,57 +585,352 @@ class HtmlGenerator:
                     }
                 });
                 
-                // 初始化现有图标
-                initToolsIcons();
-                
-                // 使用MutationObserver监听DOM变化，处理动态添加的工具图标
-                const observer = new MutationObserver(function(mutations) {
-                    let hasNewIcons = false;
-                    
-                    mutations.forEach(function(mutation) {
-                        if (mutation.type === 'childList') {
-                            const icons = mutation.target.querySelectorAll('.tools-icon:not([data-initialized])');
-                            if (icons.length > 0) {
-                                hasNewIcons = true;
-                            }
-                        }
-                    });
-                    
-                    if (hasNewIcons) {
-                        initToolsIcons();
-                    }
-                });
-                
-                // 开始观察DOM变化
-                observer.observe(document.getElementById('conversation'), { 
-                    childList: true, 
-                    subtree: true 
-                });
-                
-                // 初始化时检查所有用户消息内容高度
-                setTimeout(() => {
-                    document.querySelectorAll('.message.user').forEach(message => {
+                // 初始化一批消息：工具图标、空消息的样式，以及进入视口时才执行的代码高亮
+                function initMessages(root) {
+                    initToolsIcons();
+                    root.querySelectorAll('.message.user').forEach(message => {
                         // 移除空格、换行符等空白字符，检查消息是否为空
                         const text = message.textContent.trim();
                         if (!text || text.length === 0) {
                             message.style.padding = '5px 20px';
                         }
                     });
-                    
-                    // 确保所有图标都已初始化
-                    initToolsIcons();
-                }, 100);
+                    root.querySelectorAll('pre code:not([data-highlighted])').forEach(code => {
+                        if (highlightObserver) {
+                            highlightObserver.observe(code);
+                        } else if (window.hljs) {
+                            hljs.highlightElement(code);
+                        }
+                    });
+                }
                 
-                // 初始化代码高亮
+                // 代码块接近视口时再高亮，长对话打开时不必一次高亮所有代码
                 if (window.hljs) {
                     hljs.configure({
                         languages: ['json', 'javascript', 'python', 'bash', 'html', 'css'],
                         ignoreUnescapedHTML: true
                     });
-                    hljs.highlightAll();
                 }
+                const highlightObserver = window.hljs && 'IntersectionObserver' in window
+                    ? new IntersectionObserver(function(entries) {
+                        entries.forEach(entry => {
+                            if (entry.isIntersecting) {
+                                highlightObserver.unobserve(entry.target);
+                                if (!entry.target.dataset.highlighted) {
+                                    hljs.highlightElement(entry.target);
+                                }
+                            }
+                        });
+                    }, { rootMargin: '600px 0px' })
+                    : null;
+                
+                // 初始化页面中已有的消息，按需渲染的消息块在渲染后发出 chat:rendered 事件
+                initMessages(document);
+                document.addEventListener('chat:rendered', function(e) {
+                    initMessages(e.target);
+                });
+            });
+"""
+
+# 按需渲染模式下的消息加载脚本：消息以 JSON 字符串存放在 script 标签中，每 50 条组成一块，
+# 块接近视口时才生成 DOM，远离视口后换回相同高度的占位，同时只有少量消息参与布局
+_LAZY_SCRIPT = """            document.addEventListener('DOMContentLoaded', function() {
+                const BLOCK_SIZE = 50;
+                const ESTIMATED_HEIGHT = 150;
+                const chunks = Array.from(document.querySelectorAll('#conversation > script.message-chunk'));
+                const blocks = [];
+                for (let i = 0; i < chunks.length; i += BLOCK_SIZE) {
+                    const block = document.createElement('div');
+                    block.className = 'message-block';
+                    block.chunks = chunks.slice(i, i + BLOCK_SIZE);
+                    block.style.minHeight = `${block.chunks.length * ESTIMATED_HEIGHT}px`;
+                    chunks[i].before(block);
+                    blocks.push(block);
+                }
+                
+                function render(block) {
+                    if (block.rendered) {
+                        return;
+                    }
+                    block.rendered = true;
+                    block.innerHTML = block.chunks.map(chunk => JSON.parse(chunk.textContent)).join('');
+                    block.style.minHeight = '';
+                    block.dispatchEvent(new CustomEvent('chat:rendered', { bubbles: true }));
+                }
+                
+                function release(block) {
+                    if (!block.rendered || block.contains(document.activeElement)) {
+                        return;
+                    }
+                    // 保持原来的高度，滚动位置不会跳动
+                    block.style.minHeight = `${block.offsetHeight}px`;
+                    block.innerHTML = '';
+                    block.rendered = false;
+                }
+                
+                if (!('IntersectionObserver' in window)) {
+                    blocks.forEach(render);
+                    return;
+                }
+                const observer = new IntersectionObserver(function(entries) {
+                    entries.forEach(entry => entry.isIntersecting ? render(entry.target) : release(entry.target));
+                }, { rootMargin: '1500px 0px' });
+                blocks.forEach(block => observer.observe(block));
             });
-            </script>
+"""
+
+# 页面结尾，未压缩的文件每次刷盘时都写在数据之后，下一次写入从它的起始位置覆盖，磁盘上的文件始终是完整的页面
+_HTML_TRAILER = b"""
+            </div>
+        </body>
+        </html>
+        """
+
+# 超长内容写入独立文件时每次编码的字符数
+_SPILL_CHUNK_CHARS = 256 * 1024
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+
+# 同一进程内生成文件名的序号，同一纳秒内创建的文件也不会重名
+_file_counter = itertools.count()
+
+# 持有打开文件句柄的生成器，进程退出时统一刷盘
+_open_generators = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_generators():
+    for generator in list(_open_generators):
+        try:
+            generator.flush()
+        except Exception as e:
+            print(f"退出时刷新日志文件出错: {e}")
+
+
+def open_file_paths() -> set:
+    """当前进程中仍在写入的文件路径"""
+    return {generator._handle_path for generator in list(_open_generators) if generator._handle_path}
+
+
+def _content_end(handle) -> int:
+    """页面结尾之前的数据长度，文件没有以结尾结束时（例如进程异常退出）为文件长度"""
+    size = handle.seek(0, os.SEEK_END)
+    if size >= len(_HTML_TRAILER):
+        handle.seek(size - len(_HTML_TRAILER))
+        if handle.read(len(_HTML_TRAILER)) == _HTML_TRAILER:
+            return size - len(_HTML_TRAILER)
+    return size
+
+
+def recover_html_file(html_file: str) -> bool:
+    """修复异常退出时没有写完的 HTML 文件，补上页面结尾
+
+    压缩文件会解压到截断处为止，补上结尾后重新压缩。正在被当前进程写入的文件不处理
+
+    Returns:
+        是否修改了文件
+    """
+    if html_file in open_file_paths():
+        return False
+    compression = compression_of(html_file)
+    if compression is None:
+        with open(html_file, "r+b") as f:
+            if _content_end(f) != f.seek(0, os.SEEK_END):
+                return False
+            f.write(_HTML_TRAILER)
+        return True
+
+    data = bytearray()
+    truncated = False
+    with open_file(html_file, "rb") as f:
+        try:
+            while chunk := f.read(1024 * 1024):
+                data += chunk
+        except Exception:
+            # 压缩流被截断，保留已经解压出的部分
+            truncated = True
+    if not truncated and data.endswith(_HTML_TRAILER):
+        return False
+    tmp_file = f"{html_file}.{os.getpid()}.tmp"
+    try:
+        with open_file(tmp_file, "wb", compression) as f:
+            f.write(data)
+            if not data.endswith(_HTML_TRAILER):
+                f.write(_HTML_TRAILER)
+        os.replace(tmp_file, html_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return True
+
+
+class HtmlGenerator:
+    """HTML 生成和导出工具，可复用于不同的日志收集场景"""
+    
+    def __init__(
+            self,
+            output_dir: str = "logs",
+            async_write: bool = False,
+            queue_size: int = 1000,
+            full_policy: str = "block",
+            flush_bytes: int = 64 * 1024,
+            flush_interval: float = 1.0,
+            asset_mode: str = "inline",
+            highlight_mode: str = "cdn",
+            capture_format: str = "html",
+            image_mode: str = "inline",
+            shard_by: str = None,
+            rotate_bytes: int = None,
+            rotate_messages: int = None,
+            retention: dict = None,
+            compression: str = None,
+            compress_mode: str = "stream",
+            render_mode: str = "dom",
+            max_payload_chars: int = None,
+            metrics: MetricsHook = None,
+            search_index: bool = False,
+    ):
+        """初始化 HTML 生成器
+        
+        Args:
+            output_dir: 输出目录，默认为 "logs"
+            async_write: 是否由后台线程负责渲染和写入，调用线程只负责入队
+            queue_size: 后台写入队列的容量
+            full_policy: 队列满时的策略，可选 "block"、"drop"、"spill"，spill 的溢出缓冲区最多容纳 10 倍队列容量的任务，
+                再满时丢弃任务
+            flush_bytes: 缓冲区累计超过该字节数时刷盘
+            flush_interval: 距上次刷盘超过该秒数时，在下一次写入时刷盘
+            asset_mode: 样式和脚本的输出方式，"inline" 内联到每个文件，
+                "external" 以内容哈希命名写入 output_dir/assets 并在页面中引用
+            highlight_mode: 代码高亮方式，"cdn" 从 cdnjs 加载 highlight.js，
+                "local" 使用写入 output_dir/assets 的精简高亮脚本，
+                "server" 在渲染代码块时直接输出高亮结果，两种离线模式都不访问外部网络
+            capture_format: 记录格式，"html" 直接渲染为 HTML，
+                "jsonl" 只追加规范化的消息记录，需要查看时再用 render_capture 渲染
+            image_mode: Base64 图片的输出方式，"inline" 直接写入 img 标签，
+                "extract" 解码后以内容哈希命名写入 output_dir/assets，页面只引用文件路径
+            shard_by: 按时间划分子目录，"date" 写入 output_dir/YYYY-MM-DD，"hour" 写入 output_dir/YYYY-MM-DD/HH，
+                默认不划分
+            rotate_bytes: 单个文件中的消息超过该字节数后，之后的消息写入新的分卷文件，页面头部不计入，默认不分卷
+            rotate_messages: 单个文件超过该消息数后写入新的分卷文件，分卷之间互相链接
+            retention: 启用输出目录的后台清理，值为 RetentionPolicy 的参数，
+                例如 {"max_age": 7 * 86400, "max_total_bytes": 10 ** 9, "action": "compress"}
+            compression: 压缩格式，"gzip" 或 "zstd"（需要安装 zstandard），默认不压缩
+            compress_mode: 压缩方式，"stream" 追加消息时直接写入 .html.gz 等压缩文件，
+                "close" 照常写入，文件结束（切换到下一个文件或关闭生成器）后再压缩并删除原文件
+            render_mode: 页面渲染方式，"dom" 直接输出消息的 HTML，
+                "lazy" 把消息以 JSON 字符串写入页面，由浏览器在滚动到附近时才生成 DOM，适合上千条消息的长对话
+            max_payload_chars: 单段文本、字典内容或工具参数超过该字符数时，页面中只保留开头部分，
+                完整内容逐块写入 output_dir/assets 并在页面中链接，默认不截断。jsonl 记录格式不受影响
+            metrics: 指标回调，记录渲染、写入的耗时，写入字节数、队列深度和错误数，
+                例如 PrometheusMetrics()，默认不记录
+            search_index: 是否在 output_dir/search.db 中维护全文索引，每条消息写入时记录文件、字节偏移、角色、
+                模型、工具名称和文本，可以用命令行的 search 子命令检索
+        """
+        if asset_mode not in ("inline", "external"):
+            raise ValueError(f"不支持的资源模式: {asset_mode}")
+        if highlight_mode not in ("cdn", "local", "server"):
+            raise ValueError(f"不支持的代码高亮方式: {highlight_mode}")
+        if capture_format not in ("html", "jsonl"):
+            raise ValueError(f"不支持的记录格式: {capture_format}")
+        if image_mode not in ("inline", "extract"):
+            raise ValueError(f"不支持的图片模式: {image_mode}")
+        if shard_by not in (None, "date", "hour"):
+            raise ValueError(f"不支持的子目录划分方式: {shard_by}")
+        if compression not in (None, *SUFFIXES):
+            raise ValueError(f"不支持的压缩格式: {compression}")
+        if compress_mode not in ("stream", "close"):
+            raise ValueError(f"不支持的压缩方式: {compress_mode}")
+        if render_mode not in ("dom", "lazy"):
+            raise ValueError(f"不支持的渲染方式: {render_mode}")
+        self.output_dir = output_dir
+        self.html_file = None
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.asset_mode = asset_mode
+        self.highlight_mode = highlight_mode
+        self.capture_format = capture_format
+        self.image_mode = image_mode
+        self.shard_by = shard_by
+        self.rotate_bytes = rotate_bytes
+        self.rotate_messages = rotate_messages
+        self.compression = compression
+        self.compress_mode = compress_mode
+        self.render_mode = render_mode
+        self.max_payload_chars = max_payload_chars
+        self.metrics = metrics
+        # data URI 到图片文件的映射，以 (长度, 哈希) 为键，避免缓存整段 Base64 文本
+        self._extracted_images = {}
+        # 当前文件中已经写出的工具列表哈希，同一份工具列表每个文件只写一次
+        self._tools_file = None
+        self._tools_refs = set()
+        # 消息中的工具列表数据写在消息之外，按需渲染模式下消息未渲染时也能找到
+        self._pending_schemas = []
+        self._writer = BackgroundWriter(queue_size, full_policy, metrics=metrics) if async_write else None
+        self._executor = None  # 异步接口使用的单线程执行器，第一次调用时创建
+        self._owns_writer = True
+        # 派生新文件时沿用的选项
+        self._options = dict(
+            flush_bytes=flush_bytes,
+            flush_interval=flush_interval,
+            asset_mode=asset_mode,
+            highlight_mode=highlight_mode,
+            capture_format=capture_format,
+            image_mode=image_mode,
+            shard_by=shard_by,
+            rotate_bytes=rotate_bytes,
+            rotate_messages=rotate_messages,
+            compression=compression,
+            compress_mode=compress_mode,
+            render_mode=render_mode,
+            max_payload_chars=max_payload_chars,
+            metrics=metrics,
+            search_index=search_index,
+        )
+        # 当前文件已写入的消息数，以及写入线程记录的 (文件, 页面头部之后写入的字节数)
+        self._file_messages = 0
+        self._file_bytes = (None, 0)
+        self._part = 1  # 当前分卷的序号
+        self._part_base = None  # 分卷文件名去掉扩展名的部分
+        self._sealed = False  # 当前文件关闭后不能再追加，下一次写入时切换到新的分卷
+        # 整个文件生命周期内复用同一个带缓冲的句柄
+        self._handle = None
+        self._handle_path = None
+        self._handle_lock = threading.Lock()
+        self._data_end = 0  # 当前文件中页面结尾之前的数据长度
+        self._released_path = None  # 暂时关闭了句柄、尚未完成结尾和压缩的文件
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+        
+        # 确保输出目录存在
+        Path(output_dir).mkdir(exist_ok=True)
+        self._index = open_index(output_dir) if search_index else None
+        if retention is not None:
+            start_retention(output_dir, **retention)
+    
+    def create_html_file(self, html_file: str = None) -> str:
+        """创建新的 HTML 文件并添加基本样式，jsonl 记录格式下创建空的捕获文件
+
+        Args:
+            html_file: 文件路径，默认在输出目录下生成唯一的文件名
+        """
+        if html_file is None:
+            html_file = self._new_file_path(self._file_suffix())
+        self._file_messages = 0
+        self._sealed = False
+
+        if self.capture_format == "jsonl":
+            self._dispatch_required(self._write_file, html_file, "", "w")
+            self.html_file = html_file
+            return html_file
+
+        html_content = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <title>AI对话历史</title>
+{self._render_head_assets(html_file)}
         </head>
         <body>
             <h1>AI对话历史</h1>
@@ -643,21 +938,303 @@ class HtmlGenerator:
         """
 
         # 创建新的HTML文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        html_file = os.path.join(self.output_dir, f"conversation_{timestamp}.html")
-
-        with open(html_file, "w", encoding="utf-8") as f:
-            f.write(html_content)
+        self._dispatch_required(self._write_file, html_file, html_content, "w")
 
         self.html_file = html_file
         return html_file
 
+    def _file_suffix(self) -> str:
+        """新文件的扩展名"""
+        suffix = ".jsonl" if self.capture_format == "jsonl" else ".html"
+        if self.compression and self.compress_mode == "stream":
+            suffix += SUFFIXES[self.compression]
+        return suffix
+
+    def _new_file_path(self, suffix: str, label: str = "") -> str:
+        """生成按时间排序且不会重名的文件路径，并以 O_EXCL 方式创建空文件占位
+
+        文件名由秒级时间、秒内纳秒、进程号和进程内序号组成，多个进程同时启动也不会写入同一个文件，
+        label 附加在序号之后，例如会话 ID
+        """
+        now_ns = time.time_ns()
+        now = datetime.fromtimestamp(now_ns / 1e9)
+        directory = self.output_dir
+        if self.shard_by == "date":
+            directory = os.path.join(directory, now.strftime("%Y-%m-%d"))
+        elif self.shard_by == "hour":
+            directory = os.path.join(directory, now.strftime("%Y-%m-%d"), now.strftime("%H"))
+        if directory != self.output_dir:
+            os.makedirs(directory, exist_ok=True)
+
+        while True:
+            name = (f"conversation_{now.strftime('%Y%m%d_%H%M%S')}_{now_ns % 1_000_000_000:09d}"
+                    f"_{os.getpid()}_{next(_file_counter)}{'_' + label if label else ''}{suffix}")
+            path = os.path.join(directory, name)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return path
+            except FileExistsError:
+                continue
+
+    def _asset_url(self, html_file: str, data: str, suffix: str, prefix: str = "chat-") -> str:
+        """写入共享资源文件并返回相对于 HTML 文件的 URL"""
+        path = write_asset(os.path.join(self.output_dir, "assets"), data, suffix, prefix=prefix)
+        return relative_url(path, html_file)
+
+    def _render_head_assets(self, html_file: str) -> str:
+        """生成 <head> 中的样式表和脚本"""
+        style_text = _HTML_STYLE if self.highlight_mode == "cdn" else _HTML_STYLE + HIGHLIGHT_STYLE
+        if self.asset_mode == "external":
+            style = f'<link rel="stylesheet" href="{self._asset_url(html_file, style_text, ".css")}">'
+        else:
+            style = f"<style>\n{style_text}            </style>"
+
+        if self.highlight_mode == "cdn":
+            libraries = """<!-- Inter 字体 -->
+            <link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap">
+            <!-- 代码高亮库 -->
+            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/styles/github.min.css">
+            <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/highlight.min.js"></script>
+            <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/languages/json.min.js"></script>"""
+        else:
+            # 离线模式不访问任何外部资源
+            libraries = f"""<!-- 本地代码高亮 -->
+            <script src="{self._asset_url(html_file, LOCAL_HIGHLIGHT_SCRIPT, ".js", prefix="hljs-")}"></script>"""
+
+        return f"""            {style}
+            {libraries}
+            {self._render_script_element(html_file)}"""
+
+    def _render_script_element(self, html_file: str) -> str:
+        """生成页面脚本标签，按需渲染模式下加载消息的脚本排在后面，先注册的 chat:rendered 监听能收到第一批消息"""
+        scripts = [_HTML_SCRIPT, _LAZY_SCRIPT] if self.render_mode == "lazy" else [_HTML_SCRIPT]
+        if self.asset_mode == "external":
+            return "\n            ".join(
+                f'<script src="{self._asset_url(html_file, script, ".js")}"></script>' for script in scripts)
+        return "\n            ".join(f"<script>\n{script}            </script>" for script in scripts)
+
+    def _dispatch(self, func: Callable, *args) -> None:
+        """执行渲染/写入任务，开启后台写入时交给写入线程"""
+        if self._writer:
+            accepted = self._writer.submit(func, *args)
+            if self.metrics is not None and not accepted:
+                self.metrics.increment("dropped")
+        else:
+            func(*args)
+
+    def _dispatch_required(self, func: Callable, *args) -> None:
+        """执行不可丢弃的任务，例如刷盘和关闭句柄"""
+        if self._writer:
+            self._writer.submit_required(func, *args)
+        else:
+            func(*args)
+
+    def _write_file(self, html_file: str, text: str, mode: str = "a", flush: bool = False) -> tuple:
+        """把文本写入指定文件，返回写入位置的 (字节偏移, 字节数)，压缩文件按解压后的内容计算
+
+        句柄在文件切换前一直保持打开，缓冲数据达到 flush_bytes 或距上次刷盘超过 flush_interval 时刷盘
+        """
+        data = text.encode("utf-8")
+        start = time.perf_counter() if self.metrics is not None else 0
+        with self._handle_lock:
+            if mode == "w" or self._handle_path != html_file:
+                if self._released_path == html_file:
+                    # 回到暂时释放的文件，直接重新打开
+                    self._released_path = None
+                self._finish_handle()
+                self._open_handle(html_file, mode)
+            offset = self._data_end
+            self._handle.write(data)
+            self._data_end += len(data)
+            self._unflushed_bytes += len(data)
+            path, size = self._file_bytes
+            if mode == "w":
+                # 新文件的页面头部（内联样式和脚本约 26KB）不计入分卷大小
+                self._file_bytes = (html_file, 0)
+            else:
+                self._file_bytes = (html_file, (size if path == html_file else 0) + len(data))
+            if (flush or self._unflushed_bytes >= self.flush_bytes
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_handle()
+        if self.metrics is not None:
+            self.metrics.observe("write", time.perf_counter() - start)
+            self.metrics.increment("bytes_written", len(data))
+        return offset, len(data)
+
+    def _has_trailer(self) -> bool:
+        """是否在每次刷盘时维护页面结尾，边写边压缩的文件无法回退，只在关闭时写入结尾"""
+        return self.capture_format == "html" and not (self.compression and self.compress_mode == "stream")
+
+    def _open_handle(self, html_file: str, mode: str) -> None:
+        """打开文件句柄，重新打开已有的 HTML 文件时定位到页面结尾之前"""
+        buffering = max(self.flush_bytes, 8192)
+        if self.compression and self.compress_mode == "stream":
+            # 追加方式重新打开时写入新的压缩成员，读取时会自动拼接
+            self._data_end = 0
+            if mode == "a" and os.path.exists(html_file):
+                # 偏移量按解压后的内容计算，重新打开已有的压缩文件时需要读一遍
+                with open_file(html_file, "rb") as existing:
+                    for chunk in iter(lambda: existing.read(1024 * 1024), b""):
+                        self._data_end += len(chunk)
+            self._handle = open_file(html_file, mode + "b", self.compression)
+        elif self._has_trailer():
+            # 追加模式会忽略 seek，需要以读写模式打开
+            if mode == "a" and os.path.exists(html_file):
+                self._handle = open(html_file, "r+b", buffering=buffering)
+                self._data_end = _content_end(self._handle)
+                self._handle.seek(self._data_end)
+            else:
+                self._handle = open(html_file, "w+b", buffering=buffering)
+                self._data_end = 0
+        else:
+            self._data_end = os.path.getsize(html_file) if mode == "a" and os.path.exists(html_file) else 0
+            self._handle = open(html_file, mode + "b", buffering=buffering)
+        self._handle_path = html_file
+        self._released_path = None
+        _open_generators.add(self)
+
+    def _flush_handle(self) -> None:
+        if self._handle:
+            if self._has_trailer():
+                # 写入结尾后回到结尾之前，下一次写入直接覆盖它
+                self._handle.write(_HTML_TRAILER)
+                self._handle.flush()
+                self._handle.seek(self._data_end)
+            else:
+                self._handle.flush()
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+
+    def _close_handle(self, final: bool = True) -> None:
+        """关闭句柄，final 为 False 时只是暂时释放，之后还会追加：不写入边写边压缩文件的结尾，也不压缩"""
+        if self._handle:
+            if self._has_trailer():
+                self._handle.write(_HTML_TRAILER)
+                # 覆盖写入的数据可能比原来的结尾短，截掉残留的部分
+                self._handle.truncate()
+            elif self.capture_format == "html" and final:
+                self._handle.write(_HTML_TRAILER)
+            self._handle.close()
+            _open_generators.discard(self)
+            if not final:
+                self._released_path = self._handle_path
+            elif self.compression and self.compress_mode == "close":
+                try:
+                    compress_file(self._handle_path, self.compression)
+                except Exception as e:
+                    print(f"压缩文件时出错: {e}")
+        self._handle = None
+        self._handle_path = None
+        self._unflushed_bytes = 0
+
+    def _sync_flush(self) -> None:
+        with self._handle_lock:
+            self._flush_handle()
+        if self._index is not None:
+            self._index.flush()
+
+    def _sync_release(self) -> None:
+        with self._handle_lock:
+            self._close_handle(final=False)
+
+    def _finish_handle(self) -> None:
+        """结束当前文件，暂时释放过的压缩文件还没有写入结尾或压缩，重新打开后正常关闭"""
+        if self._handle is None and self._released_path and self.compression:
+            self._open_handle(self._released_path, "a")
+        self._released_path = None
+        self._close_handle()
+
+    def _sync_close(self) -> None:
+        with self._handle_lock:
+            self._finish_handle()
+        if self._index is not None:
+            self._index.flush()
+
+    def flush(self, timeout: float = None) -> None:
+        """把缓冲区写入磁盘，开启后台写入时等待队列中的任务全部完成"""
+        self._dispatch_required(self._sync_flush)
+        if self._writer:
+            self._writer.flush(timeout)
+
+    def release_handle(self) -> None:
+        """暂时关闭文件句柄，释放文件描述符，下一次写入时重新打开并接着写入
+
+        不等待后台写入线程，也不会压缩文件，适合长时间不再写入但还没有结束的文件，例如切换走的分叉对话
+        """
+        if self.html_file:
+            self._dispatch_required(self._sync_release)
+
+    def close(self, timeout: float = None) -> None:
+        """刷盘并关闭文件句柄，开启后台写入时等待队列清空并停止写入线程
+
+        关闭时压缩的文件已经被替换为压缩文件，边写边压缩的 HTML 文件已经写入页面结尾，
+        两者关闭后都不能再追加，之后的消息写入下一个分卷
+        """
+        self._dispatch_required(self._sync_close)
+        if self.html_file and self.compression and (self.compress_mode == "close" or self.capture_format == "html"):
+            self._sealed = True
+        if self._writer and self._owns_writer:
+            self._writer.close(timeout)
+        elif self._writer:
+            self._writer.flush(timeout)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """异步接口的单线程执行器，同一个生成器的调用按提交顺序依次执行"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai-chat-html-async")
+        return self._executor
+
+    async def _run_async(self, func: Callable, *args) -> Any:
+        """在执行器线程中运行同步方法，事件循环只等待结果，不执行渲染和磁盘 IO"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+
+    async def aappend_message(self, role: str, content: Any, name: str = None, model: str = None) -> None:
+        """append_message 的异步版本"""
+        await self._run_async(self.append_message, role, content, name, model)
+
+    async def aappend_divider(self, title: str = "", href: str = None) -> None:
+        """append_divider 的异步版本"""
+        await self._run_async(self.append_divider, title, href)
+
+    async def aclose_html_file(self) -> None:
+        """close_html_file 的异步版本"""
+        await self._run_async(self.close_html_file)
+
+    async def aflush(self, timeout: float = None) -> None:
+        """flush 的异步版本"""
+        await self._run_async(self.flush, timeout)
+
+    async def aclose(self, timeout: float = None) -> None:
+        """close 的异步版本，完成后停止执行器线程"""
+        await self._run_async(self.close, timeout)
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def spawn(self) -> 'HtmlGenerator':
+        """创建一个写入新文件的生成器，沿用当前的选项并共享后台写入线程"""
+        generator = HtmlGenerator(self.output_dir, **self._options)
+        generator._writer = self._writer
+        generator._owns_writer = False
+        return generator
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _escape_html(self, text: str) -> str:
         """转义 HTML 特殊字符"""
         return html.escape(str(text))
 
-    def _process_content(self, content: Any) -> str:
-        """处理内容中的代码和图片"""
+    def _process_content(self, content: Any, html_file: str = None) -> str:
+        """处理内容中的代码和图片
+
+        Args:
+            content: 消息内容
+            html_file: 内容所写入的文件，用于计算提取出的图片的相对路径，默认为当前文件
+        """
         try:
             if not content:
                 return ''
@@ -671,15 +1248,14 @@ class HtmlGenerator:
                         if part.get('type') == 'image_url':
                             image_url = part.get('image_url', {}).get('url', '')
                             if image_url:
+                                if self.image_mode == "extract" and image_url.startswith("data:image/"):
+                                    image_url = self._extract_image(image_url, html_file)
                                 # 使用统一的图片处理格式
                                 processed_parts.append(f'<div class="image-container"><img src="{image_url}" alt="图片"></div>')
                         # 处理文本
                         elif part.get('type') == 'text':
-                            text = part.get('text', '')
-                            processed_text = self._escape_html(text)
-                            processed_text = self._detect_code_blocks(processed_text)
-                            processed_text = self._detect_inline_code(processed_text)
-                            processed_parts.append(processed_text)
+                            text, notice = self._limit_text(part.get('text', ''), html_file)
+                            processed_parts.append(self._render_text(text, detect_images=False, html_file=html_file) + notice)
                         else:
                             # 处理其他类型
                             processed_parts.append(self._escape_html(str(part)))
@@ -687,73 +1263,71 @@ class HtmlGenerator:
             
             # 处理字符串内容
             elif isinstance(content, str):
-                processed = self._escape_html(content)
-                processed = self._detect_code_blocks(processed)
                 # 对于普通字符串，保留图片检测，因为可能包含图片链接
-                processed = self._detect_images(processed)
-                processed = self._detect_inline_code(processed)
-                return f'<span class="content-text">{processed}</span>'
+                content, notice = self._limit_text(content, html_file)
+                processed = self._render_text(content, detect_images=True, html_file=html_file)
+                return f'<span class="content-text">{processed}</span>{notice}'
             
             # 处理带有text字段的字典内容（用于增强型用户消息）
             elif isinstance(content, dict) and 'text' in content:
                 text_content = content.get('text', '')
-                return self._process_content(text_content)
+                return self._process_content(text_content, html_file)
             
             # 处理其他类型（字典等）
             else:
                 # 转为 JSON 字符串
-                content_str = json.dumps(content, ensure_ascii=False, indent=2)
-                return f'<pre><code>{self._escape_html(content_str)}</code></pre>'
+                content_str, notice = self._limit_json(content, html_file)
+                if self.highlight_mode == "server":
+                    return self._highlight_block(content_str, 'json') + notice
+                return f'<pre><code>{self._escape_html(content_str)}</code></pre>{notice}'
             
         except Exception as e:
             print(f"处理内容时出错: {e}")
+            if self.metrics is not None:
+                self.metrics.increment("errors", stage="render")
             # 返回转义后的原始内容
             return html.escape(str(content))
 
-    def _detect_code_blocks(self, text: str) -> str:
-        """检测并高亮代码块"""
-        lines = text.split('\n')
-        in_code_block = False
-        language = ''
-        code_content = []
-        result = []
-
-        for line in lines:
-            if line.startswith('```') and not in_code_block:
-                in_code_block = True
-                language = line[3:].strip() or 'plaintext'
-            elif line.startswith('```') and in_code_block:
-                in_code_block = False
-                highlighted_code = f'<pre><code class="language-{language}">{"\n".join(code_content)}</code></pre>'
-                result.append(highlighted_code)
-                code_content = []
-            elif in_code_block:
-                code_content.append(line)
-            else:
-                result.append(line)
+    def _render_text(self, text: str, detect_images: bool, html_file: str = None) -> str:
+        """单次扫描渲染文本中的代码块、图片和内联代码"""
+        code_block = self._render_code_block if self.highlight_mode == "server" else None
+        image_src = None
+        if self.image_mode == "extract":
+            image_src = lambda data_uri: self._extract_image(data_uri, html_file)
+        return render_text(text, detect_images, code_block, image_src)
 
-        return '\n'.join(result)
+    def _extract_image(self, data_uri: str, html_file: str = None) -> str:
+        """把 Base64 图片解码后写入 output_dir/assets，返回相对于 HTML 文件的 URL
 
-    def _detect_images(self, text: str) -> str:
-        """检测并替换图片URL和Base64图片为img标签"""
-        # 处理普通图片URL
-        url_pattern = r'(https?://\S+\.(?:png|jpg|jpeg|gif|webp))'
-        text = re.sub(url_pattern, r'<div class="image-container"><img src="\1" alt="图片"></div>', text)
+        相同的图片只解码和写入一次，无法解码时原样返回 data URI
+        """
+        key = (len(data_uri), hash(data_uri))
+        path = self._extracted_images.get(key)
+        if path is None:
+            header, _, payload = data_uri.partition(",")
+            # data:image/png;base64 -> png，svg+xml 等子类型只取前半部分
+            subtype = header[len("data:image/"):].split(";")[0].split("+")[0].lower()
+            if not subtype.isalnum() or not header.endswith(";base64"):
+                return data_uri
+            try:
+                data = base64.b64decode(payload, validate=True)
+            except (binascii.Error, ValueError):
+                return data_uri
+            suffix = ".jpg" if subtype == "jpeg" else f".{subtype}"
+            path = write_asset(os.path.join(self.output_dir, "assets"), data, suffix, prefix="img-")
+            if len(self._extracted_images) >= 1024:
+                self._extracted_images.clear()
+            self._extracted_images[key] = path
+        return relative_url(path, html_file or self.html_file)
 
-        # 处理Base64编码的图片
-        base64_pattern = r'(data:image/(?:png|jpg|jpeg|gif|webp);base64,[a-zA-Z0-9+/]+={0,2})'
-        return re.sub(base64_pattern, r'<div class="image-container"><img src="\1" alt="Base64图片"></div>', text)
+    def _render_code_block(self, code: str, language: str) -> str:
+        """服务端高亮模式下的代码块渲染，code 和 language 均为转义后的文本"""
+        return self._highlight_block(html.unescape(code), language)
 
-    def _detect_inline_code(self, text: str) -> str:
-        """检测内联代码"""
-        parts = text.split('`')
-        result = []
-        for i, part in enumerate(parts):
-            if i % 2 == 1:  # 奇数部分是代码
-                result.append(f'<code>{part}</code>')
-            else:
-                result.append(part)
-        return ''.join(result)
+    def _highlight_block(self, code: str, language: str) -> str:
+        """在服务端高亮代码块，标记为已高亮，页面脚本不会再次处理"""
+        return (f'<pre><code class="hljs language-{language}" data-highlighted="yes">'
+                f'{highlight_code(code, html.unescape(language))}</code></pre>')
 
     def _format_tool_calls(self, tool_calls: list) -> list:
         """格式化工具调用信息"""
@@ -764,14 +1338,14 @@ class HtmlGenerator:
                 # 处理API响应中的原始JSON格式
                 function_name = tool_call.get("function", {}).get("name", "unknown")
                 try:
-                    function_args = json.loads(tool_call.get("function", {}).get("arguments", "{}"))
+                    function_args = self._parse_tool_args(tool_call.get("function", {}).get("arguments", "{}"))
                 except:
                     function_args = tool_call.get("function", {}).get("arguments", {})
             else:
                 # 处理其他可能的格式
                 function_name = getattr(getattr(tool_call, "function", {}), "name", "unknown")
                 try:
-                    function_args = json.loads(getattr(getattr(tool_call, "function", {}), "arguments", "{}"))
+                    function_args = self._parse_tool_args(getattr(getattr(tool_call, "function", {}), "arguments", "{}"))
                 except:
                     function_args = getattr(getattr(tool_call, "function", {}), "arguments", {})
             
@@ -782,11 +1356,198 @@ class HtmlGenerator:
             
         return result
 
-    def append_message(self, role: str, content: Any, name: str = None) -> None:
-        """将新的对话内容追加到 HTML 文件中"""
+    def _parse_tool_args(self, arguments: str) -> Any:
+        """解析工具调用参数的 JSON 字符串，超过 max_payload_chars 时保留原文，避免再生成一份解析结果和缩进后的文本"""
+        if self.max_payload_chars and len(arguments) > self.max_payload_chars:
+            return arguments
+        return json.loads(arguments)
+
+    def _render_tool_args(self, function_args: Any, html_file: str = None) -> str:
+        """渲染工具调用参数"""
+        if isinstance(function_args, str) and self.max_payload_chars and len(function_args) > self.max_payload_chars:
+            args_json, notice = self._limit_text(function_args, html_file, ".json")
+        else:
+            args_json, notice = self._limit_json(function_args, html_file)
+        if self.highlight_mode == "server":
+            return self._highlight_block(args_json, 'json') + notice
+        return f'<pre><code>{self._escape_html(args_json)}</code></pre>{notice}'
+
+    def _limit_text(self, text: str, html_file: str = None, suffix: str = ".txt") -> tuple:
+        """超过 max_payload_chars 的文本只保留开头部分，完整内容写入独立文件
+
+        Returns:
+            (页面中展示的文本, 截断提示的 HTML，未截断时为空字符串)
+        """
+        limit = self.max_payload_chars
+        if not limit or len(text) <= limit:
+            return text, ''
+        chunks = (text[i:i + _SPILL_CHUNK_CHARS] for i in range(0, len(text), _SPILL_CHUNK_CHARS))
+        return text[:limit], self._spill_payload(chunks, suffix, html_file)
+
+    def _limit_json(self, value: Any, html_file: str = None) -> tuple:
+        """序列化为带缩进的 JSON，超过 max_payload_chars 时只保留开头部分
+
+        逐块序列化，超出上限后把已生成的部分和剩余部分直接写入独立文件，内存中不会出现完整的缩进文本
+
+        Returns:
+            (页面中展示的 JSON 文本, 截断提示的 HTML，未截断时为空字符串)
+        """
+        limit = self.max_payload_chars
+        if not limit:
+            return json.dumps(value, indent=2, ensure_ascii=False), ''
+        chunks = _json_encoder.iterencode(value)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                break
+        else:
+            return ''.join(head), ''
+        preview = ''.join(head)[:limit]
+        return preview, self._spill_payload(itertools.chain(head, chunks), ".json", html_file)
+
+    def _spill_payload(self, chunks: Iterable[str], suffix: str, html_file: str = None) -> str:
+        """把完整内容以内容哈希命名写入 output_dir/assets，返回页面中的截断提示"""
+        path, size = write_asset_chunks(os.path.join(self.output_dir, "assets"), chunks, suffix, prefix="payload-")
+        url = html.escape(relative_url(path, html_file or self.html_file))
+        return (f'<div class="payload-truncated">内容过长，仅显示前 {self.max_payload_chars} 个字符，'
+                f'<a href="{url}" target="_blank">查看完整内容（{size} 字节）</a></div>')
+
+    def append_message(self, role: str, content: Any, name: str = None, model: str = None) -> None:
+        """将新的对话内容追加到 HTML 文件中
+
+        Args:
+            role: 消息角色
+            content: 消息内容
+            name: 消息名称，展示在消息上方
+            model: 生成该消息的模型，只写入 jsonl 记录
+        """
         if not self.html_file:
             self.create_html_file()
+        elif self._sealed or self._should_rotate():
+            self._rotate()
+        self._file_messages += 1
+
+        if self.capture_format == "jsonl":
+            # 在调用线程生成记录，保留消息产生的时间
+            self._dispatch(self._write_record, self.html_file, message_record(role, content, name, model))
+        else:
+            self._dispatch(self._write_message, self.html_file, role, content, name, model)
+
+    def _should_rotate(self) -> bool:
+        """当前文件是否已经超过分卷上限"""
+        if self.rotate_messages and self._file_messages >= self.rotate_messages:
+            return True
+        if self.rotate_bytes:
+            # 开启后台写入时字节数可能稍有滞后，分卷文件会略大于上限
+            path, size = self._file_bytes
+            return path == self.html_file and size >= self.rotate_bytes
+        return False
+
+    def _rotate(self) -> None:
+        """结束当前文件并切换到下一个分卷，前后分卷互相链接，已关闭的文件只在新分卷中链接回去"""
+        previous = self.html_file
+        stem, suffix = split_name(previous)
+        if self._part_base is None or not stem.startswith(self._part_base):
+            self._part_base = stem
+            self._part = 1
+        self._part += 1
+        next_file = f"{self._part_base}_part{self._part}{suffix}"
+        # 关闭时压缩的分卷最终都会变成压缩文件，链接指向压缩后的文件名
+        compressed = SUFFIXES[self.compression] if self.compression and self.compress_mode == "close" else ""
+
+        if not self._sealed:
+            next_name = next_file + compressed
+            self.append_divider(f"———下一部分: {os.path.basename(next_name)}———", relative_url(next_name, previous))
+            self.close_html_file()
+        previous += compressed
+        self.create_html_file(next_file)
+        self.append_divider(f"———上一部分: {os.path.basename(previous)}———", relative_url(previous, next_file))
+
+    def _write_message(self, html_file: str, role: str, content: Any, name: str = None, model: str = None) -> None:
+        """渲染一条消息并写入文件"""
+        start = time.perf_counter() if self.metrics is not None else 0
+        message_html = self._render_fragment(self._render_message(role, content, name, html_file))
+        if self.metrics is not None:
+            self.metrics.observe("render", time.perf_counter() - start)
+        prefix = ""
+        if self._pending_schemas:
+            prefix = "".join(self._pending_schemas)
+            self._pending_schemas = []
+        offset, length = self._write_file(html_file, prefix + message_html)
+        if self._index is not None:
+            # 索引只指向消息本身，不包含前面的工具列表数据
+            skipped = len(prefix.encode("utf-8"))
+            self._add_to_index(html_file, offset + skipped, length - skipped, message_record(role, content, name, model))
+
+    def _render_fragment(self, fragment: str) -> str:
+        """按需渲染模式下把消息或分隔线的 HTML 包装为 JSON 字符串，由页面脚本在需要时生成 DOM"""
+        if self.render_mode != "lazy":
+            return fragment
+        # JSON 中的 < 转义后不会提前结束 script 标签
+        fragment_json = json.dumps(fragment, ensure_ascii=False).replace("<", "\\u003c")
+        return f'<script type="application/json" class="message-chunk">{fragment_json}</script>'
+
+    def _write_record(self, capture_file: str, record: dict) -> None:
+        """序列化一条记录并追加到捕获文件
 
+        消息中的 tools 在每个文件中只写一次独立的 tools 记录，消息本身只保留 tools_ref
+        """
+        start = time.perf_counter() if self.metrics is not None else 0
+        prefix = ""
+        if record.get("tools"):
+            tools = record.pop("tools")
+            _, ref, is_new = self._tools_ref(capture_file, tools)
+            if is_new:
+                prefix = dumps_record(tools_record(ref, tools))
+            record["tools_ref"] = ref
+        line = dumps_record(record)
+        if self.metrics is not None:
+            self.metrics.observe("render", time.perf_counter() - start)
+        offset, length = self._write_file(capture_file, prefix + line)
+        if self._index is not None and record.get("type") == "message":
+            # 索引只指向消息本身这一行，不包含前面的 tools 记录
+            skipped = len(prefix.encode("utf-8"))
+            self._add_to_index(capture_file, offset + skipped, length - skipped, record)
+
+    def _add_to_index(self, file: str, offset: int, length: int, record: dict) -> None:
+        """把刚写入的消息加入全文索引，索引出错不影响写入"""
+        try:
+            self._index.add(file, offset, length, record)
+        except Exception as e:
+            print(f"更新检索索引时出错: {e}")
+            if self.metrics is not None:
+                self.metrics.increment("errors", stage="index")
+
+    def _tools_ref(self, file: str, tools: Any) -> tuple:
+        """计算工具列表的紧凑 JSON 和哈希，返回 (JSON, 哈希, 是否第一次出现在该文件中)"""
+        tools_json = json.dumps(tools, ensure_ascii=False, separators=(",", ":"))
+        ref = content_hash(tools_json.encode("utf-8"))
+        if self._tools_file != file:
+            self._tools_file = file
+            self._tools_refs = set()
+        is_new = ref not in self._tools_refs
+        self._tools_refs.add(ref)
+        return tools_json, ref, is_new
+
+    def _render_tools(self, tools: Any, html_file: str = None) -> str:
+        """渲染工具列表的引用，第一次出现时在页面中写入一份 JSON 数据
+
+        JSON 数据写在消息的 div 之前，不计入消息的文本（空消息的判断读取 textContent），
+        按需渲染模式下也不会被包进消息块
+        """
+        tools_json, ref, is_new = self._tools_ref(html_file or self.html_file, tools)
+        if is_new:
+            # JSON 中的 < 只会出现在字符串里，转义后不会提前结束 script 标签
+            tools_json = tools_json.replace("<", "\\u003c")
+            self._pending_schemas.append(
+                f'<script type="application/json" class="tools-schema" id="tools-{ref}">{tools_json}</script>')
+        return f'<div class="tools-data" data-tools-ref="{ref}" style="display:none;"></div>'
+
+    def _render_message(self, role: str, content: Any, name: str = None, html_file: str = None) -> str:
+        """把一条消息渲染为 HTML 片段"""
         if name:
             message_html = f'<div class="message {role}" data-name="{self._escape_html(name)}">'
         else:
@@ -794,11 +1555,10 @@ class HtmlGenerator:
 
         if role == "user" or role == "system":
             # 用户消息直接展示
-            message_html += self._process_content(content)
+            message_html += self._process_content(content, html_file)
             
             # 如果用户消息有tools字段，添加一个图标
             if isinstance(content, dict) and content.get('tools'):
-                tools_json = json.dumps(content.get('tools'), indent=2, ensure_ascii=False)
                 message_html += f'''
                 <svg class="tools-icon" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" title="查看可用工具">
                     <path stroke-linecap="round" stroke-linejoin="round" d="M4 6h16M4 12h16M4 18h7" />
@@ -806,222 +1566,66 @@ class HtmlGenerator:
                 </svg>
                 '''
                 
-                # 将工具数据存储为自定义数据属性，而不是直接在DOM中
-                message_html += f'<div class="tools-data" data-tools="{self._escape_html(tools_json)}" style="display:none;"></div>'
+                # 工具列表每个文件只写一次，消息中只保留按哈希的引用
+                message_html += self._render_tools(content.get('tools'), html_file)
         else:
             # AI 响应消息
             if isinstance(content, dict):
                 # 展示主要响应文本
                 content_text = content.get('content', content.get('response', ''))
-                message_html += self._process_content(content_text)
+                message_html += self._process_content(content_text, html_file)
 
                 # 如果有工具调用，单独展示
                 tool_calls = content.get('tool_calls', [])
                 if tool_calls:
                     for tool_call in tool_calls:
-                        message_html += f'<div class="tool-call-container"><div class="tool-call-header"><svg class="tool-call-icon" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path stroke-linecap="round" stroke-linejoin="round" d="M11.42 15.17L17.25 21A2.652 2.652 0 0021 17.25l-5.877-5.877M11.42 15.17l2.496-3.03c.317-.384.74-.626 1.208-.766M11.42 15.17l-4.655 5.653a2.548 2.548 0 11-3.586-3.586l6.837-5.63m5.108-.233c.55-.164 1.163-.188 1.743-.14a4.5 4.5 0 004.486-6.336l-3.276 3.277a3.004 3.004 0 01-2.25-2.25l3.276-3.276a4.5 4.5 0 00-6.336 4.486c.091 1.076-.071 2.264-.904 2.95l-.102.085m-1.745 1.437L5.909 7.5H4.5L2.25 3.75l1.5-1.5L7.5 4.5v1.409l4.26 4.26m-1.745 1.437l1.745-1.437m6.615 8.206L15.75 15.75M4.867 19.125h.008v.008h-.008v-.008z" /></svg><div class="tool-call-title">Tool | {tool_call["function_name"]}</div></div><pre><code>{json.dumps(tool_call["function_args"], indent=2, ensure_ascii=False)}</code></pre></div>'
+                        message_html += f'<div class="tool-call-container"><div class="tool-call-header"><svg class="tool-call-icon" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path stroke-linecap="round" stroke-linejoin="round" d="M11.42 15.17L17.25 21A2.652 2.652 0 0021 17.25l-5.877-5.877M11.42 15.17l2.496-3.03c.317-.384.74-.626 1.208-.766M11.42 15.17l-4.655 5.653a2.548 2.548 0 11-3.586-3.586l6.837-5.63m5.108-.233c.55-.164 1.163-.188 1.743-.14a4.5 4.5 0 004.486-6.336l-3.276 3.277a3.004 3.004 0 01-2.25-2.25l3.276-3.276a4.5 4.5 0 00-6.336 4.486c.091 1.076-.071 2.264-.904 2.95l-.102.085m-1.745 1.437L5.909 7.5H4.5L2.25 3.75l1.5-1.5L7.5 4.5v1.409l4.26 4.26m-1.745 1.437l1.745-1.437m6.615 8.206L15.75 15.75M4.867 19.125h.008v.008h-.008v-.008z" /></svg><div class="tool-call-title">Tool | {self._escape_html(str(tool_call["function_name"]))}</div></div>{self._render_tool_args(tool_call["function_args"], html_file)}</div>'
             else:
-                message_html += self._process_content(content)
+                message_html += self._process_content(content, html_file)
 
         message_html += "</div>"
-
-        with open(self.html_file, "a", encoding="utf-8") as f:
-            f.write(message_html)
+        return message_html
 
     def close_html_file(self) -> None:
-        """关闭 HTML 文件"""
+        """刷盘，之后仍然可以继续追加消息
+
+        页面结尾由写入句柄维护，每次刷盘后磁盘上都是完整的页面，这里不再重复写入结尾标签
+        """
         if not self.html_file:
             return
-            
-        with open(self.html_file, "a", encoding="utf-8") as f:
-            f.write("""
-            </div>
-        </body>
-        </html>
-        """)
+        self._dispatch_required(self._sync_flush)
 
 
-    def append_divider(self, title: str = ""):
+    def append_divider(self, title: str = "", href: str = None):
         """添加分隔线到对话中
         
         Args:
             title: 分隔线标题
+            href: 标题链接，例如分叉对话指向父对话文件的相对路径
         """
-        if self.html_file:
+        if self._sealed:
+            self._rotate()
+        if self.html_file and self.capture_format == "jsonl":
+            self._dispatch(self._write_record, self.html_file, divider_record(title, href))
+        elif self.html_file:
+            title_html = html.escape(title)
+            if href:
+                title_html = f'<a href="{html.escape(href)}">{title_html}</a>'
+
             divider_html = f"""
             <div class="conversation-divider" style="text-align: center; margin: 20px 0; color: #6b7280; font-size: 14px;">
                 <span style="display: inline-block; position: relative; padding: 0 10px; background: #f7f7f8;">
                     <span style="border-top: 1px solid #d1d5db; position: absolute; top: 50%; left: 0; width: 100%; z-index: -1;"></span>
-                    {html.escape(title)}
+                    {title_html}
                 </span>
             </div>
             """
-            with open(self.html_file, "a", encoding="utf-8") as f:
-                f.write(divider_html)
+            self._dispatch(self._write_file, self.html_file, self._render_fragment(divider_html))
 
     def append_script(self):
         """添加自定义的JavaScript代码"""
-        if self.html_file:
-            script_content = """
-            <script>
-            document.addEventListener('DOMContentLoaded', function() {
-                // 全局弹出层，只创建一次
-                const popupContainer = document.createElement('div');
-                popupContainer.className = 'tools-popup';
-                popupContainer.innerHTML = `
-                    <span class="tools-popup-close" title="关闭">&times;</span>
-                    <div class="tools-popup-title">可用工具列表</div>
-                    <div class="tools-popup-content">
-                        <pre><code class="language-json"></code></pre>
-                    </div>
-                `;
-                document.body.appendChild(popupContainer);
-                
-                // 关闭按钮事件
-                popupContainer.querySelector('.tools-popup-close').addEventListener('click', function() {
-                    popupContainer.classList.remove('tools-popup-visible');
-                });
-                
-                // 初始化所有工具图标的点击事件
-                function initToolsIcons() {
-                    document.querySelectorAll('.tools-icon').forEach(icon => {
-                        if (!icon.dataset.initialized) {
-                            icon.dataset.initialized = 'true';
-                            icon.addEventListener('click', handleToolIconClick);
-                        }
-                    });
-                }
-                
-                // 工具图标点击处理函数
-                function handleToolIconClick(e) {
-                    const icon = e.currentTarget;
-                    const message = icon.closest('.message');
-                    const toolsData = message.querySelector('.tools-data');
-                    
-                    if (toolsData) {
-                        // 获取工具数据
-                        const toolsJson = toolsData.getAttribute('data-tools');
-                        
-                        // 填充弹出层内容
-                        const codeElement = popupContainer.querySelector('code');
-                        codeElement.textContent = toolsJson;
-                        
-                        // 应用语法高亮
-                        if (window.hljs) {
-                            hljs.highlightElement(codeElement);
-                        }
-                        
-                        // 定位弹出层
-                        const iconRect = icon.getBoundingClientRect();
-                        popupContainer.style.top = `${iconRect.bottom + 5}px`;
-                        popupContainer.style.right = `${window.innerWidth - iconRect.right}px`;
-                        
-                        // 显示弹出层
-                        popupContainer.classList.add('tools-popup-visible');
-                        
-                        // 调整位置
-                        adjustPopupPosition(popupContainer);
-                        
-                        // 阻止事件冒泡
-                        e.stopPropagation();
-                    }
-                }
-                
-                // 调整弹出框位置，确保在视窗内
-                function adjustPopupPosition(popup) {
-                    const rect = popup.getBoundingClientRect();
-                    const viewportHeight = window.innerHeight;
-                    const viewportWidth = window.innerWidth;
-                    
-                    // 检查是否超出底部边界
-                    if (rect.bottom > viewportHeight) {
-                        // 如果弹出框太大，则将其放到顶部附近
-                        if (rect.height > viewportHeight * 0.6) {
-                            popup.style.top = '20px';
-                        } else {
-                            const overflowBottom = rect.bottom - viewportHeight;
-                            popup.style.top = `${parseInt(popup.style.top || '0') - overflowBottom - 10}px`;
-                        }
-                    }
-                    
-                    // 检查是否超出右侧边界
-                    if (rect.right > viewportWidth) {
-                        popup.style.right = '10px';
-                        popup.style.left = 'auto';
-                    }
-                    
-                    // 检查是否超出左侧边界
-                    if (rect.left < 0) {
-                        popup.style.left = '10px';
-                        popup.style.right = 'auto';
-                    }
-                }
-                
-                // 点击文档其他区域关闭弹出框
-                document.addEventListener('click', function(e) {
-                    if (!e.target.closest('.tools-popup') && !e.target.closest('.tools-icon')) {
-                        popupContainer.classList.remove('tools-popup-visible');
-                    }
-                });
-                
-                // 窗口大小改变时重新调整弹出框的位置
-                window.addEventListener('resize', function() {
-                    if (popupContainer.classList.contains('tools-popup-visible')) {
-                        adjustPopupPosition(popupContainer);
-                    }
-                });
-                
-                // 初始化现有图标
-                initToolsIcons();
-                
-                // 使用MutationObserver监听DOM变化，处理动态添加的工具图标
-                const observer = new MutationObserver(function(mutations) {
-                    let hasNewIcons = false;
-                    
-                    mutations.forEach(function(mutation) {
-                        if (mutation.type === 'childList') {
-                            const icons = mutation.target.querySelectorAll('.tools-icon:not([data-initialized])');
-                            if (icons.length > 0) {
-                                hasNewIcons = true;
-                            }
-                        }
-                    });
-                    
-                    if (hasNewIcons) {
-                        initToolsIcons();
-                    }
-                });
-                
-                // 开始观察DOM变化
-                observer.observe(document.getElementById('conversation'), { 
-                    childList: true, 
-                    subtree: true 
-                });
-                
-                // 初始化时检查所有用户消息内容高度
-                setTimeout(() => {
-                    document.querySelectorAll('.message.user').forEach(message => {
-                        // 移除空格、换行符等空白字符，检查消息是否为空
-                        const text = message.textContent.trim();
-                        if (!text || text.length === 0) {
-                            message.style.padding = '5px 20px';
-                        }
-                    });
-                    
-                    // 确保所有图标都已初始化
-                    initToolsIcons();
-                }, 100);
-                
-                // 初始化代码高亮
-                if (window.hljs) {
-                    hljs.configure({
-                        languages: ['json', 'javascript', 'python', 'bash', 'html', 'css'],
-                        ignoreUnescapedHTML: true
-                    });
-                    hljs.highlightAll();
-                }
-            });
-            </script>
+        if self.html_file and self.capture_format == "html":
+            script_content = f"""
+            {self._render_script_element(self.html_file)}
             """
-            with open(self.html_file, "a", encoding="utf-8") as f:
-                f.write(script_content)
\ No newline at end of file
+            self._dispatch(self._write_file, self.html_file, script_content)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import json
+import time
 from typing import Any, Optional
 from uuid import UUID
 
@@ -6,6 +7,9 @@ from langchain_core.callbacks import StdOutCallbackHandler
 from langchain_core.messages import BaseMessage
 
 from .html_generator import HtmlGenerator
+from .request_parser import message_digest
+from .sampling import Outcome, SamplingPolicy
+from .tracker import ConversationFiles, ConversationTracker
 
 
 def _convert_message_role(type: str):
@@ -22,19 +26,29 @@ class HtmlExportCallbackHandler(StdOutCallbackHandler, HtmlGenerator):
     def __init__(
             self,
             output_dir: str = "logs",
+            sampling: SamplingPolicy = None,
+            **generator_options,
     ):
         """初始化导出器
 
         Args:
             output_dir: 输出目录，默认为 "logs"
+            sampling: 采样策略，只导出其中一部分对话，设置后文件在第一次写入时才创建
+            generator_options: 透传给 HtmlGenerator 的其他选项，例如 async_write
         """
         StdOutCallbackHandler.__init__(self)
-        HtmlGenerator.__init__(self, output_dir=output_dir)
+        HtmlGenerator.__init__(self, output_dir=output_dir, **generator_options)
+        self.sampling = sampling
         self.html_file = None
-        self.previous_messages_count = 0
-        self.is_first_conversation = True
-        self.step = 0
-        self.html_file = self.create_html_file()
+        if sampling is None:
+            self.html_file = self.create_html_file()
+        # 按消息前缀哈希判断请求属于哪个对话，以及对话写入哪个文件
+        self._tracker = ConversationTracker()
+        self._conversation_files = ConversationFiles(self, sampling)
+        self._runs = {}  # run_id -> (对话, 开始时间, 模型)，回复写入同一个对话
+        # 上一次调用的消息和摘要，开头相同的消息直接复用摘要
+        self._last_messages = []
+        self._last_digests = []
 
     def on_chat_model_start(
             self,
@@ -49,58 +63,85 @@ class HtmlExportCallbackHandler(StdOutCallbackHandler, HtmlGenerator):
     ) -> Any:
         """当聊天模型开始处理时调用"""
         current_messages = messages[0]
-        # 根据消息数量判断是否是新的对话
-        is_new_conversation = self._is_new_conversation(current_messages)
-
-        # 如果是新的对话但不是第一次对话，添加分隔线
-        if is_new_conversation and not self.is_first_conversation:
-            self.step = self.step + 1
-            self.append_divider(f"———Step {self.step}———")
-
-        if is_new_conversation:
-            self.previous_messages_count = len(current_messages)
-            self.is_first_conversation = False
-            for message in current_messages:
-                self._append_message(message)
-        else:
-            last_messages = current_messages[(self.previous_messages_count - len(current_messages)):]
-            for message in last_messages:
-                self._append_message(message)
-            self.previous_messages_count = self.previous_messages_count + len(last_messages)
-
-    def _append_message(self, message):
+        digests, reused = self._digests(current_messages)
+        leading_system = 0
+        while leading_system < len(current_messages) and current_messages[leading_system].type == 'system':
+            leading_system += 1
+
+        # 根据消息前缀哈希判断延续哪个对话，以及从哪条消息开始是新的
+        result = self._tracker.track(digests, leading_system, reused)
+        generator = self._conversation_files.generator_for(result)
+        conversation = result.conversation
+        start = result.start
+        if conversation.responded and start < len(current_messages) and current_messages[start].type == 'ai':
+            # 上一次记录过的回复被作为 AI 消息带回，不再重复写入
+            start += 1
+        conversation.responded = False
+
+        for message in current_messages[start:]:
+            self._append_message(message, generator)
+        invocation_params = kwargs.get("invocation_params") or {}
+        model = (invocation_params.get("model") or invocation_params.get("model_name")
+                 or (metadata or {}).get("ls_model_name"))
+        self._runs[run_id] = (conversation, time.perf_counter(), model)
+
+    def _append_message(self, message, generator: HtmlGenerator = None):
+        generator = generator or self
         if message.type == 'ai' and message.tool_calls:
             assistant_message = {
                 "response": message.content,
                 "tool_calls": self._format_tool_calls(message.tool_calls)
             }
-            self.append_message("assistant", assistant_message, message.name)
+            generator.append_message("assistant", assistant_message, message.name)
         else:
-            self.append_message(_convert_message_role(message.type), message.content, message.name)
-
-    def _is_new_conversation(self, messages: list[BaseMessage]) -> bool:
-        """检查是否是新的对话轮次
-        
-        如果消息数量少于之前记录的数量，或者
-        消息数量为1且是用户消息，则判断为新对话
-        """
-        # 如果当前消息数量少于之前记录的数量，可能是新会话
-        if len(messages) < self.previous_messages_count + 1:
-            return True
+            generator.append_message(_convert_message_role(message.type), message.content, message.name)
 
-        if self.previous_messages_count == 0:
-            return True
+    def _digests(self, current_messages: list) -> tuple:
+        """计算每条消息的摘要，返回 (摘要列表, 与上一次调用相同的开头消息数)
 
-        return False
+        对话历史在多次调用之间沿用同一批消息对象，开头仍是同一个对象的消息复用上一次的摘要，
+        每次调用只对新增的消息做序列化和哈希
+        """
+        last_messages = self._last_messages
+        reused = 0
+        limit = min(len(current_messages), len(last_messages))
+        while reused < limit and current_messages[reused] is last_messages[reused]:
+            reused += 1
+        digests = self._last_digests[:reused]
+        digests.extend(self._message_digest(message) for message in current_messages[reused:])
+        self._last_messages = list(current_messages)
+        self._last_digests = digests
+        return digests, reused
+
+    @staticmethod
+    def _message_digest(message: BaseMessage) -> str:
+        """消息内容的摘要，用于追踪对话前缀"""
+        key = [message.type, message.content, message.name, getattr(message, 'tool_calls', None),
+               getattr(message, 'tool_call_id', None)]
+        return message_digest(json.dumps(key, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
 
     def on_llm_end(self, response: Any, **kwargs: Any) -> None:
         """当 LLM 结束处理时调用"""
+        run = self._runs.pop(kwargs.get("run_id"), None)
+        generator = self._conversation_files.target_of(run[0]) if run else self
         assistant_message = response.generations[0][0].message
-        self.append_message("assistant", {
+        generator.append_message("assistant", {
             "response": assistant_message.content,
             "tool_calls": self._format_tool_calls(assistant_message.tool_calls)
         }, assistant_message.name)
-        self.previous_messages_count = self.previous_messages_count + 1
+        if run:
+            conversation, started, model = run
+            conversation.responded = True
+            if self.sampling is not None:
+                outcome = Outcome(False, bool(assistant_message.tool_calls), time.perf_counter() - started, model)
+                self._conversation_files.finish(conversation, outcome)
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        """当 LLM 出错时调用，采样保留出错的对话"""
+        run = self._runs.pop(kwargs.get("run_id"), None)
+        if run and self.sampling is not None:
+            conversation, started, model = run
+            self._conversation_files.finish(conversation, Outcome(True, False, time.perf_counter() - started, model))
 
     def on_tool_end(
             self,
@@ -127,6 +168,11 @@ class HtmlExportCallbackHandler(StdOutCallbackHandler, HtmlGenerator):
             })
         return result
 
+    def close(self, timeout: float = None) -> None:
+        """刷盘并关闭所有对话文件"""
+        self._conversation_files.close(timeout)
+        HtmlGenerator.close(self, timeout)
+
     def get_callback(self) -> 'HtmlExportCallbackHandler':
         """获取回调实例"""
         return self
@@ -0,0 +1,117 @@
+import threading
+from typing import Dict, Tuple
+
+# 各阶段的名称：parse 解析请求体，sse 旁路解析流式响应，render 渲染 HTML，write 写入文件，
+# process 一次请求从解析到提交写入的总耗时
+STAGES = ("parse", "sse", "render", "write", "process")
+
+
+def _format_value(value: float) -> str:
+    """整数原样输出，浮点数输出能还原的完整精度，避免较大的字节数被截成科学计数法"""
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsHook:
+    """日志记录的指标回调接口
+
+    传给 HtmlGenerator 或日志传输层的 metrics 参数后，在解析、渲染、写入等位置被调用。
+    未设置时各处只多一次 None 判断。回调可能在调用线程或后台写入线程中执行，实现需要线程安全。
+    默认实现什么都不做，子类只需覆盖关心的方法
+    """
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """记录一次阶段耗时"""
+
+    def increment(self, name: str, value: float = 1, stage: str = "") -> None:
+        """累加计数，例如 bytes_written、errors、dropped"""
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """设置当前值，例如 queue_depth"""
+
+
+class PrometheusMetrics(MetricsHook):
+    """在内存中汇总指标，并输出 Prometheus 文本格式
+
+    耗时按阶段记录为 summary（次数和总秒数）以及固定分桶的 histogram，计数和当前值原样输出
+    """
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+    def __init__(self, namespace: str = "ai_chat_html_exporter"):
+        """
+        Args:
+            namespace: 指标名称的前缀
+        """
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._timings: Dict[str, list] = {}  # 阶段 -> [次数, 总秒数, 各分桶计数]
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                timing = self._timings[stage] = [0, 0.0, [0] * len(self.BUCKETS)]
+            timing[0] += 1
+            timing[1] += seconds
+            buckets = timing[2]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+
+    def increment(self, name: str, value: float = 1, stage: str = "") -> None:
+        with self._lock:
+            key = (name, stage)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式，可以直接作为 /metrics 接口的响应体"""
+        prefix = self.namespace
+        lines = []
+        with self._lock:
+            if self._timings:
+                name = f"{prefix}_stage_seconds"
+                lines.append(f"# HELP {name} Time spent in each logging stage.")
+                lines.append(f"# TYPE {name} histogram")
+                for stage, (count, total, buckets) in sorted(self._timings.items()):
+                    cumulative = 0
+                    for bound, bucket in zip(self.BUCKETS, buckets):
+                        cumulative += bucket
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+            counter_names = sorted({counter for counter, _ in self._counters})
+            for counter in counter_names:
+                name = f"{prefix}_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                for (key, stage), value in sorted(self._counters.items()):
+                    if key == counter:
+                        labels = f'{{stage="{stage}"}}' if stage else ""
+                        lines.append(f"{name}{labels} {_format_value(value)}")
+
+            for gauge, value in sorted(self._gauges.items()):
+                name = f"{prefix}_{gauge}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """以字典形式返回当前的汇总数据，便于在测试或其他监控系统中使用"""
+        with self._lock:
+            return {
+                "timings": {stage: {"count": count, "seconds": total}
+                            for stage, (count, total, _) in self._timings.items()},
+                "counters": {f"{name}:{stage}" if stage else name: value
+                             for (name, stage), value in self._counters.items()},
+                "gauges": dict(self._gauges),
+            }
@@ -1,7 +1,14 @@
-import logging
+import asyncio
+import threading
+import time
 from datetime import datetime
 import json
 from .html_generator import HtmlGenerator
+from .request_parser import message_digest
+from .sampling import Outcome, SamplingPolicy
+from .session import Session, SessionRouter
+from .tracker import TrackResult
+from .sse import AsyncTeeStream, SSEResponseParser, SyncTeeStream
 
 import httpx
 from openai import AsyncOpenAI, OpenAI, AsyncAzureOpenAI, AzureOpenAI
@@ -14,94 +21,213 @@ class LoggerTransport(HtmlGenerator):
             self,
             wrapped_transport,
             output_dir: str = "logs",
+            stream_capture: bool = True,
+            session_mode: str = "auto",
+            session_header: str = "x-chat-session",
+            sampling: SamplingPolicy = None,
+            offload: bool = True,
+            **generator_options,
     ):
         """初始化日志拦截器
 
         Args:
             wrapped_transport: 被包装的原始传输层
             output_dir: 日志输出目录
+            stream_capture: 是否以旁路方式捕获 SSE 流式响应，为 False 时先读完整个响应再返回
+            session_mode: 会话路由方式，"auto" 按 chat_session 上下文和请求头区分会话，
+                "prefix" 另外按开头消息的摘要区分，"single" 所有请求写入同一个文件
+            session_header: 携带会话 ID 的请求头
+            sampling: 采样策略，只导出其中一部分对话，设置后主文件在第一次写入时才创建
+            offload: 异步请求是否把请求解析、HTML 渲染和文件写入交给单独的导出线程，事件循环只负责转发，
+                同一传输层的记录仍按请求完成的顺序写入
+            generator_options: 透传给 HtmlGenerator 的其他选项，例如 async_write
         """
-        HtmlGenerator.__init__(self, output_dir=output_dir)
+        HtmlGenerator.__init__(self, output_dir=output_dir, **generator_options)
         self.wrapped_transport = wrapped_transport
-        self.html_file = self.create_html_file()
-        self._processed_message_count = 0
-        self._previous_messages_count = 0  # 记录上一次对话的消息数量
-        self._is_first_conversation = True  # 是否是第一次对话
-        self._step = 0  # 记录对话步骤
-
-    def _process_request(self, request_content, response_body):
-        """处理请求和响应内容"""
-        try:
-            # 解析请求体
-            request_body = json.loads(request_content.decode('utf-8'))
-            messages = request_body.get("messages", [])
-            model = request_body.get("model")
-            tools = request_body.get("tools", [])
-
-            # 判断是否是新对话
-            is_new_conversation = self._is_new_conversation(messages)
-
-            # 如果是新的对话但不是第一次对话，添加分隔线
-            if is_new_conversation and not self._is_first_conversation:
-                self._step += 1
-                self.append_divider(f"———Step {self._step}———")
-                self._processed_message_count = 0  # 重置消息计数器
-
-            if is_new_conversation:
-                self._previous_messages_count = len(messages)
-                self._is_first_conversation = False
-            else:
-                # 更新最近一次消息数量
-                self._previous_messages_count = max(self._previous_messages_count, len(messages))
-
-            # 添加未处理的新消息
-            for i in range(self._processed_message_count, len(messages)):
-                message = messages[i]
-                role = message["role"]
-                content = message["content"]
-                name = message["name"] if "name" in message else None
-
-                # 如果是最后一条用户消息并且存在tools字段，添加tools信息
-                if role == "user" and i == len(messages) - 1 and tools:
-                    # 创建包含tools字段的消息内容
-                    enhanced_content = {
-                        "text": content,
-                        "tools": tools
-                    }
-                    self.append_message(role, enhanced_content, name)
-                else:
-                    self.append_message(role, content, name)
+        self.stream_capture = stream_capture
+        self.sampling = sampling
+        self.offload = offload
+        self.html_file = self.create_html_file() if sampling is None else None
+        # 每个会话各自的解析器、对话追踪和输出文件
+        self._sessions = SessionRouter(self, session_mode, session_header, sampling=sampling)
 
-                # 更新计数器
-                self._processed_message_count += 1
+    def _process_request(self, request_content, response_body, session: Session = None, status_code: int = 200,
+                         latency: float = None):
+        """处理请求和响应内容
 
-            # 记录助手回复
-            if response_body.get("choices") and len(response_body["choices"]) > 0:
-                choice = response_body["choices"][0]
-                message = choice.get("message", {})
+        Args:
+            status_code: 响应的 HTTP 状态码
+            latency: 从发出请求到读完响应的秒数，用于采样的保留规则
+        """
+        session = session or self._sessions.default
+        metrics = self.metrics
+        started = time.perf_counter() if metrics is not None else 0
+        try:
+            with session.lock:
+                # 解析请求体，复用上一次请求已解析的历史消息，只解析新增部分
+                request_body = session.parser.parse(request_content)
+                if metrics is not None:
+                    metrics.observe("parse", time.perf_counter() - started)
+                messages = request_body.get("messages", [])
+                model = request_body.get("model")
+                tools = request_body.get("tools", [])
+
+                # 判断请求延续哪个对话，以及从哪条消息开始是新的
+                result = self._track(session, messages)
+                generator = session.files.generator_for(result)
+                start = result.start
+                conversation = result.conversation
+                if conversation.responded and start < len(messages) and messages[start].get("role") == "assistant":
+                    # 上一次记录过的回复被客户端作为 assistant 消息带回，不再重复写入
+                    start += 1
+                conversation.responded = False
+
+                # 添加未处理的新消息
+                for i in range(start, len(messages)):
+                    message = messages[i]
+                    role = message["role"]
+                    content = message["content"]
+                    name = message["name"] if "name" in message else None
+
+                    # 如果是最后一条用户消息并且存在tools字段，添加tools信息
+                    if role == "user" and i == len(messages) - 1 and tools:
+                        # 创建包含tools字段的消息内容
+                        enhanced_content = {
+                            "text": content,
+                            "tools": tools
+                        }
+                        generator.append_message(role, enhanced_content, name)
+                    else:
+                        generator.append_message(role, content, name)
+
+                # 记录助手回复
+                tool_calls = []
+                if response_body.get("choices") and len(response_body["choices"]) > 0:
+                    choice = response_body["choices"][0]
+                    message = choice.get("message", {})
+                    tool_calls = message.get("tool_calls") or []
+
+                    assistant_message = {
+                        "response": message.get("content", ""),
+                        "tool_calls": self._format_tool_calls(tool_calls),
+                    }
 
-                assistant_message = {
-                    "response": message.get("content", ""),
-                    "tool_calls": self._format_tool_calls(message.get("tool_calls", [])),
-                }
+                    generator.append_message("assistant", assistant_message, name=model, model=model)
+                    conversation.responded = True
 
-                self.append_message("assistant", assistant_message, name=model)
-                # 更新计数器
-                self._processed_message_count += 1
+                    generator.close_html_file()
 
-                self.close_html_file()
+                if self.sampling is not None:
+                    error = status_code >= 400 or "error" in response_body
+                    session.files.finish(conversation, Outcome(error, bool(tool_calls), latency, model))
         except Exception as e:
             print(f"日志记录器出错: {e}")
+            if metrics is not None:
+                metrics.increment("errors", stage="process")
+        if metrics is not None:
+            metrics.observe("process", time.perf_counter() - started)
+
+    def _export(self, func, *args) -> None:
+        """执行记录任务，开启 offload 时提交给导出线程后立即返回"""
+        if self.offload:
+            try:
+                self._get_executor().submit(func, *args)
+                return
+            except RuntimeError:
+                # 传输层已经关闭，在当前线程完成记录
+                pass
+        func(*args)
+
+    async def _forward_async(self, transport: httpx.AsyncBaseTransport, request):
+        """通过 transport 转发异步请求，拦截 chat/completions 请求"""
+        # 只处理 chat completions 相关的请求，转发前确定所属会话并移除会话请求头
+        is_chat = "/chat/completions" in request.url.path
+        session = self._sessions.route(request) if is_chat else None
+
+        # 获取原始响应
+        started = time.perf_counter()
+        response = await transport.handle_async_request(request)
+
+        if is_chat:
+            # 检查是否为 SSE 流式响应, azure 是流式的
+            if "text/event-stream" in response.headers.get("content-type", ""):
+                if self._can_tee(response):
+                    # 边转发边解析，流关闭时再写入 HTML
+                    response.stream = AsyncTeeStream(
+                        response.stream,
+                        SSEResponseParser(),
+                        lambda parser: self._export(self._process_sse_parser, request.content, parser, session,
+                                                    response.status_code, started),
+                        self.metrics,
+                    )
+                else:
+                    # 处理 SSE 流式响应
+                    response_content = await response.aread()
+                    self._export(self._process_raw_response, request.content, response_content, session, True,
+                                 response.status_code, time.perf_counter() - started)
+            else:
+                response_content = await response.aread()
+                self._export(self._process_raw_response, request.content, response_content, session, False,
+                             response.status_code, time.perf_counter() - started)
+
+        return response
 
-    def _is_new_conversation(self, messages: list) -> bool:
-        if self._previous_messages_count == 0:
-            return True
+    def _forward(self, transport: httpx.BaseTransport, request):
+        """通过 transport 转发同步请求，拦截 chat/completions 请求"""
+        # 只处理 chat completions 相关的请求，转发前确定所属会话并移除会话请求头
+        is_chat = "/chat/completions" in request.url.path
+        session = self._sessions.route(request) if is_chat else None
+
+        # 获取原始响应
+        started = time.perf_counter()
+        response = transport.handle_request(request)
+
+        if is_chat:
+            if "text/event-stream" in response.headers.get("content-type", ""):
+                if self._can_tee(response):
+                    # 边转发边解析，流关闭时再写入 HTML
+                    response.stream = SyncTeeStream(
+                        response.stream,
+                        SSEResponseParser(),
+                        lambda parser: self._process_sse_parser(request.content, parser, session,
+                                                                response.status_code, started),
+                        self.metrics,
+                    )
+                else:
+                    # 处理 SSE 流式响应
+                    response_content = response.read()
+                    self._process_raw_response(request.content, response_content, session, True,
+                                               response.status_code, time.perf_counter() - started)
+            else:
+                response_content = response.read()
+                self._process_raw_response(request.content, response_content, session, False,
+                                           response.status_code, time.perf_counter() - started)
 
-        # 如果消息数量不符合递增规律，可能是新会话
-        if len(messages) < self._previous_messages_count + 1:
-            return True
+        return response
 
-        return False
+    def _track(self, session: Session, messages: list) -> TrackResult:
+        """用解析器缓存的消息摘要追踪对话"""
+        digests = session.parser.digests
+        reused = session.parser.reused
+        if len(digests) != len(messages):
+            # 请求体不是预期的结构，退回到逐条计算摘要
+            digests = [message_digest(json.dumps(message, ensure_ascii=False).encode("utf-8")) for message in messages]
+            reused = 0
+
+        leading_system = 0
+        while leading_system < len(messages) and messages[leading_system].get("role") == "system":
+            leading_system += 1
+
+        return session.tracker.track(digests, leading_system, reused)
+
+    def close_logs(self, timeout: float = None) -> None:
+        """刷盘并关闭所有对话文件"""
+        if self._executor is not None:
+            # 先等待已经交给执行器的记录任务
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._sessions.close(timeout)
+        HtmlGenerator.close(self, timeout)
 
     def _format_tool_calls(self, tool_calls: list) -> list:
         """格式化工具调用信息"""
@@ -109,144 +235,104 @@ class LoggerTransport(HtmlGenerator):
         for tool_call in tool_calls:
             result.append({
                 'function_name': tool_call['function']['name'],
-                'function_args': json.loads(tool_call['function']['arguments'])
+                'function_args': self._parse_tool_args(tool_call['function']['arguments'])
             })
         return result
 
+    def _can_tee(self, response) -> bool:
+        """判断响应流能否旁路解析
 
-class AsyncChatLoggerTransport(httpx.AsyncBaseTransport, LoggerTransport):
-    """异步 OpenAI API 请求和响应的传输层"""
-
-    def __init__(
-            self,
-            wrapped_transport: httpx.AsyncBaseTransport,
-            output_dir: str = "logs",
-    ):
-        LoggerTransport.__init__(self, wrapped_transport, output_dir)
-
-    async def handle_async_request(self, request):
-        """处理异步请求，拦截 chat/completions 请求"""
-        # 获取原始响应
-        response = await self.wrapped_transport.handle_async_request(request)
-
-        # 只处理 chat completions 相关的请求
-        if "/chat/completions" in request.url.path:
-            # 检查是否为 SSE 流式响应, azure 是流式的
-            if "text/event-stream" in response.headers.get("content-type", ""):
-                response_content = await response.aread()
-                # 处理 SSE 流式响应
-                message_content, tool_calls = self._process_sse_response(response_content)
-
-                # 构造与标准 OpenAI 响应格式相匹配的结构
-                standard_response = {
-                    "choices": [{
-                        "message": {
-                            "content": message_content,
-                            "tool_calls": tool_calls
-                        }
-                    }]
+        压缩过的响应体需要先解码才能解析，已经读完的响应（例如 MockTransport 返回的）不会再被迭代，
+        这两种情况退回到完整读取
+        """
+        if not self.stream_capture or hasattr(response, "_content"):
+            return False
+        encoding = response.headers.get("content-encoding", "identity").strip().lower()
+        return encoding in ("", "identity")
+
+    @staticmethod
+    def _standard_response(message_content: str, tool_calls: list) -> dict:
+        """构造与标准 OpenAI 响应格式相匹配的结构"""
+        return {
+            "choices": [{
+                "message": {
+                    "content": message_content,
+                    "tool_calls": tool_calls
                 }
-
-                self._process_request(request.content, standard_response)
-            else:
-                response_body = json.loads(await response.aread())
-                self._process_request(request.content, response_body)
-
-        return response
+            }]
+        }
+
+    def _process_sse_parser(self, request_content, parser: SSEResponseParser, session: Session = None,
+                            status_code: int = 200, started: float = None):
+        """流式响应结束后，根据解析结果记录对话，started 为发出请求时的 perf_counter"""
+        latency = time.perf_counter() - started if started is not None else None
+        message_content, tool_calls = parser.result()
+        self._process_request(request_content, self._standard_response(message_content, tool_calls), session,
+                              status_code, latency)
+
+    def _process_raw_response(self, request_content, response_content: bytes, session: Session = None, sse: bool = False,
+                              status_code: int = 200, latency: float = None):
+        """解析完整读取的响应体并记录对话，sse 为 True 时按流式响应解析
+
+        响应体不是 JSON 时（例如网关返回的 502 HTML 页面）不影响原请求，按出错的响应记录，采样的保留规则也能看到这次错误
+        """
+        if sse:
+            response_body = self._standard_response(*self._process_sse_response(response_content))
+        else:
+            try:
+                response_body = json.loads(response_content)
+            except Exception as e:
+                print(f"日志记录器出错: {e}")
+                response_body = {"error": {"message": response_content[:1000].decode("utf-8", "replace")}}
+        self._process_request(request_content, response_body, session, status_code, latency)
 
     def _process_sse_response(self, response_content: bytes) -> tuple:
         """处理 SSE 格式的流式响应，提取 assistant 的内容和工具调用
-        
+
         Args:
             response_content: SSE 格式的原始响应内容
-            
+
         Returns:
             提取并合并后的消息内容以及工具调用列表的元组
         """
+        start = time.perf_counter() if self.metrics is not None else 0
         try:
-            # 解码为文本
-            response_text = response_content.decode('utf-8')
-            # 按 SSE 的数据块分割
-            chunks = response_text.split("data: ")
-            full_content = ""
-            all_tool_calls = []
-            current_tool_calls = {}  # 用于收集同一工具调用的不同部分
-
-            for chunk in chunks:
-                if not chunk.strip() or chunk.strip() == "[DONE]":
-                    continue
-
-                try:
-                    # 解析 JSON 数据块
-                    data = json.loads(chunk.strip())
-                    # 提取内容
-                    if "choices" in data and len(data["choices"]) > 0:
-                        choice = data["choices"][0]
-                        delta = choice.get("delta", {})
-
-                        # 处理文本内容
-                        if "content" in delta and delta["content"] is not None:
-                            full_content += delta["content"]
-
-                        # 处理工具调用
-                        if "tool_calls" in delta and delta["tool_calls"]:
-                            for tool_call in delta["tool_calls"]:
-                                tool_index = tool_call.get("index", 0)
-
-                                # 如果是新的工具调用索引，初始化结构
-                                if tool_index not in current_tool_calls:
-                                    current_tool_calls[tool_index] = {
-                                        "id": tool_call.get("id", ""),
-                                        "type": tool_call.get("type", "function"),
-                                        "function": {
-                                            "name": "",
-                                            "arguments": ""
-                                        }
-                                    }
-
-                                # 更新工具调用信息
-                                if "function" in tool_call:
-                                    function = tool_call["function"]
-                                    if "name" in function:
-                                        current_tool_calls[tool_index]["function"]["name"] += function["name"]
-                                    if "arguments" in function:
-                                        current_tool_calls[tool_index]["function"]["arguments"] += function["arguments"]
-
-                        # 检查是否完成
-                        if choice.get("finish_reason") is not None:
-                            # 收集所有完成的工具调用
-                            for tool_call in current_tool_calls.values():
-                                if tool_call["function"]["name"]:  # 仅添加有名称的工具调用
-                                    all_tool_calls.append(tool_call)
-                except json.JSONDecodeError:
-                    logging.warning(f"can not parse SSE chunk: {chunk}")
-                    continue
-
-            # 转换工具调用格式
-            formatted_tool_calls = []
-            for tool_call in all_tool_calls:
-                try:
-                    # 确保参数是有效的 JSON 字符串
-                    args_str = tool_call["function"]["arguments"]
-                    formatted_tool_calls.append({
-                        "function": {
-                            "name": tool_call["function"]["name"],
-                            "arguments": args_str
-                        }
-                    })
-                except json.JSONDecodeError:
-                    logging.warning(f"can not format tool_call: {tool_call}")
-                    formatted_tool_calls.append({
-                        "function": {
-                            "name": tool_call["function"]["name"],
-                            "arguments": "{}"  # 使用空对象作为默认值
-                        }
-                    })
-
-            return full_content, formatted_tool_calls
+            parser = SSEResponseParser()
+            parser.feed(response_content)
+            parser.close()
+            return parser.result()
         except Exception as e:
             print(f"处理 Azure OpenAI 流式响应时出错: {e}")
+            if self.metrics is not None:
+                self.metrics.increment("errors", stage="sse")
             return "", []
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe("sse", time.perf_counter() - start)
+
+
+class AsyncChatLoggerTransport(httpx.AsyncBaseTransport, LoggerTransport):
+    """异步 OpenAI API 请求和响应的传输层"""
+
+    def __init__(
+            self,
+            wrapped_transport: httpx.AsyncBaseTransport,
+            output_dir: str = "logs",
+            stream_capture: bool = True,
+            offload: bool = True,
+            **generator_options,
+    ):
+        LoggerTransport.__init__(self, wrapped_transport, output_dir, stream_capture, offload=offload,
+                                 **generator_options)
+
+    async def handle_async_request(self, request):
+        """处理异步请求，拦截 chat/completions 请求"""
+        return await self._forward_async(self.wrapped_transport, request)
+
+    async def aclose(self) -> None:
+        """关闭传输层，等待日志全部写入，等待期间不阻塞事件循环"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close_logs)
+        await self.wrapped_transport.aclose()
 
 
 class SyncChatLoggerTransport(httpx.BaseTransport, LoggerTransport):
@@ -256,69 +342,193 @@ class SyncChatLoggerTransport(httpx.BaseTransport, LoggerTransport):
             self,
             wrapped_transport: httpx.BaseTransport,
             output_dir: str = "logs",
+            stream_capture: bool = True,
+            **generator_options,
     ):
-        LoggerTransport.__init__(self, wrapped_transport, output_dir)
+        LoggerTransport.__init__(self, wrapped_transport, output_dir, stream_capture, **generator_options)
 
     def handle_request(self, request):
         """处理同步请求，拦截 chat/completions 请求"""
-        # 获取原始响应
-        response = self.wrapped_transport.handle_request(request)
+        return self._forward(self.wrapped_transport, request)
 
-        # 只处理 chat completions 相关的请求
-        if "/chat/completions" in request.url.path:
-            if "text/event-stream" in response.headers.get("content-type", ""):
-                response_content = response.aread()
-                # 处理 SSE 流式响应
-                message_content, tool_calls = self._process_sse_response(response_content)
-
-                # 构造与标准 OpenAI 响应格式相匹配的结构
-                standard_response = {
-                    "choices": [{
-                        "message": {
-                            "content": message_content,
-                            "tool_calls": tool_calls
-                        }
-                    }]
-                }
+    def close(self) -> None:
+        """关闭传输层，等待日志全部写入"""
+        self.close_logs()
+        self.wrapped_transport.close()
 
-                self._process_request(request.content, standard_response)
-            else:
-                response_body = json.loads(response.read())
-                self._process_request(request.content, response_body)
 
-        return response
+class PooledAsyncTransport(httpx.AsyncBaseTransport):
+    """ExporterPool 中的异步客户端传输层，只转发请求，记录由共享的导出器完成"""
+
+    def __init__(self, wrapped_transport: httpx.AsyncBaseTransport, exporter: LoggerTransport):
+        self.wrapped_transport = wrapped_transport
+        self.exporter = exporter
+
+    async def handle_async_request(self, request):
+        return await self.exporter._forward_async(self.wrapped_transport, request)
+
+    async def aclose(self) -> None:
+        """只关闭原始传输层，共享的日志文件由 ExporterPool.close 关闭"""
+        await self.wrapped_transport.aclose()
+
+
+class PooledSyncTransport(httpx.BaseTransport):
+    """ExporterPool 中的同步客户端传输层，只转发请求，记录由共享的导出器完成"""
+
+    def __init__(self, wrapped_transport: httpx.BaseTransport, exporter: LoggerTransport):
+        self.wrapped_transport = wrapped_transport
+        self.exporter = exporter
+
+    def handle_request(self, request):
+        return self.exporter._forward(self.wrapped_transport, request)
+
+    def close(self) -> None:
+        """只关闭原始传输层，共享的日志文件由 ExporterPool.close 关闭"""
+        self.wrapped_transport.close()
+
+
+class ExporterPool:
+    """多个客户端共享的导出器
+
+    池中只有一份导出状态：一个后台写入线程、一个异步导出线程、同一个输出目录和 assets 目录，
+    以及同一套会话路由和对话追踪。接入的客户端各自只持有一个转发请求的传输层，
+    不会各自创建文件、写入页面头部或启动线程。不同客户端的对话仍按会话 ID 和消息前缀区分。
+    """
+
+    BACKENDS = ("html", "jsonl", "compressed")
+
+    def __init__(
+            self,
+            output_dir: str = "logs",
+            backend: str = "html",
+            sampling: SamplingPolicy = None,
+            async_write: bool = False,
+            stream_capture: bool = True,
+            **generator_options,
+    ):
+        """
+        Args:
+            output_dir: 日志输出目录，资源文件写入其中的 assets 目录
+            backend: 记录格式，"html" 直接渲染为 HTML，"jsonl" 只追加消息记录，
+                "compressed" 写入压缩的 HTML，默认 gzip，可以用 compression 选项改为 zstd
+            sampling: 采样策略，默认记录所有对话
+            async_write: 是否由后台线程负责渲染和写入
+            stream_capture: 是否以旁路方式捕获 SSE 流式响应
+            generator_options: LoggerTransport 和 HtmlGenerator 的其他选项，
+                例如按 flush_bytes、flush_interval 攒批刷盘，queue_size、full_policy 控制后台写入队列
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"不支持的记录格式: {backend}")
+        if backend == "jsonl":
+            generator_options["capture_format"] = "jsonl"
+        elif backend == "compressed":
+            generator_options.setdefault("compression", "gzip")
+        self.output_dir = output_dir
+        self.backend = backend
+        self.exporter = LoggerTransport(
+            None,
+            output_dir=output_dir,
+            stream_capture=stream_capture,
+            sampling=sampling,
+            async_write=async_write,
+            **generator_options,
+        )
+
+    def patch_client(self, client: AsyncOpenAI | OpenAI) -> AsyncOpenAI | OpenAI:
+        """让客户端的请求经过池中的导出器记录
 
+        Args:
+            client: 现有的 OpenAI 客户端
 
-# 创建一个装饰器函数
-def with_html_logger(func):
+        Returns:
+            配置了日志记录的 OpenAI 客户端
+        """
+        original_transport = client._client._transport
+        if isinstance(client, AsyncOpenAI):
+            client._client._transport = PooledAsyncTransport(original_transport, self.exporter)
+        elif isinstance(client, OpenAI):
+            client._client._transport = PooledSyncTransport(original_transport, self.exporter)
+        else:
+            raise TypeError(f"不支持的客户端类型: {type(client)}")
+        return client
+
+    def flush(self, timeout: float = None) -> None:
+        """把已记录的内容写入磁盘"""
+        self.exporter.flush(timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """等待日志全部写入并关闭所有文件，之后的请求仍会记录到新文件"""
+        self.exporter.close_logs(timeout)
+
+    async def aclose(self, timeout: float = None) -> None:
+        """close 的异步版本，等待期间不阻塞事件循环"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close, timeout)
+
+
+def with_html_logger(func=None, *, pool: ExporterPool = None, **pool_options):
+    """为返回 OpenAI 客户端的工厂函数添加日志记录
+
+    可以直接作为装饰器使用，也可以传入参数:
+
+        @with_html_logger(output_dir="chat_logs", backend="jsonl", sampling=SamplingPolicy(rate=0.1))
+        def get_client(): ...
+
+    同一个被装饰的工厂函数创建的所有客户端共用一个 ExporterPool，多个工厂函数可以通过 pool 参数共用同一个池。
+    被装饰的函数的 exporter_pool() 返回这个池，例如用于在退出前调用 close
+
+    Args:
+        func: 被装饰的同步或异步工厂函数
+        pool: 使用已有的导出器池，设置后忽略其他选项
+        pool_options: 创建 ExporterPool 的选项，例如 output_dir、backend、sampling、async_write
+    """
     import functools
     import inspect
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        if inspect.iscoroutinefunction(func):
-            async def async_wrapper():
-                client = await func(*args, **kwargs)
-                return OpenAIChatLogger(output_dir="logs").patch_client(client)
-
-            return async_wrapper()
-        else:
-            client = func(*args, **kwargs)
-            return OpenAIChatLogger(output_dir="logs").patch_client(client)
 
-    return wrapper
+    def decorator(func):
+        # 第一次创建客户端时才创建导出器池，只定义不调用的工厂函数不会产生日志文件
+        shared = [pool]
+        lock = threading.Lock()
+
+        def get_pool() -> ExporterPool:
+            with lock:
+                if shared[0] is None:
+                    shared[0] = ExporterPool(**pool_options)
+                return shared[0]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if inspect.iscoroutinefunction(func):
+                async def async_wrapper():
+                    client = await func(*args, **kwargs)
+                    return get_pool().patch_client(client)
+
+                return async_wrapper()
+            else:
+                client = func(*args, **kwargs)
+                return get_pool().patch_client(client)
+
+        wrapper.exporter_pool = get_pool
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
 class OpenAIChatLogger:
     """OpenAI 聊天日志记录器"""
 
-    def __init__(self, output_dir: str = "logs"):
+    def __init__(self, output_dir: str = "logs", stream_capture: bool = True, **generator_options):
         """初始化日志记录器
 
         Args:
             output_dir: 日志输出目录
-            auto_open: 是否自动打开生成的HTML文件
+            stream_capture: 是否以旁路方式捕获 SSE 流式响应，不阻塞调用方读取首个 token
+            generator_options: 透传给 HtmlGenerator 的其他选项，例如 async_write
         """
         self.output_dir = output_dir
+        self.stream_capture = stream_capture
+        self.generator_options = generator_options
 
     def patch_client(self,
                      client: AsyncOpenAI | OpenAI) -> AsyncOpenAI | OpenAI:
@@ -337,11 +547,15 @@ class OpenAIChatLogger:
             logger_transport = AsyncChatLoggerTransport(
                 original_transport,
                 output_dir=self.output_dir,
+                stream_capture=self.stream_capture,
+                **self.generator_options,
             )
         elif isinstance(client, OpenAI):
             logger_transport = SyncChatLoggerTransport(
                 original_transport,
                 output_dir=self.output_dir,
+                stream_capture=self.stream_capture,
+                **self.generator_options,
             )
 
         else:
@@ -0,0 +1,103 @@
+import html
+import re
+from typing import Callable, Optional
+
+# 预编译的图片模式，以字面量开头，正则引擎可以直接跳到候选位置
+_IMAGE_URL = re.compile(r'(https?://\S+\.(?:png|jpg|jpeg|gif|webp))')
+_IMAGE_URL_HTML = r'<div class="image-container"><img src="\1" alt="图片"></div>'
+_IMAGE_BASE64 = re.compile(r'(data:image/(?:png|jpg|jpeg|gif|webp);base64,[a-zA-Z0-9+/]+={0,2})')
+_IMAGE_BASE64_HTML = r'<div class="image-container"><img src="\1" alt="Base64图片"></div>'
+
+
+def _render_code_blocks(text: str, code_block: Optional[Callable[[str, str], str]]) -> str:
+    """定位行首的 ``` 围栏并替换为代码块，只在围栏处切片，不再逐行拆分
+
+    未闭合的代码块连同围栏行及其后的内容一起丢弃
+    """
+    out = []
+    last = 0
+    open_start = -1
+    code_start = 0
+    language = ''
+
+    pos = text.find('```')
+    while pos >= 0:
+        if pos > 0 and text[pos - 1] != '\n':
+            # 不在行首的反引号留给内联代码处理
+            pos = text.find('```', pos + 3)
+            continue
+
+        line_end = text.find('\n', pos)
+        if line_end < 0:
+            line_end = len(text)
+
+        if open_start < 0:
+            open_start = pos
+            language = text[pos + 3:line_end].strip() or 'plaintext'
+            code_start = line_end + 1
+        else:
+            out.append(text[last:open_start])
+            # 代码内容不包含关闭围栏前的换行
+            code = text[code_start:pos - 1] if pos > code_start else ''
+            if code_block is None:
+                out.append(f'<pre><code class="language-{language}">{code}</code></pre>')
+            else:
+                out.append(code_block(code, language))
+            # 关闭围栏行之后的换行保留为分隔符
+            last = line_end
+            open_start = -1
+        pos = text.find('```', line_end)
+
+    if open_start >= 0:
+        tail = text[last:open_start]
+        out.append(tail[:-1] if open_start > 0 else tail)
+    else:
+        out.append(text[last:])
+    return ''.join(out)
+
+
+def render_text(
+        text: str,
+        detect_images: bool = True,
+        code_block: Optional[Callable[[str, str], str]] = None,
+        image_src: Optional[Callable[[str], str]] = None,
+) -> str:
+    """渲染消息文本中的代码块、图片和内联代码
+
+    输出与依次执行 html.escape、代码块检测、图片检测、内联代码检测的结果一致，
+    但每一步都由 str 方法或预编译正则在 C 层完成扫描，且只在文本中出现相应标记时才执行：
+    以 ``` 开头的行开启或关闭代码块；反引号在整段文本（包括代码块内部）中依次配对，
+    未配对的反引号一直作用到末尾。
+
+    Args:
+        text: 原始文本
+        detect_images: 是否把图片 URL 和 Base64 图片替换为 img 标签
+        code_block: 自定义代码块渲染函数，参数为转义后的代码和语言，返回完整的 HTML 片段
+        image_src: 自定义 Base64 图片地址，参数为 data URI，返回 img 标签使用的 src
+
+    Returns:
+        渲染后的 HTML
+    """
+    text = html.escape(text)
+
+    if '```' in text:
+        text = _render_code_blocks(text, code_block)
+
+    if detect_images:
+        if '://' in text:
+            text = _IMAGE_URL.sub(_IMAGE_URL_HTML, text)
+        if 'data:image/' in text:
+            if image_src is None:
+                text = _IMAGE_BASE64.sub(_IMAGE_BASE64_HTML, text)
+            else:
+                text = _IMAGE_BASE64.sub(
+                    lambda match: f'<div class="image-container"><img src="{image_src(match.group(1))}" alt="Base64图片"></div>',
+                    text)
+
+    if '`' in text:
+        # 奇数位置的片段是内联代码
+        parts = text.split('`')
+        parts[1::2] = [f'<code>{part}</code>' for part in parts[1::2]]
+        text = ''.join(parts)
+
+    return text
@@ -0,0 +1,194 @@
+import hashlib
+import json
+from typing import Optional
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def _skip(text: str, pos: int) -> int:
+    """跳过 JSON 空白字符"""
+    while text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def message_digest(raw: bytes) -> str:
+    """单条消息原始 JSON 的摘要"""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class IncrementalRequestParser:
+    """增量解析 chat/completions 请求体
+
+    同一个对话的每次请求都会带上完整的历史消息。解析器记住上一次请求体中截至最后一条消息的字节前缀，
+    新请求体以该前缀开头时直接复用已解析的消息，只对之后新增的消息和其余字段调用 JSON 解析，
+    前缀比较由 C 层的 bytes.startswith 完成。前缀不匹配时（例如新对话）退回到完整解析。
+    返回的消息字典在多次请求之间共享，调用方不应修改。
+    """
+
+    def __init__(self):
+        self._prefix = b""  # 上一次请求体中截至最后一条消息的字节，用 memoryview 避免复制
+        self._head = {}  # messages 之前的字段
+        self._messages = []
+        self._digests = []
+        self._rest_text = None  # messages 之后的原始文本及其解析结果，通常只有 model、tools 等
+        self._rest = {}
+        self.parsed_bytes = 0  # 累计解码和扫描的请求体字节数
+        self.reused = 0  # 最近一次请求中直接复用的开头消息数
+
+    @property
+    def digests(self) -> list:
+        """最近一次请求中每条消息原始 JSON 的摘要，与 messages 一一对应"""
+        return self._digests
+
+    def parse(self, body: bytes) -> dict:
+        """解析请求体，返回与 json.loads 相同的字典"""
+        try:
+            if self._prefix and body.startswith(self._prefix):
+                return self._parse_tail(body)
+            return self._parse_full(body)
+        except (ValueError, IndexError):
+            # 不是预期的结构，按普通 JSON 解析，解析失败时照常抛出异常
+            self.reset()
+            self.parsed_bytes += len(body)
+            return json.loads(body)
+
+    def reset(self) -> None:
+        """清空缓存的前缀"""
+        self._prefix = b""
+        self._head = {}
+        self._messages = []
+        self._digests = []
+        self._rest_text = None
+        self._rest = {}
+        self.reused = 0
+
+    def _parse_full(self, body: bytes) -> dict:
+        self.reset()
+        text = body.decode("utf-8")
+        pos = _skip(text, 0)
+        if text[pos] != "{":
+            raise ValueError("request body is not an object")
+        pos += 1
+
+        # 逐个解析 messages 之前的字段
+        head = {}
+        while True:
+            pos = _skip(text, pos)
+            if text[pos] == "}":
+                # 没有 messages 字段，不缓存
+                self.parsed_bytes += len(body)
+                return head
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos] != ":":
+                raise ValueError("expected ':'")
+            pos = _skip(text, pos + 1)
+            if key == "messages" and text[pos] == "[":
+                pos += 1
+                break
+            head[key], pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos] == ",":
+                pos += 1
+
+        self._head = head
+        return self._parse_messages(body, text, pos, 0)
+
+    def _parse_tail(self, body: bytes) -> dict:
+        base = len(self._prefix)
+        return self._parse_messages(body, body[base:].decode("utf-8"), 0, base)
+
+    def _parse_messages(self, body: bytes, text: str, pos: int, base: int) -> dict:
+        """从 text[pos] 开始解析剩余的消息和字段，text 对应 body[base:]"""
+        messages = self._messages
+        digests = self._digests
+        self.reused = len(messages)
+        boundary = pos  # 最后一条完整消息之后的位置
+        after_item = bool(messages)
+        while True:
+            pos = _skip(text, pos)
+            if text[pos] == "]":
+                pos += 1
+                break
+            if after_item:
+                if text[pos] != ",":
+                    raise ValueError("expected ','")
+                pos = _skip(text, pos + 1)
+            start = pos
+            message, pos = _decoder.raw_decode(text, pos)
+            messages.append(message)
+            digests.append(message_digest(text[start:pos].encode("utf-8")))
+            boundary = pos
+            after_item = True
+
+        rest_text = text[pos:]
+        if rest_text != self._rest_text:
+            self._rest = self._parse_rest(rest_text)
+            self._rest_text = rest_text
+        self.parsed_bytes += len(body) - base
+
+        # 下一次请求只需比较到最后一条消息为止
+        self._prefix = memoryview(body)[:base + len(text[:boundary].encode("utf-8"))]
+        return {**self._head, "messages": list(messages), **self._rest}
+
+    @staticmethod
+    def _parse_rest(text: str) -> dict:
+        """解析 messages 数组之后的字段，text 以 ',' 或 '}' 开头"""
+        rest = {}
+        pos = _skip(text, 0)
+        while text[pos] == ",":
+            pos = _skip(text, pos + 1)
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos] != ":":
+                raise ValueError("expected ':'")
+            rest[key], pos = _decoder.raw_decode(text, _skip(text, pos + 1))
+            pos = _skip(text, pos)
+        if text[pos] != "}" or text[pos + 1:].strip():
+            raise ValueError("unexpected trailing data")
+        return rest
+
+
+def conversation_key(body: bytes) -> Optional[str]:
+    """对话的路由键：开头的 system 消息加上第一条其他消息的摘要
+
+    只对第一条非 system 消息及之前的内容做 JSON 解析，之后的历史消息不解析。请求体不是预期的结构时返回 None
+    """
+    try:
+        text = body.decode("utf-8")
+        pos = _skip(text, 0)
+        if text[pos] != "{":
+            return None
+        pos += 1
+        while True:
+            pos = _skip(text, pos)
+            if text[pos] == "}":
+                return None
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos] != ":":
+                return None
+            pos = _skip(text, pos + 1)
+            if key == "messages" and text[pos] == "[":
+                break
+            _, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos] == ",":
+                pos += 1
+
+        parts = []
+        pos = _skip(text, pos + 1)
+        while text[pos] != "]":
+            start = pos
+            message, pos = _decoder.raw_decode(text, pos)
+            parts.append(text[start:pos])
+            if not isinstance(message, dict) or message.get("role") != "system":
+                return message_digest("\n".join(parts).encode("utf-8"))
+            pos = _skip(text, pos)
+            if text[pos] == ",":
+                pos = _skip(text, pos + 1)
+        return None
+    except (ValueError, IndexError):
+        return None
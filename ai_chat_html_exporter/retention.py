@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+from .compression import compress_file, compression_of
+
+# 每个输出目录只运行一个清理线程
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+class RetentionPolicy:
+    """按时间或目录总大小清理输出目录中的对话文件，在后台线程中定期执行
+
+    超过 max_age 秒的文件按 action 删除或压缩；目录总大小超过 max_total_bytes 时，
+    从最旧的文件开始处理直到低于上限，压缩后仍然超出时删除最旧的压缩文件。
+    当前进程正在写入的文件、最近 min_idle 秒内修改过的文件（可能由其他进程写入）以及 assets 目录中的共享资源不会被处理。
+    """
+
+    ACTIONS = ("delete", "compress")
+
+    def __init__(
+            self,
+            output_dir: str,
+            max_age: float = None,
+            max_total_bytes: int = None,
+            action: str = "delete",
+            interval: float = 600,
+            min_idle: float = 300,
+    ):
+        """
+        Args:
+            output_dir: 输出目录
+            max_age: 文件保留的秒数，按最后修改时间计算
+            max_total_bytes: 目录中对话文件的总大小上限
+            action: 超出限制的文件的处理方式，"delete" 删除，"compress" 压缩为 .gz，已压缩的文件不再处理
+            interval: 两次清理之间的秒数
+            min_idle: 最后修改后至少经过该秒数的文件才会被处理
+        """
+        if action not in self.ACTIONS:
+            raise ValueError(f"不支持的清理方式: {action}")
+        self.output_dir = output_dir
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        self.action = action
+        self.interval = interval
+        self.min_idle = min_idle
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'RetentionPolicy':
+        """启动后台清理线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ai-chat-html-retention", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """停止后台清理线程"""
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.apply()
+            except Exception as e:
+                print(f"清理日志目录时出错: {e}")
+            self._stop.wait(self.interval)
+
+    def apply(self) -> None:
+        """执行一次清理"""
+        files = self._list_files()
+        now = time.time()
+        kept = []
+        for path, mtime, size in files:
+            if self.max_age is not None and now - mtime > self.max_age:
+                self._expire(path)
+            else:
+                kept.append((path, mtime, size))
+
+        if self.max_total_bytes is None:
+            return
+        total = sum(size for _, _, size in kept)
+        # 先压缩最旧的文件，仍然超出时再删除最旧的文件
+        for path, _, size in kept:
+            if total <= self.max_total_bytes:
+                return
+            if self.action == "compress" and compression_of(path) is None:
+                compressed = self._compress(path)
+                if compressed:
+                    total -= size - os.path.getsize(compressed)
+        for path, _, _ in sorted(self._list_files(), key=lambda item: item[1]):
+            if total <= self.max_total_bytes:
+                return
+            size = os.path.getsize(path)
+            os.remove(path)
+            total -= size
+
+    def _list_files(self) -> List[tuple]:
+        """列出可以清理的对话文件 (路径, 修改时间, 大小)，按修改时间从旧到新排序"""
+        from .html_generator import open_file_paths
+
+        in_use = open_file_paths()
+        idle_before = time.time() - self.min_idle
+        files = []
+        stack = [self.output_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != "assets":
+                            stack.append(entry.path)
+                    elif (entry.name.startswith("conversation_") and not entry.name.endswith(".tmp")
+                          and entry.path not in in_use):
+                        # .tmp 是其他进程正在写入的压缩或渲染结果
+                        stat = entry.stat(follow_symlinks=False)
+                        if stat.st_mtime <= idle_before:
+                            files.append((entry.path, stat.st_mtime, stat.st_size))
+        files.sort(key=lambda item: item[1])
+        return files
+
+    def _expire(self, path: str) -> None:
+        if self.action == "compress" and compression_of(path) is None:
+            self._compress(path)
+        elif self.action == "delete":
+            os.remove(path)
+
+    @staticmethod
+    def _compress(path: str) -> Optional[str]:
+        """把文件压缩为 .gz，失败时返回 None"""
+        try:
+            return compress_file(path)
+        except FileNotFoundError:
+            # 其他进程已经处理过
+            return None
+        except Exception as e:
+            logging.warning(f"can not compress {path}: {e}")
+            return None
+
+
+def start_retention(output_dir: str, **options) -> RetentionPolicy:
+    """为输出目录启动清理线程，同一目录只启动一次
+
+    Args:
+        output_dir: 输出目录
+        options: RetentionPolicy 的其他参数
+    """
+    key = os.path.abspath(output_dir)
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = _policies[key] = RetentionPolicy(output_dir, **options).start()
+    return policy
@@ -0,0 +1,186 @@
+import hashlib
+import random
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Iterable, Optional
+
+
+class Outcome:
+    """一次模型调用的结果，用于尾部采样的保留规则"""
+
+    __slots__ = ("error", "tool_calls", "latency", "model")
+
+    def __init__(self, error: bool = False, tool_calls: bool = False, latency: float = None, model: str = None):
+        """
+        Args:
+            error: 调用是否出错，例如 HTTP 状态码不小于 400 或回调收到异常
+            tool_calls: 回复中是否有工具调用
+            latency: 从发出请求到收到完整回复的秒数
+            model: 请求的模型
+        """
+        self.error = error
+        self.tool_calls = tool_calls
+        self.latency = latency
+        self.model = model
+
+
+class MessageBuffer:
+    """尾部采样时暂存未决定是否保留的对话，接口与 HtmlGenerator 的写入方法相同
+
+    只保存消息的原始内容，不渲染也不写入磁盘。超过 max_messages 时丢弃最早的消息，
+    被保留后回放到真正的生成器中，并以分隔线说明省略了多少条消息
+    """
+
+    def __init__(self, max_messages: int, note: str = ""):
+        """
+        Args:
+            max_messages: 暂存的消息数上限
+            note: 回放时写在最前面的说明，例如分叉自未记录的对话
+        """
+        self.note = note
+        self.omitted = 0  # 因超出上限或被回收而丢弃的消息数
+        self._calls = deque(maxlen=max_messages)
+        self._lock = threading.Lock()
+
+    def append_message(self, role: str, content: Any, name: str = None, model: str = None) -> None:
+        with self._lock:
+            if len(self._calls) == self._calls.maxlen:
+                self.omitted += 1
+            self._calls.append(("append_message", (role, content, name, model)))
+
+    def append_divider(self, title: str = "", href: str = None) -> None:
+        with self._lock:
+            self._calls.append(("append_divider", (title, href)))
+
+    def close_html_file(self) -> None:
+        """暂存的内容没有对应的文件，什么都不做"""
+
+    def clear(self) -> None:
+        """释放暂存的消息，之后仍然可以继续暂存"""
+        with self._lock:
+            self.omitted += sum(1 for method, _ in self._calls if method == "append_message")
+            self._calls.clear()
+
+    def replay(self, generator) -> None:
+        """把暂存的内容按顺序写入生成器"""
+        with self._lock:
+            calls = list(self._calls)
+            self._calls.clear()
+            omitted = self.omitted
+        if self.note:
+            generator.append_divider(self.note)
+        if omitted:
+            generator.append_divider(f"———未记录较早的 {omitted} 条消息———")
+        for method, args in calls:
+            getattr(generator, method)(*args)
+
+
+class _Discard:
+    """被采样丢弃的对话写入这里，不保留任何内容"""
+
+    def append_message(self, role: str, content: Any, name: str = None, model: str = None) -> None:
+        pass
+
+    def append_divider(self, title: str = "", href: str = None) -> None:
+        pass
+
+    def close_html_file(self) -> None:
+        pass
+
+
+DISCARD = _Discard()
+
+
+class SamplingPolicy:
+    """决定哪些对话需要导出
+
+    按对话做头部采样：对话第一次出现时以 rate 的概率保留。deterministic 为 True 时用对话标识的哈希决定，
+    同一会话 ID（或同样的开头消息）在所有进程中得到相同的结果；否则随机决定。
+    未被头部采样保留的对话，如果设置了尾部保留规则，先在内存中暂存，某次调用的结果满足任一规则
+    （出错、有工具调用、耗时超过 min_latency、使用 keep_models 中的模型）时写出整个对话，否则不写入任何文件。
+    所有对话共用暂存上限，超过 max_pending 个对话时回收最久未更新的对话的暂存内容。
+    """
+
+    def __init__(
+            self,
+            rate: float = 1.0,
+            deterministic: bool = True,
+            salt: str = "",
+            keep_errors: bool = False,
+            keep_tool_calls: bool = False,
+            min_latency: float = None,
+            keep_models: Iterable[str] = None,
+            max_buffered_messages: int = 200,
+            max_pending: int = 1000,
+    ):
+        """
+        Args:
+            rate: 头部采样保留的比例，0 到 1 之间
+            deterministic: 是否按对话标识的哈希采样，为 False 时随机采样
+            salt: 参与哈希的字符串，修改后得到另一组采样结果
+            keep_errors: 保留出错的对话
+            keep_tool_calls: 保留有工具调用的对话
+            min_latency: 保留单次调用耗时超过该秒数的对话
+            keep_models: 保留使用这些模型的对话
+            max_buffered_messages: 每个对话暂存的消息数上限
+            max_pending: 同时暂存的对话数上限
+        """
+        if not 0 <= rate <= 1:
+            raise ValueError(f"不支持的采样比例: {rate}")
+        self.rate = rate
+        self.deterministic = deterministic
+        self.salt = salt.encode("utf-8")
+        self.keep_errors = keep_errors
+        self.keep_tool_calls = keep_tool_calls
+        self.min_latency = min_latency
+        self.keep_models = frozenset(keep_models or ())
+        self.max_buffered_messages = max_buffered_messages
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # 暂存中的缓冲区，按最近更新排序
+        self._lock = threading.Lock()
+
+    @property
+    def has_tail_rules(self) -> bool:
+        """是否设置了尾部保留规则"""
+        return bool(self.keep_errors or self.keep_tool_calls or self.min_latency is not None or self.keep_models)
+
+    def head_keep(self, key: bytes) -> bool:
+        """头部采样，key 为对话标识"""
+        if self.rate >= 1:
+            return True
+        if self.rate <= 0:
+            return False
+        if not self.deterministic:
+            return random.random() < self.rate
+        digest = hashlib.blake2b(self.salt + key, digest_size=8).digest()
+        return int.from_bytes(digest, "big") < self.rate * 2 ** 64
+
+    def tail_keep(self, outcome: Outcome) -> bool:
+        """调用结果是否满足任一尾部保留规则"""
+        if self.keep_errors and outcome.error:
+            return True
+        if self.keep_tool_calls and outcome.tool_calls:
+            return True
+        if self.min_latency is not None and outcome.latency is not None and outcome.latency >= self.min_latency:
+            return True
+        return bool(outcome.model) and outcome.model in self.keep_models
+
+    def new_buffer(self, note: str = "") -> MessageBuffer:
+        """创建一个暂存对话的缓冲区"""
+        return MessageBuffer(self.max_buffered_messages, note)
+
+    def touch(self, buffer: MessageBuffer) -> None:
+        """标记缓冲区刚被写入，超过暂存上限时回收最久未更新的缓冲区"""
+        evicted = []
+        with self._lock:
+            self._pending[buffer] = None
+            self._pending.move_to_end(buffer)
+            while len(self._pending) > self.max_pending:
+                evicted.append(self._pending.popitem(last=False)[0])
+        for old in evicted:
+            old.clear()
+
+    def release(self, buffer: Optional[MessageBuffer]) -> None:
+        """缓冲区已经回放或不再需要，不再计入暂存上限"""
+        with self._lock:
+            self._pending.pop(buffer, None)
@@ -0,0 +1,200 @@
+import atexit
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+
+from .compression import SUFFIXES
+
+# 索引文件在输出目录中的名称
+INDEX_NAME = "search.db"
+
+# 每个索引文件在进程内只打开一个连接
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Base64 图片不写入索引
+_DATA_URI = re.compile(r"data:[\w.+-]+/[\w.+-]+;base64,[A-Za-z0-9+/=\s]+")
+
+
+def message_text(record: dict) -> tuple:
+    """从 message_record 生成的消息记录中提取可检索的文本，返回 (文本, 工具名称列表)"""
+    parts = []
+    _collect_text(record.get("content"), parts)
+    tool_names = []
+    for tool_call in record.get("tool_calls") or []:
+        tool_names.append(str(tool_call["name"]))
+        _collect_text(tool_call["arguments"], parts)
+    return _DATA_URI.sub("[image]", "\n".join(part for part in parts if part)), tool_names
+
+
+def _collect_text(value: Any, parts: list) -> None:
+    if value is None:
+        return
+    if isinstance(value, str):
+        parts.append(value)
+    elif isinstance(value, list):
+        # 多模态消息的各个部分只取文本
+        for item in value:
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                continue
+            if isinstance(item, dict) and "text" in item:
+                item = item["text"]
+            _collect_text(item, parts)
+    else:
+        parts.append(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class SearchIndex:
+    """输出目录旁的 SQLite FTS5 全文索引
+
+    每条消息写入文件时记录一行：文件路径（相对于索引所在目录）、消息在文件中的字节偏移和长度、角色、模型、
+    工具名称和文本。压缩写入的文件中偏移量按解压后的内容计算。使用 trigram 分词，中文和代码都可以按子串检索，
+    SQLite 不支持 trigram 时退回默认分词。插入在事务中累积，超过 commit_rows 行或 commit_interval 秒时提交，
+    多个进程可以同时写入同一个索引
+    """
+
+    def __init__(self, path: str, commit_rows: int = 500, commit_interval: float = 1.0):
+        """
+        Args:
+            path: 索引文件路径
+            commit_rows: 累积多少行后提交
+            commit_interval: 距上次提交超过该秒数时，在下一次插入后提交
+        """
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = "text, role, model, tools, file UNINDEXED, offset UNINDEXED, length UNINDEXED, ts UNINDEXED"
+        try:
+            self._conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5({columns}, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            self._conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5({columns})")
+        self._conn.commit()
+        self.trigram = "trigram" in self._conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'messages'").fetchone()[0]
+        atexit.register(self.close)
+
+    def add(self, file: str, offset: int, length: int, record: dict) -> None:
+        """索引一条消息
+
+        Args:
+            file: 消息所在文件
+            offset: 消息在文件中的字节偏移
+            length: 消息占用的字节数
+            record: message_record 生成的消息记录
+        """
+        text, tool_names = message_text(record)
+        row = (text, record.get("role", ""), record.get("model", ""), " ".join(tool_names),
+               os.path.relpath(os.path.abspath(file), self.root), offset, length, record.get("ts", time.time()))
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._pending += 1
+            if self._pending >= self.commit_rows or time.monotonic() - self._last_commit >= self.commit_interval:
+                self._commit()
+
+    def _commit(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def flush(self) -> None:
+        """提交累积的插入"""
+        with self._lock:
+            if self._conn is not None and self._pending:
+                self._commit()
+
+    def close(self) -> None:
+        """提交并关闭连接"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._commit()
+            self._conn.close()
+            self._conn = None
+        atexit.unregister(self.close)
+
+    def search(self, query: str, limit: int = 20, role: str = None, model: str = None) -> List[dict]:
+        """检索消息
+
+        query 按空白拆分为多个词，每个词作为子串匹配，所有词都出现的消息才会命中。
+        trigram 分词下少于 3 个字符的词无法使用索引，改为逐行匹配。被删除的文件不会出现在结果中，
+        之后被压缩的文件返回压缩后的路径，偏移量仍按解压后的内容计算
+
+        Args:
+            query: 检索词
+            limit: 最多返回的条数
+            role: 只返回该角色的消息
+            model: 只返回该模型的消息
+
+        Returns:
+            命中的消息列表，每项包含 file、offset、length、role、model、tools、snippet
+        """
+        terms = query.split()
+        min_chars = 3 if self.trigram else 1
+        matched = [term for term in terms if len(term) >= min_chars]
+        scanned = [term for term in terms if len(term) < min_chars]
+
+        conditions, params = [], []
+        if matched:
+            conditions.append("messages MATCH ?")
+            params.append(" ".join('"' + term.replace('"', '""') + '"' for term in matched))
+        for term in scanned:
+            conditions.append("text LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([%_\\])", r"\\\1", term) + "%")
+        if role:
+            conditions.append("role = ?")
+            params.append(role)
+        if model:
+            conditions.append("model = ?")
+            params.append(model)
+
+        snippet = "snippet(messages, 0, '[', ']', '…', 16)" if matched else "substr(text, 1, 80)"
+        order = "rank" if matched else "rowid DESC"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT file, offset, length, role, model, tools, {snippet} FROM messages {where} ORDER BY {order}"
+
+        hits = []
+        with self._lock:
+            # 先提交本进程累积的插入，检索结果包含刚写入的消息
+            if self._pending:
+                self._commit()
+            # 逐行读取，跳过已删除的文件直到凑够 limit 条
+            for file, offset, length, role, model, tools, text in self._conn.execute(sql, params):
+                path = self._resolve(file)
+                if path is None:
+                    continue
+                hits.append({"file": path, "offset": offset, "length": length, "role": role,
+                             "model": model, "tools": tools.split(), "snippet": " ".join(text.split())})
+                if len(hits) >= limit:
+                    break
+        return hits
+
+    def _resolve(self, file: str) -> Optional[str]:
+        """返回文件现在的路径，文件已被压缩时返回压缩文件，已被删除时返回 None"""
+        path = os.path.join(self.root, file)
+        for candidate in (path, *(path + suffix for suffix in SUFFIXES.values())):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+
+def open_index(output_dir: str) -> SearchIndex:
+    """打开输出目录的索引，同一进程中的生成器共用一个连接"""
+    key = os.path.abspath(os.path.join(output_dir, INDEX_NAME))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index._conn is None:
+            index = _indexes[key] = SearchIndex(key)
+    return index
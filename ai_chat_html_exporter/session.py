@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import functools
+import hashlib
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .compression import SUFFIXES, split_name
+from .html_generator import HtmlGenerator
+from .request_parser import IncrementalRequestParser, conversation_key
+from .sampling import SamplingPolicy
+from .tracker import ConversationFiles, ConversationTracker
+
+# 当前上下文所属的会话，asyncio 任务和线程各自独立
+current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "ai_chat_html_exporter_session", default=None)
+
+
+@contextlib.contextmanager
+def chat_session(session_id: str):
+    """在上下文中指定会话 ID，其中通过同一个客户端发出的请求写入该会话自己的文件
+
+    Args:
+        session_id: 会话 ID
+    """
+    token = current_session.set(session_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+
+class Session:
+    """一个会话的独立状态：增量解析器、对话追踪、输出文件以及保护它们的锁"""
+
+    def __init__(self, key: Optional[str], generator: HtmlGenerator, sampling: SamplingPolicy = None,
+                 opener: Callable[[], None] = None):
+        self.key = key
+        self.generator = generator
+        self.parser = IncrementalRequestParser()
+        self.tracker = ConversationTracker()
+        self.files = ConversationFiles(generator, sampling, key, opener)
+        self.lock = threading.Lock()
+
+    def close(self, timeout: float = None) -> None:
+        """关闭会话的分叉文件和主文件"""
+        with self.lock:
+            self.files.close(timeout)
+            if self.generator.html_file:
+                self.generator.close_html_file()
+            self.generator.close(timeout)
+
+    def release(self) -> None:
+        """暂时关闭会话的主文件和分叉文件的句柄，会话状态保留，下一次写入时重新打开"""
+        with self.lock:
+            self.files.release()
+            self.generator.release_handle()
+
+
+class SessionRouter:
+    """把请求路由到各自的会话
+
+    会话 ID 依次取自 chat_session 设置的上下文变量、请求头；prefix 模式下两者都没有时，
+    以开头的 system 消息和第一条其他消息的摘要区分会话。找不到会话 ID 的请求写入默认会话（主文件）。
+    全局锁只保护会话表的查找和插入，解析和写入只持有各自会话的锁，不同会话之间互不阻塞。
+    会话的文件在第一次有对话需要写入时才创建，被采样丢弃的会话不会产生文件。
+    会话状态和文件句柄分开限制：只有最近使用的 max_open_files 个会话保持句柄打开（每个会话最多占用主文件和
+    一个分叉文件两个描述符），其余会话的句柄暂时关闭，再次写入时重新打开，会话数较多时也不会超过进程的文件描述符上限。
+    """
+
+    MODES = ("auto", "prefix", "single")
+
+    def __init__(
+            self,
+            root: HtmlGenerator,
+            mode: str = "auto",
+            header: str = "x-chat-session",
+            max_sessions: int = 1024,
+            sampling: SamplingPolicy = None,
+            max_open_files: int = 64,
+    ):
+        """
+        Args:
+            root: 主文件的生成器，默认会话直接写入它，其他会话的文件由它派生
+            mode: 路由方式，"auto" 按上下文变量和请求头，"prefix" 另外按消息前缀，"single" 所有请求写入默认会话
+            header: 携带会话 ID 的请求头，转发前会被移除
+            max_sessions: 保留状态的会话数上限，超过后关闭最久未使用的会话
+            sampling: 采样策略，设置会话 ID 的会话整体作为一个采样单位
+            max_open_files: 保持文件句柄打开的会话数上限，应明显小于进程的文件描述符上限
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的会话路由方式: {mode}")
+        self.root = root
+        self.mode = mode
+        self.header = header
+        self.max_sessions = max_sessions
+        self.max_open_files = max_open_files
+        self.sampling = sampling
+        self.default = Session(None, root, sampling)
+        self._sessions = OrderedDict()
+        self._open = OrderedDict()  # 文件句柄可能仍然打开的会话，按最近使用排序
+        self._lock = threading.Lock()
+
+    def route(self, request) -> Session:
+        """返回请求所属的会话"""
+        key = self._session_key(request)
+        if key is None:
+            return self.default
+
+        evicted = idle = None
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+            else:
+                session = Session(key, self.root.spawn(), self.sampling)
+                session.files.opener = functools.partial(self.open, session)
+                self._sessions[key] = session
+                if len(self._sessions) > self.max_sessions:
+                    evicted_key, evicted = self._sessions.popitem(last=False)
+                    self._open.pop(evicted_key, None)
+            self._open[key] = session
+            self._open.move_to_end(key)
+            if len(self._open) > self.max_open_files:
+                _, idle = self._open.popitem(last=False)
+
+        if evicted is not None:
+            evicted.close()
+        if idle is not None:
+            idle.release()
+        return session
+
+    def open(self, session: Session) -> None:
+        """在会话第一次写入时创建它的文件，调用方需持有会话的锁"""
+        if session.generator.html_file is None:
+            label = self._file_label(session.key)
+            if self.root.html_file:
+                stem, suffix = split_name(self.root.html_file)
+                session.generator.create_html_file(self._claim_file(f"{stem}_{label}", suffix))
+            else:
+                # 主文件延迟创建，还没有文件名时会话文件单独生成唯一的文件名
+                generator = session.generator
+                generator.create_html_file(generator._new_file_path(generator._file_suffix(), label))
+
+    @staticmethod
+    def _claim_file(stem: str, suffix: str) -> str:
+        """以 O_EXCL 方式创建会话文件并返回路径
+
+        被回收的会话再次出现时原来的文件已经存在（关闭时压缩的文件只剩压缩后的文件），
+        依次加上序号，不会覆盖之前写入的内容
+        """
+        for number in itertools.count(1):
+            path = f"{stem}{'' if number == 1 else f'_{number}'}{suffix}"
+            if any(os.path.exists(path + extension) for extension in SUFFIXES.values()):
+                continue
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return path
+            except FileExistsError:
+                continue
+
+    def close(self, timeout: float = None) -> None:
+        """关闭所有会话，默认会话的主文件由调用方关闭"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._open.clear()
+        for session in sessions:
+            session.close(timeout)
+        with self.default.lock:
+            self.default.files.close(timeout)
+
+    def _session_key(self, request) -> Optional[str]:
+        if self.mode == "single":
+            return None
+        key = current_session.get()
+        if self.header and self.header in request.headers:
+            # 会话 ID 只在本地使用，不转发给服务端
+            key = key or request.headers[self.header]
+            del request.headers[self.header]
+        if key is None and self.mode == "prefix":
+            digest = conversation_key(request.content)
+            key = f"p{digest[:12]}" if digest else None
+        return key
+
+    @staticmethod
+    def _file_label(key: str) -> str:
+        """把会话 ID 转为可以放进文件名的标签"""
+        label = re.sub(r"[^A-Za-z0-9_-]", "", key)[:40]
+        if label != key:
+            label = f"{label}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+        return label
@@ -0,0 +1,197 @@
+import json
+import logging
+import time
+from typing import Callable
+
+import httpx
+
+
+class SSEResponseParser:
+    """增量式 SSE 解析器，逐块接收响应字节并还原 assistant 的内容和工具调用"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._pending = []  # 缓冲区之后还没有遇到换行的数据块
+        self._data_lines = []
+        self._content_parts = []
+        self._current_tool_calls = {}  # 用于收集同一工具调用的不同部分
+        self._finished_tool_calls = []
+        self._closed = False
+
+    def feed(self, chunk: bytes) -> None:
+        """喂入一段原始响应字节，解析其中所有完整的行"""
+        if not chunk:
+            return
+        if b"\n" not in chunk:
+            # 很长的一行分成多块到达时先暂存，换行到达后再一次拼接，避免反复复制已缓冲的数据
+            self._pending.append(chunk)
+            return
+        if self._pending:
+            self._pending.append(chunk)
+            chunk = b"".join(self._pending)
+            self._pending = []
+        # 只处理完整的行，剩余部分留到下一次
+        *lines, rest = (self._buffer + chunk).split(b"\n")
+        self._buffer = rest
+        for line in lines:
+            self._feed_line(line)
+
+    def close(self) -> None:
+        """流结束，处理缓冲区中剩余的数据"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._pending:
+            self._buffer += b"".join(self._pending)
+            self._pending = []
+        if self._buffer:
+            self._feed_line(self._buffer)
+            self._buffer = b""
+        self._dispatch()
+
+    def result(self) -> tuple:
+        """返回提取并合并后的消息内容以及工具调用列表的元组"""
+        formatted_tool_calls = []
+        for tool_call in self._finished_tool_calls:
+            formatted_tool_calls.append({
+                "function": {
+                    "name": "".join(tool_call["name"]),
+                    "arguments": "".join(tool_call["arguments"])
+                }
+            })
+        return "".join(self._content_parts), formatted_tool_calls
+
+    def _feed_line(self, line: bytes) -> None:
+        line = line.rstrip(b"\r")
+        if not line:
+            # 空行表示一个事件结束
+            self._dispatch()
+        elif line.startswith(b"data:"):
+            data = line[5:]
+            if data.startswith(b" "):
+                data = data[1:]
+            self._data_lines.append(data)
+        # event:、id:、retry: 以及注释行与内容无关，直接忽略
+
+    def _dispatch(self) -> None:
+        if not self._data_lines:
+            return
+        data = b"\n".join(self._data_lines).strip()
+        self._data_lines = []
+        if not data or data == b"[DONE]":
+            return
+
+        try:
+            # 解析 JSON 数据块
+            self._handle_event(json.loads(data))
+        except json.JSONDecodeError:
+            logging.warning(f"can not parse SSE chunk: {data!r}")
+
+    def _handle_event(self, data: dict) -> None:
+        if not data.get("choices"):
+            return
+        choice = data["choices"][0]
+        delta = choice.get("delta") or {}
+
+        # 处理文本内容
+        if delta.get("content") is not None:
+            self._content_parts.append(delta["content"])
+
+        # 处理工具调用
+        for tool_call in delta.get("tool_calls") or []:
+            tool_index = tool_call.get("index", 0)
+
+            # 如果是新的工具调用索引，初始化结构
+            if tool_index not in self._current_tool_calls:
+                self._current_tool_calls[tool_index] = {"name": [], "arguments": []}
+
+            # 更新工具调用信息
+            function = tool_call.get("function") or {}
+            if function.get("name"):
+                self._current_tool_calls[tool_index]["name"].append(function["name"])
+            if function.get("arguments"):
+                self._current_tool_calls[tool_index]["arguments"].append(function["arguments"])
+
+        # 检查是否完成，收集所有完成的工具调用（仅添加有名称的工具调用）
+        if choice.get("finish_reason") is not None:
+            for tool_call in self._current_tool_calls.values():
+                if tool_call["name"]:
+                    self._finished_tool_calls.append(tool_call)
+            self._current_tool_calls = {}
+
+
+class _TeeStreamBase:
+    """把响应字节流原样交给调用方，同时喂给 SSE 解析器"""
+
+    def __init__(
+            self,
+            stream,
+            parser: SSEResponseParser,
+            on_complete: Callable[[SSEResponseParser], None],
+            metrics=None,
+    ):
+        self._stream = stream
+        self._parser = parser
+        self._on_complete = on_complete
+        self._completed = False
+        self._metrics = metrics
+        self._parse_seconds = 0.0  # 开启指标时累计的解析耗时，流结束时一次记录
+
+    def _feed(self, chunk: bytes) -> None:
+        start = time.perf_counter() if self._metrics is not None else 0
+        try:
+            self._parser.feed(chunk)
+        except Exception as e:
+            print(f"解析 SSE 流式响应时出错: {e}")
+            if self._metrics is not None:
+                self._metrics.increment("errors", stage="sse")
+        if self._metrics is not None:
+            self._parse_seconds += time.perf_counter() - start
+
+    def _complete(self) -> None:
+        # 流读完或被关闭时只回调一次
+        if self._completed:
+            return
+        self._completed = True
+        try:
+            start = time.perf_counter() if self._metrics is not None else 0
+            self._parser.close()
+            if self._metrics is not None:
+                self._metrics.observe("sse", self._parse_seconds + time.perf_counter() - start)
+            self._on_complete(self._parser)
+        except Exception as e:
+            print(f"处理 SSE 流式响应时出错: {e}")
+            if self._metrics is not None:
+                self._metrics.increment("errors", stage="sse")
+
+
+class AsyncTeeStream(_TeeStreamBase, httpx.AsyncByteStream):
+    """异步响应流的旁路捕获"""
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._feed(chunk)
+            yield chunk
+        self._complete()
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._complete()
+
+
+class SyncTeeStream(_TeeStreamBase, httpx.SyncByteStream):
+    """同步响应流的旁路捕获"""
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._feed(chunk)
+            yield chunk
+        self._complete()
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._complete()
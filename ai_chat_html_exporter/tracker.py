@@ -0,0 +1,256 @@
+import hashlib
+import os
+from typing import Any, Callable, List
+
+from .assets import relative_url
+from .compression import split_name
+from .html_generator import HtmlGenerator
+from .sampling import DISCARD, Outcome, SamplingPolicy
+
+
+def _chain(previous: bytes, digest: str) -> bytes:
+    """滚动哈希：前缀哈希与下一条消息摘要的哈希"""
+    return hashlib.blake2b(previous + digest.encode("ascii"), digest_size=16).digest()
+
+
+class Conversation:
+    """一个被追踪的对话，chain[i] 为前 i + 1 条消息的前缀哈希"""
+
+    def __init__(self, chain: List[bytes], parent: 'Conversation' = None, fork_index: int = 0):
+        self.chain = chain
+        self.parent = parent
+        self.fork_index = fork_index  # 从父对话的第几条消息之后分叉
+        self.responded = False  # 最近一次请求的回复是否已经记录，下一次请求会把它作为 assistant 消息带回
+        self.target: Any = None  # 调用方关联的对象，例如写入该对话的 HtmlGenerator
+        self.title = ""  # 展示用的标题
+        self.key = b""  # 对话标识：截至第一条非 system 消息的前缀哈希，分叉沿用父对话的标识
+        self.buffer = None  # 采样时暂存对话的缓冲区，还没有决定是否保留
+        self.dropped = False  # 是否已被采样丢弃
+
+    def __len__(self) -> int:
+        return len(self.chain)
+
+
+class TrackResult:
+    """一次请求的追踪结果
+
+    kind 为 "continue"（延续已有对话）、"new"（新对话）或 "fork"（从已有对话的中间分叉），
+    start 为第一条需要写入的消息下标
+    """
+
+    __slots__ = ("kind", "conversation", "start")
+
+    def __init__(self, kind: str, conversation: Conversation, start: int):
+        self.kind = kind
+        self.conversation = conversation
+        self.start = start
+
+
+class ConversationTracker:
+    """基于消息前缀滚动哈希的对话追踪
+
+    为每个对话的每个前缀位置记录滚动哈希，新请求按最长的已知前缀归属到对应对话：
+    前缀恰好是某个对话的全部消息时为延续，只写入之后的新消息；前缀落在对话中间时为分叉；
+    没有已知前缀，或已知前缀只包含 system 消息（多个任务共用同一个系统提示词）时为新对话。
+    """
+
+    def __init__(self, max_prefixes: int = 1_000_000):
+        """
+        Args:
+            max_prefixes: 记录的前缀哈希上限，超过后清空，之后再出现的旧对话按新对话处理
+        """
+        self.max_prefixes = max_prefixes
+        self._index = {}  # 前缀哈希 -> (对话, 前缀长度)
+        self._last_chain = []  # 上一次请求的前缀哈希，配合解析器复用的消息数避免重新计算
+
+    def track(self, digests: List[str], leading_system: int = 0, reused: int = 0) -> TrackResult:
+        """追踪一次请求
+
+        Args:
+            digests: 请求中每条消息的摘要
+            leading_system: 开头连续的 system 消息数
+            reused: 与上一次请求相同的开头消息数，这部分前缀哈希直接复用
+
+        Returns:
+            追踪结果
+        """
+        chain = self._last_chain[:min(reused, len(self._last_chain))]
+        previous = chain[-1] if chain else b""
+        for digest in digests[len(chain):]:
+            previous = _chain(previous, digest)
+            chain.append(previous)
+        self._last_chain = chain
+
+        # 从后往前找最长的已知前缀，延续对话时第一次查找就会命中
+        known = 0
+        conversation = None
+        for length in range(len(chain), 0, -1):
+            entry = self._index.get(chain[length - 1])
+            if entry is not None:
+                conversation, known = entry
+                break
+
+        if conversation is not None and known == len(conversation):
+            self._extend(conversation, chain)
+            return TrackResult("continue", conversation, known)
+
+        if conversation is None or known <= leading_system:
+            conversation = Conversation([])
+            self._extend(conversation, chain)
+            if chain:
+                conversation.key = chain[min(leading_system, len(chain) - 1)]
+            return TrackResult("new", conversation, 0)
+
+        fork = Conversation(chain[:known], parent=conversation, fork_index=known)
+        fork.key = conversation.key
+        self._extend(fork, chain)
+        return TrackResult("fork", fork, known)
+
+    def _extend(self, conversation: Conversation, chain: List[bytes]) -> None:
+        """把新请求中超出对话已有长度的前缀哈希加入对话"""
+        first = len(conversation) + 1
+        if len(self._index) + len(chain) > self.max_prefixes:
+            # 只保留当前对话
+            self._index.clear()
+            first = 1
+        for length in range(first, len(chain) + 1):
+            prefix = chain[length - 1]
+            # 共享的前缀仍然归属最早的对话
+            self._index.setdefault(prefix, (conversation, length))
+        conversation.chain = chain
+
+
+class ConversationFiles:
+    """决定每个被追踪的对话写入哪个文件
+
+    新对话和原来一样写入主文件并以 Step 分隔线隔开；分叉的对话写入新文件，开头链接到父对话所在的文件，
+    只写入分叉之后的消息。切换到其他文件后，上一个分叉文件的句柄暂时关闭，再次写入时重新打开，
+    重试或重新生成产生大量分叉时也不会占满文件描述符。设置了采样策略时，对话第一次出现时决定写入文件、暂存或丢弃，
+    暂存的对话在 finish 收到满足保留规则的结果后才分配文件
+    """
+
+    def __init__(
+            self,
+            root: HtmlGenerator,
+            sampling: SamplingPolicy = None,
+            key: str = None,
+            opener: Callable[[], None] = None,
+    ):
+        """
+        Args:
+            root: 主文件的生成器，分叉文件由它派生
+            sampling: 采样策略，默认记录所有对话
+            key: 会话 ID，设置时整个会话作为一个采样单位
+            opener: 第一次需要写入主文件之前调用，用于延迟创建主文件
+        """
+        self.root = root
+        self.sampling = sampling
+        self.key = key
+        self.opener = opener
+        self._buffers = set()  # 暂存中的对话缓冲区，关闭时释放
+        self._step = 0  # 记录对话步骤
+        self._is_first_conversation = True  # 是否是第一次对话
+        self._forks = []  # 分叉对话各自的生成器
+        self._active = {}  # 每个生成器最近写入的对话
+        self._open_fork = None  # 句柄仍然打开的分叉生成器
+
+    def generator_for(self, result: TrackResult) -> Any:
+        """返回对话所写入的生成器，必要时添加分隔线或创建分叉文件
+
+        采样暂存中的对话返回缓冲区，被丢弃的对话返回不保留内容的空对象，两者的写入接口与生成器相同
+        """
+        conversation = result.conversation
+        if conversation.target is not None:
+            generator = conversation.target
+            if self._active.get(generator) is not conversation:
+                # 同一文件中穿插了其他对话，回到这个对话时标注出来
+                generator.append_divider(f"———继续 {conversation.title}———")
+                self._active[generator] = conversation
+            return self._switch_to(generator)
+        if conversation.dropped:
+            return DISCARD
+        if conversation.buffer is not None:
+            self.sampling.touch(conversation.buffer)
+            return conversation.buffer
+
+        sampling = self.sampling
+        if sampling is not None and not sampling.head_keep(self.key.encode("utf-8") if self.key else conversation.key):
+            if not sampling.has_tail_rules:
+                conversation.dropped = True
+                return DISCARD
+            note = ""
+            if conversation.parent is not None and conversation.parent.target is None:
+                note = f"———分叉自未记录的对话的第 {conversation.fork_index} 条消息———"
+            conversation.buffer = sampling.new_buffer(note)
+            self._buffers.add(conversation.buffer)
+            sampling.touch(conversation.buffer)
+            return conversation.buffer
+        return self._assign(conversation)
+
+    def target_of(self, conversation: Conversation) -> Any:
+        """对话当前的写入目标：生成器、暂存的缓冲区或丢弃内容的空对象"""
+        if conversation.target is not None:
+            return conversation.target
+        return conversation.buffer if conversation.buffer is not None else DISCARD
+
+    def finish(self, conversation: Conversation, outcome: Outcome) -> None:
+        """一次调用结束，暂存的对话满足保留规则时分配文件并写出暂存的内容"""
+        buffer = conversation.buffer
+        if buffer is None or not self.sampling.tail_keep(outcome):
+            return
+        conversation.buffer = None
+        self._buffers.discard(buffer)
+        self.sampling.release(buffer)
+        buffer.replay(self._assign(conversation))
+
+    def _assign(self, conversation: Conversation) -> HtmlGenerator:
+        """为第一次写入的对话分配生成器"""
+        if self.opener is not None and not self.root.html_file:
+            self.opener()
+        if conversation.parent is not None and conversation.parent.target is not None:
+            parent = conversation.parent.target
+            generator = self.root.spawn()
+            # 以主文件名加序号命名，同一秒内分叉也不会与主文件重名
+            stem, suffix = split_name(self.root.html_file)
+            generator.create_html_file(f"{stem}_fork{len(self._forks) + 1}{suffix}")
+            generator.append_divider(
+                f"———分叉自 {os.path.basename(parent.html_file)} 的第 {conversation.fork_index} 条消息———",
+                relative_url(parent.html_file, generator.html_file),
+            )
+            self._forks.append(generator)
+            conversation.title = f"{conversation.parent.title} 分叉 {len(self._forks)}"
+        else:
+            # 如果是新的对话但不是第一次对话，添加分隔线
+            if not self._is_first_conversation:
+                self._step += 1
+                self.root.append_divider(f"———Step {self._step}———")
+            self._is_first_conversation = False
+            generator = self.root
+            conversation.title = f"Step {self._step}"
+
+        conversation.target = generator
+        self._active[generator] = conversation
+        return self._switch_to(generator)
+
+    def _switch_to(self, generator: HtmlGenerator) -> HtmlGenerator:
+        """切换写入的文件，离开的分叉文件暂时关闭句柄"""
+        previous = self._open_fork
+        self._open_fork = generator if generator is not self.root else None
+        if previous is not None and previous is not generator:
+            previous.release_handle()
+        return generator
+
+    def release(self) -> None:
+        """暂时关闭所有分叉文件的句柄，之后写入时重新打开"""
+        if self._open_fork is not None:
+            self._open_fork.release_handle()
+            self._open_fork = None
+
+    def close(self, timeout: float = None) -> None:
+        """刷盘并关闭分叉文件，主文件由调用方关闭，未被保留的暂存对话直接丢弃"""
+        for generator in self._forks:
+            generator.close(timeout)
+        if self.sampling is not None:
+            for buffer in self._buffers:
+                self.sampling.release(buffer)
+            self._buffers.clear()
@@ -0,0 +1,174 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Callable
+
+
+class BackgroundWriter:
+    """后台写入线程，从有界队列中取出任务并依次执行，保证调用线程不接触磁盘"""
+
+    FULL_POLICIES = ("block", "drop", "spill")
+
+    def __init__(
+            self,
+            queue_size: int = 1000,
+            full_policy: str = "block",
+            name: str = "ai-chat-html-writer",
+            metrics=None,
+            max_spill: int = None,
+    ):
+        """初始化后台写入线程
+
+        Args:
+            queue_size: 队列容量
+            full_policy: 队列满时的策略，block 阻塞等待，drop 丢弃任务，spill 溢出到内存缓冲区，
+                缓冲区也满时丢弃任务（不可丢弃的任务等待缓冲区腾出空间）
+            name: 线程名称
+            metrics: 指标回调，任务出错时累加 errors，等待执行的任务数变化时更新 queue_depth
+            max_spill: spill 策略下溢出缓冲区的任务数上限，默认为队列容量的 10 倍
+        """
+        if full_policy not in self.FULL_POLICIES:
+            raise ValueError(f"不支持的队列满策略: {full_policy}")
+        self.full_policy = full_policy
+        self.dropped = 0  # 被丢弃的任务数
+        self.errors = 0  # 执行出错的任务数
+        self.metrics = metrics
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._overflow = deque()
+        self._overflow_lock = threading.Lock()
+        self._overflow_cond = threading.Condition(self._overflow_lock)  # 溢出区腾出空间时通知
+        self.max_spill = max_spill if max_spill is not None else queue_size * 10
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, func: Callable, *args, **kwargs) -> bool:
+        """提交一个任务，返回任务是否被接受
+
+        写入线程关闭后（例如进程退出阶段）提交的任务直接在调用线程执行
+        """
+        return self._submit((func, args, kwargs), droppable=True)
+
+    def submit_required(self, func: Callable, *args, **kwargs) -> None:
+        """提交一个不可丢弃的任务（例如刷盘、关闭文件），队列满时总是等待"""
+        self._submit((func, args, kwargs), droppable=False)
+
+    def _submit(self, task: tuple, droppable: bool) -> bool:
+        if self._closed:
+            func, args, kwargs = task
+            func(*args, **kwargs)
+            return True
+        with self._pending_cond:
+            self._pending += 1
+            self._update_gauge()
+
+        if self.full_policy == "block" or (self.full_policy == "drop" and not droppable):
+            self._queue.put(task)
+            return True
+
+        with self._overflow_lock:
+            while True:
+                # 一旦开始溢出，后续任务也进入溢出区，保证写入顺序
+                if not self._overflow:
+                    try:
+                        self._queue.put_nowait(task)
+                        return True
+                    except queue.Full:
+                        pass
+                if self.full_policy != "spill":
+                    break
+                # 写入线程自己提交的任务不能等待自己腾出空间
+                if len(self._overflow) < self.max_spill or (
+                        not droppable and threading.current_thread() is self._thread):
+                    self._overflow.append(task)
+                    return True
+                if droppable:
+                    break
+                # 不可丢弃的任务等待溢出区腾出空间后重新尝试，其间溢出区可能已经清空，需要先放入队列
+                self._overflow_cond.wait()
+
+        self._task_done()
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning(f"html writer queue is full, {self.dropped} tasks dropped")
+        return False
+
+    @property
+    def queue_depth(self) -> int:
+        """当前等待执行的任务数"""
+        return self._pending
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待已提交的任务全部执行完毕，返回是否在超时前完成"""
+        if threading.current_thread() is self._thread:
+            return True
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """等待队列清空后停止后台线程"""
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        # 等待超时时队列或溢出区中可能还有任务，结束标记排在它们之后，写入线程执行完剩余任务再退出
+        with self._overflow_lock:
+            if self._overflow:
+                self._overflow.append(None)
+            else:
+                try:
+                    self._queue.put_nowait(None)
+                except queue.Full:
+                    self._overflow.append(None)
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def _next_task(self):
+        with self._overflow_lock:
+            spilled = bool(self._overflow)
+        if spilled:
+            # 队列中的任务总是早于溢出区的任务，先取队列
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            with self._overflow_lock:
+                if self._overflow:
+                    task = self._overflow.popleft()
+                    self._overflow_cond.notify_all()
+                    return task
+        return self._queue.get()
+
+    def _run(self) -> None:
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"后台写入日志时出错: {e}")
+                self.errors += 1
+                if self.metrics is not None:
+                    self.metrics.increment("errors", stage="write")
+            finally:
+                self._task_done()
+
+    def _task_done(self) -> None:
+        with self._pending_cond:
+            self._pending -= 1
+            self._update_gauge()
+            if self._pending == 0:
+                self._pending_cond.notify_all()
+
+    def _update_gauge(self) -> None:
+        """在持有计数锁时更新 queue_depth，入队和出队的更新不会互相覆盖"""
+        if self.metrics is not None:
+            self.metrics.set_gauge("queue_depth", self._pending)
@@ -0,0 +1,91 @@
+"""并发请求经过 AsyncChatLoggerTransport 时测量事件循环的延迟，比较 offload 开启和关闭
+
+一个协程每 1ms 醒来一次，记录实际醒来时间比预期晚了多少；同时有多个协程并发发送请求，回复中带有大代码块，
+并使用服务端高亮放大渲染耗时。关闭 offload 时渲染和写入在事件循环上执行，每个回复都会让其他协程停顿；
+开启后事件循环只负责转发，导出线程与它竞争 GIL 时的停顿受解释器切换间隔限制。
+
+开启 offload 后的 p99 延迟超过关闭时的 max_ratio 倍则以非零状态退出，可以作为回归检查。
+
+运行: python benchmarks/bench_event_loop_lag.py [--concurrency 20] [--requests 20] [--max-ratio 0.5]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from ai_chat_html_exporter.openai_chat_html_exporter import AsyncChatLoggerTransport  # noqa: E402
+from ai_chat_html_exporter.session import chat_session  # noqa: E402
+
+CODE = "\n".join(f"def step_{i}(value):\n    return compute(value, '<{i}>')  # 第 {i} 步" for i in range(3000))
+REPLY = {"role": "assistant", "content": f"修改如下:\n```python\n{CODE}\n```"}
+
+
+async def handler(request):
+    # 模拟服务端耗时，让多个请求真正并发
+    await asyncio.sleep(0.005)
+    return httpx.Response(200, json={"choices": [{"message": REPLY, "finish_reason": "stop"}]})
+
+
+async def monitor(stop, lags):
+    """每 1ms 醒来一次，记录醒来的延迟"""
+    interval = 0.001
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def worker(client, task, count):
+    with chat_session(f"task-{task}"):
+        for step in range(count):
+            # 每次只发送新的问题，让客户端自身的序列化开销保持很小
+            messages = [{"role": "system", "content": "你是一个编程助手。"}, {"role": "user", "content": f"第 {step} 步"}]
+            await client.post("/chat/completions", json={"model": "gpt-4o", "messages": messages})
+
+
+async def run(offload, concurrency, count) -> float:
+    """发送 concurrency * count 个请求，打印耗时和事件循环延迟，返回 p99 延迟（秒）"""
+    transport = httpx.MockTransport(handler)
+    if offload is not None:
+        transport = AsyncChatLoggerTransport(transport, output_dir=tempfile.mkdtemp(prefix="bench-"), offload=offload,
+                                             highlight_mode="server")
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    lags = []
+    stop = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client, task, count) for task in range(concurrency)))
+    seconds = time.perf_counter() - start
+    stop.set()
+    await monitor_task
+    await client.aclose()
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)]
+    print(f"offload={str(offload):<5}  {concurrency * count} 个请求耗时 {seconds:6.2f}s  "
+          f"事件循环延迟 p50 {statistics.median(lags) * 1e3:6.2f} ms  p99 {p99 * 1e3:6.2f} ms  "
+          f"最大 {lags[-1] * 1e3:7.2f} ms")
+    return p99
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=20, help="并发的对话数")
+    parser.add_argument("--requests", type=int, default=20, help="每个对话的请求数")
+    parser.add_argument("--max-ratio", type=float, default=0.5, help="offload 开启与关闭时 p99 延迟之比的上限")
+    args = parser.parse_args()
+    # None 为不记录日志的基准
+    p99 = {offload_enabled: asyncio.run(run(offload_enabled, args.concurrency, args.requests))
+           for offload_enabled in (None, False, True)}
+    ratio = p99[True] / p99[False]
+    print(f"offload 开启与关闭的 p99 延迟之比 {ratio:.2f}，上限 {args.max_ratio}")
+    if ratio > args.max_ratio:
+        print("offload 没有明显降低事件循环延迟")
+        sys.exit(1)
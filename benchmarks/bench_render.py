@@ -0,0 +1,140 @@
+"""对比 renderer.render_text 与原先逐行处理的实现：先校验输出一致，再比较耗时
+
+运行: python benchmarks/bench_render.py
+"""
+import html
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ai_chat_html_exporter.highlighter import highlight as highlight_code  # noqa: E402
+from ai_chat_html_exporter.renderer import render_text  # noqa: E402
+
+
+# ---- 原实现：escape -> 逐行拆分检测代码块 -> 每次调用重新查找正则的图片替换 -> 内联代码 ----
+
+def _legacy_highlight_block(code, language):
+    return (f'<pre><code class="hljs language-{language}" data-highlighted="yes">'
+            f'{highlight_code(code, html.unescape(language))}</code></pre>')
+
+
+def legacy_detect_code_blocks(text, server=False):
+    lines = text.split('\n')
+    in_code_block = False
+    language = ''
+    code_content = []
+    result = []
+    for line in lines:
+        if line.startswith('```') and not in_code_block:
+            in_code_block = True
+            language = line[3:].strip() or 'plaintext'
+        elif line.startswith('```') and in_code_block:
+            in_code_block = False
+            if server:
+                result.append(_legacy_highlight_block(html.unescape('\n'.join(code_content)), language))
+            else:
+                result.append(f'<pre><code class="language-{language}">' + '\n'.join(code_content) + '</code></pre>')
+            code_content = []
+        elif in_code_block:
+            code_content.append(line)
+        else:
+            result.append(line)
+    return '\n'.join(result)
+
+
+def legacy_detect_images(text):
+    url_pattern = r'(https?://\S+\.(?:png|jpg|jpeg|gif|webp))'
+    text = re.sub(url_pattern, r'<div class="image-container"><img src="\1" alt="图片"></div>', text)
+    base64_pattern = r'(data:image/(?:png|jpg|jpeg|gif|webp);base64,[a-zA-Z0-9+/]+={0,2})'
+    return re.sub(base64_pattern, r'<div class="image-container"><img src="\1" alt="Base64图片"></div>', text)
+
+
+def legacy_detect_inline_code(text):
+    parts = text.split('`')
+    result = []
+    for i, part in enumerate(parts):
+        result.append(f'<code>{part}</code>' if i % 2 == 1 else part)
+    return ''.join(result)
+
+
+def legacy_render(text, detect_images=True, server=False):
+    processed = html.escape(text)
+    processed = legacy_detect_code_blocks(processed, server)
+    if detect_images:
+        processed = legacy_detect_images(processed)
+    return legacy_detect_inline_code(processed)
+
+
+def new_render(text, detect_images=True, server=False):
+    code_block = (lambda code, language: _legacy_highlight_block(html.unescape(code), language)) if server else None
+    return render_text(text, detect_images, code_block)
+
+
+# ---- 测试数据 ----
+
+def realistic_message(rng, size):
+    """模拟助手输出：段落、内联代码、图片链接和代码块交替出现"""
+    words = ["the", "model", "returns", "a", "value", "<tag>", "a & b", "'quoted'", "\"x\"", "call", "数据", "结果"]
+    parts = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.55:
+            chunk = " ".join(rng.choice(words) for _ in range(rng.randint(5, 30)))
+            if rng.random() < 0.5:
+                chunk += f" use `{rng.choice(words)}` here"
+        elif kind < 0.85:
+            body = "\n".join(f"    value_{i} = compute('{i}') # step <{i}>" for i in range(rng.randint(2, 25)))
+            chunk = f"```{rng.choice(['python', 'json', '', 'bash'])}\n{body}\n```"
+        elif kind < 0.95:
+            chunk = f"see https://example.com/images/{rng.randint(0, 999)}.png for details"
+        else:
+            chunk = "data:image/png;base64," + "iVBORw0KGgoAAAANSUhEUg" * rng.randint(1, 20) + "=="
+        parts.append(chunk)
+        length += len(chunk)
+    return "\n".join(parts)
+
+
+def fuzz_message(rng):
+    """由各类标记随机拼接的短文本，覆盖未闭合代码块、落单的反引号等边界情况"""
+    pieces = ["```", "```py", "```json ", "`", "``", "\n", "\n\n", "a", " ", "x y", "<b>", "&",
+              "https://x.io/a.png", "data:image/png;base64,AAAA==", "http://h/b.jpg`", "\r\n"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+
+
+def check_parity(rng):
+    cases = [realistic_message(rng, rng.randint(10, 5000)) for _ in range(200)]
+    cases += [fuzz_message(rng) for _ in range(20000)]
+    for text in cases:
+        for detect_images in (True, False):
+            for server in (False, True):
+                expected = legacy_render(text, detect_images, server)
+                actual = new_render(text, detect_images, server)
+                if expected != actual:
+                    print("输出不一致:")
+                    print(repr(text))
+                    print(repr(expected))
+                    print(repr(actual))
+                    return False
+    print(f"输出一致: {len(cases)} 条样本 x 4 种模式")
+    return True
+
+
+def benchmark(rng):
+    for size in (1_000, 10_000, 100_000):
+        text = realistic_message(rng, size)
+        number = max(1, 2_000_000 // size)
+        legacy = min(timeit.repeat(lambda: legacy_render(text), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: new_render(text), number=number, repeat=5)) / number
+        print(f"{len(text):>8} 字符  原实现 {legacy * 1e6:9.1f} us  render_text {new * 1e6:9.1f} us  加速 {legacy / new:4.2f}x")
+
+
+if __name__ == "__main__":
+    random_generator = random.Random(20240501)
+    if not check_parity(random_generator):
+        sys.exit(1)
+    benchmark(random_generator)
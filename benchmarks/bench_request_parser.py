@@ -0,0 +1,53 @@
+"""模拟一个不断增长的 agent 对话，比较每次完整 json.loads 与 IncrementalRequestParser 的累计耗时
+
+运行: python benchmarks/bench_request_parser.py
+"""
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ai_chat_html_exporter.request_parser import IncrementalRequestParser  # noqa: E402
+
+TOOLS = [
+    {"type": "function", "function": {"name": f"tool_{i}", "description": "工具说明 " * 20,
+                                      "parameters": {"type": "object", "properties": {"path": {"type": "string"}}}}}
+    for i in range(30)
+]
+
+
+def conversation_bodies(rng, turns):
+    """生成每一步的请求体，与 openai 客户端一样使用紧凑的 JSON"""
+    messages = [{"role": "system", "content": "你是一个编程助手。" * 20}]
+    for step in range(turns):
+        messages.append({"role": "user", "content": "请继续处理下一个文件 " * rng.randint(5, 50)})
+        body = {"messages": messages, "model": "gpt-4o", "tools": TOOLS}
+        yield json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        messages.append({"role": "assistant", "content": "已完成，结果如下 " * rng.randint(20, 200)})
+
+
+def run(turns):
+    bodies = list(conversation_bodies(random.Random(turns), turns))
+
+    start = time.perf_counter()
+    for body in bodies:
+        full = json.loads(body)
+    full_seconds = time.perf_counter() - start
+
+    parser = IncrementalRequestParser()
+    start = time.perf_counter()
+    for body in bodies:
+        incremental = parser.parse(body)
+    incremental_seconds = time.perf_counter() - start
+
+    assert incremental == full
+    print(f"{turns:>5} 轮  最后请求 {len(bodies[-1]) / 1024:8.0f} KB  json.loads {full_seconds * 1e3:8.1f} ms  "
+          f"增量解析 {incremental_seconds * 1e3:7.1f} ms  加速 {full_seconds / incremental_seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    for turns in (50, 200, 500):
+        run(turns)
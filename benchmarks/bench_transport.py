@@ -0,0 +1,225 @@
+"""用合成对话测量日志传输层给每个请求增加的延迟和写入的字节数
+
+请求发给本地的 httpx.MockTransport，分别经过原始传输层和日志传输层，两者的耗时差即日志记录的开销。
+场景覆盖长历史、大代码块、大量工具调用、Base64 图片和长 SSE 流，另外单独测量 HtmlGenerator 的渲染耗时。
+
+运行: python benchmarks/bench_transport.py [--requests 200] [--options '{"async_write": true}'] [--scenario sse] [--metrics]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from ai_chat_html_exporter.html_generator import HtmlGenerator  # noqa: E402
+from ai_chat_html_exporter.metrics import PrometheusMetrics  # noqa: E402
+from ai_chat_html_exporter.openai_chat_html_exporter import (  # noqa: E402
+    AsyncChatLoggerTransport,
+    SyncChatLoggerTransport,
+)
+
+TOOLS = [
+    {"type": "function", "function": {"name": f"tool_{i}", "description": "工具说明 " * 20,
+                                      "parameters": {"type": "object", "properties": {"path": {"type": "string"}}}}}
+    for i in range(20)
+]
+CODE = "\n".join(f"def step_{i}(value):\n    return compute(value, '<{i}>')  # 第 {i} 步" for i in range(200))
+IMAGE = "data:image/png;base64," + base64.b64encode(bytes(random.Random(0).getrandbits(8) for _ in range(64 * 1024))).decode()
+
+
+class ChunkStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """逐块返回响应体，模拟真实的流式响应"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def __iter__(self):
+        yield from self._chunks
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+# ---- 场景：每个场景生成一组请求体，以及服务端对每个请求的回复 ----
+
+def reply_message(scenario, rng, step):
+    if scenario == "code_blocks":
+        return {"role": "assistant", "content": f"第 {step} 步修改如下:\n```python\n{CODE}\n```\n请确认"}
+    if scenario == "tool_calls":
+        return {"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{step}_{i}", "type": "function",
+             "function": {"name": f"tool_{i}", "arguments": json.dumps({"path": f"src/{i}.py", "limit": i})}}
+            for i in range(rng.randint(5, 15))
+        ]}
+    return {"role": "assistant", "content": "已完成，结果如下 " * rng.randint(20, 200)}
+
+
+def user_message(scenario, rng, step):
+    if scenario == "images":
+        return {"role": "user", "content": [
+            {"type": "text", "text": f"第 {step} 张截图里有什么问题？"},
+            {"type": "image_url", "image_url": {"url": IMAGE}},
+        ]}
+    return {"role": "user", "content": f"请继续处理第 {step} 个文件 " * rng.randint(5, 50)}
+
+
+def scenario_requests(scenario, rng, count):
+    """生成一个持续增长的对话，返回 [(请求体, 回复消息)]"""
+    messages = [{"role": "system", "content": "你是一个编程助手。" * 20}]
+    requests = []
+    for step in range(count):
+        messages.append(user_message(scenario, rng, step))
+        body = {"model": "gpt-4o", "messages": list(messages), "tools": TOOLS, "stream": scenario == "sse"}
+        reply = reply_message(scenario, rng, step)
+        requests.append((json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), reply))
+        messages.append(reply)
+        if scenario == "images" and len(messages) > 21:
+            # 图片对话的历史太长时重新开始，避免请求体无限增大
+            messages = messages[:1]
+    return requests
+
+
+def make_handler(replies):
+    """按请求顺序返回对应的回复，SSE 场景把回复拆成大量小块"""
+    iterator = iter(replies)
+
+    def handler(request):
+        reply = next(iterator)
+        if json.loads(request.content).get("stream"):
+            text = reply["content"] * 10
+            events = [json.dumps({"choices": [{"delta": {"content": text[i:i + 8]}}]}) for i in range(0, len(text), 8)]
+            events.append(json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]}))
+            chunks = [f"data: {event}\n\n".encode("utf-8") for event in events] + [b"data: [DONE]\n\n"]
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=ChunkStream(chunks))
+        return httpx.Response(200, json={"model": "gpt-4o", "choices": [{"message": reply, "finish_reason": "stop"}]})
+
+    return handler
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+# ---- 同步与异步客户端 ----
+
+def run_sync(requests, options, logged):
+    output_dir = tempfile.mkdtemp(prefix="bench-")
+    transport = httpx.MockTransport(make_handler([reply for _, reply in requests]))
+    if logged:
+        transport = SyncChatLoggerTransport(transport, output_dir=output_dir, **options)
+    client = httpx.Client(transport=transport, base_url="http://bench")
+    latencies = []
+    for body, _ in requests:
+        start = time.perf_counter()
+        with client.stream("POST", "/chat/completions", content=body,
+                           headers={"content-type": "application/json"}) as response:
+            for _ in response.iter_bytes():
+                pass
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    client.close()
+    close_seconds = time.perf_counter() - start
+    return latencies, close_seconds, directory_bytes(output_dir)
+
+
+async def _run_async(requests, options, logged):
+    output_dir = tempfile.mkdtemp(prefix="bench-")
+    transport = httpx.MockTransport(make_handler([reply for _, reply in requests]))
+    if logged:
+        transport = AsyncChatLoggerTransport(transport, output_dir=output_dir, **options)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    latencies = []
+    for body, _ in requests:
+        start = time.perf_counter()
+        async with client.stream("POST", "/chat/completions", content=body,
+                                 headers={"content-type": "application/json"}) as response:
+            async for _ in response.aiter_bytes():
+                pass
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await client.aclose()
+    close_seconds = time.perf_counter() - start
+    return latencies, close_seconds, directory_bytes(output_dir)
+
+
+def run_async(requests, options, logged):
+    return asyncio.run(_run_async(requests, options, logged))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_transport(scenario, count, options, with_metrics=False):
+    requests = scenario_requests(scenario, random.Random(scenario), count)
+    request_bytes = sum(len(body) for body, _ in requests)
+    for name, runner in (("sync", run_sync), ("async", run_async)):
+        baseline, _, _ = runner(requests, options, logged=False)
+        metrics = PrometheusMetrics() if with_metrics else None
+        logged, close_seconds, written = runner(requests, {**options, "metrics": metrics}, logged=True)
+        overhead = [max(0.0, a - b) for a, b in zip(logged, baseline)]
+        print(f"{scenario:<12} {name:<5}  请求 {count:>4} 个 / {request_bytes / 1024 / 1024:7.1f} MB  "
+              f"额外耗时 p50 {statistics.median(overhead) * 1e3:7.2f} ms  p95 {percentile(overhead, 0.95) * 1e3:7.2f} ms  "
+              f"关闭 {close_seconds * 1e3:7.1f} ms  写入 {written / 1024:9.0f} KB")
+        if metrics is not None:
+            timings = metrics.snapshot()["timings"]
+            print("    " + "  ".join(f"{stage} {timing['seconds'] / timing['count'] * 1e3:.3f} ms x{timing['count']}"
+                                     for stage, timing in sorted(timings.items())))
+
+
+# ---- HtmlGenerator 的渲染和写入 ----
+
+def bench_generator(options):
+    contents = {
+        "text": ("user", "请解释一下这段代码 `compute()` 的作用 " * 50),
+        "code": ("assistant", f"```python\n{CODE}\n```"),
+        "dict": ("user", {"path": "src/main.py", "lines": list(range(2000))}),
+        "tool_calls": ("assistant", {"response": "", "tool_calls": [
+            {"function_name": f"tool_{i}", "function_args": {"path": f"src/{i}.py", "content": CODE[:2000]}}
+            for i in range(10)]}),
+        "image": ("user", [{"type": "text", "text": "截图"}, {"type": "image_url", "image_url": {"url": IMAGE}}]),
+    }
+    options = {key: value for key, value in options.items() if key != "async_write"}
+    generator = HtmlGenerator(output_dir=tempfile.mkdtemp(prefix="bench-"), **options)
+    generator.create_html_file()
+    for name, (role, content) in contents.items():
+        number = 200
+        start = time.perf_counter()
+        for _ in range(number):
+            generator._process_content(content, generator.html_file)
+        render = (time.perf_counter() - start) / number
+        start = time.perf_counter()
+        for _ in range(number):
+            generator.append_message(role, content)
+        append = (time.perf_counter() - start) / number
+        print(f"{name:<12} _process_content {render * 1e6:9.1f} us  append_message {append * 1e6:9.1f} us")
+    generator.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("--options", default="{}", help="传给日志传输层的 HtmlGenerator 选项，JSON 格式")
+    parser.add_argument("--scenario", choices=("long_history", "code_blocks", "tool_calls", "images", "sse"),
+                        help="只运行一个场景")
+    parser.add_argument("--metrics", action="store_true", help="开启指标回调，并输出各阶段的平均耗时")
+    args = parser.parse_args()
+    generator_options = json.loads(args.options)
+
+    print(f"选项: {generator_options}")
+    for scenario_name in [args.scenario] if args.scenario else ["long_history", "code_blocks", "tool_calls", "images", "sse"]:
+        bench_transport(scenario_name, args.requests, generator_options, args.metrics)
+    print()
+    bench_generator(generator_options)
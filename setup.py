@@ -9,6 +9,14 @@ setup(
         "python-dotenv>=1.0.0",
         "openai>=1.6.1",
     ],
+    extras_require={
+        "zstd": ["zstandard>=0.22"],
+    },
+    entry_points={
+        "console_scripts": [
+            "ai-chat-html-exporter=ai_chat_html_exporter.cli:main",
+        ],
+    },
     author="fishisnow",
     author_email="fishisnow2021@gmail.com",
     description="A tool to export AI chat history to HTML with syntax highlighting",
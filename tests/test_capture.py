@@ -0,0 +1,30 @@
+import glob
+import os
+import re
+
+import pytest
+
+from ai_chat_html_exporter.cli import render_directory
+from ai_chat_html_exporter.compression import open_file
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_rendered_part_links_point_at_rendered_files(tmp_path, compression):
+    captures = tmp_path / "captures"
+    generator = HtmlGenerator(output_dir=str(captures), capture_format="jsonl", compression="gzip", rotate_messages=2)
+    for i in range(5):
+        generator.append_message("user", f"message {i}")
+    generator.close()
+
+    output = tmp_path / "html"
+    stats = render_directory(str(captures), str(output), jobs=1, compression=compression)
+    assert stats["rendered"] == 3
+
+    pages = glob.glob(os.path.join(str(output), "*.html*"))
+    assert len(pages) == 3
+    names = {os.path.basename(page) for page in pages}
+    for page in pages:
+        with open_file(page, "r") as f:
+            links = re.findall(r'<a href="([^"]+)">———', f.read())
+        assert links and all(link in names for link in links)
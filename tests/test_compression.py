@@ -0,0 +1,46 @@
+import glob
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from ai_chat_html_exporter.compression import compress_file, open_file
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+
+
+@pytest.mark.parametrize("compress_mode", ["close", "stream"])
+def test_write_after_close_starts_new_part(tmp_path, compress_mode):
+    generator = HtmlGenerator(output_dir=str(tmp_path), compression="gzip", compress_mode=compress_mode)
+    generator.append_message("user", "first message")
+    generator.close()
+    generator.append_message("user", "second message")
+    generator.close()
+
+    files = sorted(glob.glob(os.path.join(str(tmp_path), "*.html.gz")))
+    assert len(files) == 2
+    for path, text in zip(files, ("first message", "second message")):
+        with open_file(path, "r") as f:
+            page = f.read()
+        assert text in page
+        assert page.count("</html>") == 1
+
+
+def _compress(path):
+    try:
+        compress_file(path)
+    except FileNotFoundError:
+        # 其他进程已经压缩并删除了原文件
+        pass
+
+
+def test_concurrent_compress_file_keeps_archive_intact(tmp_path):
+    data = os.urandom(1_000_000).hex().encode()
+    path = tmp_path / "conversation_old.html"
+    path.write_bytes(data)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_compress, [str(path)] * 4))
+
+    with gzip.open(str(path) + ".gz") as f:
+        assert f.read() == data
+    assert os.listdir(str(tmp_path)) == ["conversation_old.html.gz"]
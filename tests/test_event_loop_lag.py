@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import httpx
+
+from ai_chat_html_exporter.openai_chat_html_exporter import AsyncChatLoggerTransport
+from ai_chat_html_exporter.session import chat_session
+
+# 带大代码块的回复，配合服务端高亮让每次渲染都有明显的耗时
+CODE = "\n".join(f"def step_{i}(value):\n    return compute(value, '<{i}>')" for i in range(1500))
+REPLY = {"role": "assistant", "content": f"```python\n{CODE}\n```"}
+
+
+async def _handler(request):
+    await asyncio.sleep(0.002)
+    return httpx.Response(200, json={"choices": [{"message": REPLY, "finish_reason": "stop"}]})
+
+
+async def _p99_lag(output_dir, offload: bool) -> float:
+    """并发发送请求，同时每 1ms 检查一次事件循环，返回醒来延迟的 p99（秒）"""
+    transport = AsyncChatLoggerTransport(httpx.MockTransport(_handler), output_dir=output_dir, offload=offload,
+                                         highlight_mode="server")
+    client = httpx.AsyncClient(transport=transport, base_url="http://test")
+    lags = []
+    stop = asyncio.Event()
+
+    async def monitor():
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def worker(task):
+        with chat_session(f"task-{task}"):
+            for step in range(3):
+                messages = [{"role": "user", "content": f"task {task} step {step}"}]
+                await client.post("/chat/completions", json={"model": "m", "messages": messages})
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.gather(*(worker(task) for task in range(4)))
+    stop.set()
+    await monitor_task
+    await client.aclose()
+    transport.close_logs()
+    lags.sort()
+    return lags[int(len(lags) * 0.99)]
+
+
+def test_offload_reduces_event_loop_lag(tmp_path):
+    inline = asyncio.run(_p99_lag(str(tmp_path / "inline"), offload=False))
+    offloaded = asyncio.run(_p99_lag(str(tmp_path / "offload"), offload=True))
+    # 关闭 offload 时每个回复都在事件循环上渲染，开启后延迟应明显更低
+    assert offloaded < inline * 0.5, (offloaded, inline)
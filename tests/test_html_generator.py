@@ -0,0 +1,15 @@
+import glob
+import os
+
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+
+
+def test_rotate_bytes_excludes_page_header(tmp_path):
+    generator = HtmlGenerator(output_dir=str(tmp_path), rotate_bytes=4000)
+    for i in range(10):
+        generator.append_message("user", f"message {i} " + "x" * 900)
+    generator.close()
+
+    files = glob.glob(os.path.join(str(tmp_path), "*.html"))
+    # 每条消息约 1KB，页面头部不计入时每个分卷能放下多条消息
+    assert 1 < len(files) < 5
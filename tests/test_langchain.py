@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage  # noqa: E402
+
+from ai_chat_html_exporter import HtmlExportCallbackHandler  # noqa: E402
+
+
+def test_digests_only_new_messages(tmp_path, monkeypatch):
+    handler = HtmlExportCallbackHandler(output_dir=str(tmp_path))
+    digested = []
+    original = HtmlExportCallbackHandler._message_digest
+    monkeypatch.setattr(handler, "_message_digest", lambda message: digested.append(message) or original(message))
+
+    model = GenericFakeChatModel(messages=iter([AIMessage(content=f"reply {i}") for i in range(10)]))
+    messages = [SystemMessage("sys"), HumanMessage("question 0")]
+    for i in range(10):
+        reply = model.invoke(messages, config={"callbacks": [handler]})
+        messages = messages + [reply, HumanMessage(f"question {i + 1}")]
+    handler.close()
+
+    # 第一次调用计算 2 条，之后每次只计算新增的回复和问题
+    assert len(digested) == 2 + 9 * 2
+    with open(handler.html_file, encoding="utf-8") as f:
+        page = f.read()
+    assert page.count('class="message ') == 21
@@ -0,0 +1,21 @@
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+from ai_chat_html_exporter.metrics import PrometheusMetrics
+
+
+def test_render_keeps_full_precision():
+    metrics = PrometheusMetrics()
+    metrics.increment("bytes_written", 123456789)
+    metrics.set_gauge("ratio", 1 / 3)
+    lines = metrics.render().splitlines()
+    assert "ai_chat_html_exporter_bytes_written_total 123456789" in lines
+    assert "ai_chat_html_exporter_ratio 0.3333333333333333" in lines
+
+
+def test_queue_depth_returns_to_zero(tmp_path):
+    metrics = PrometheusMetrics()
+    generator = HtmlGenerator(output_dir=str(tmp_path), async_write=True, metrics=metrics)
+    for i in range(50):
+        generator.append_message("user", f"message {i}")
+    generator.flush()
+    assert metrics.snapshot()["gauges"]["queue_depth"] == 0
+    generator.close()
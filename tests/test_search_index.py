@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+from ai_chat_html_exporter.search_index import INDEX_NAME, SearchIndex
+
+
+@pytest.mark.parametrize("capture_format", ["html", "jsonl"])
+def test_offsets_exclude_tools_prefix(tmp_path, capture_format):
+    generator = HtmlGenerator(output_dir=str(tmp_path), capture_format=capture_format, search_index=True)
+    tools = [{"type": "function", "function": {"name": "grep"}}]
+    generator.append_message("user", {"text": "find the needle", "tools": tools})
+    generator.close()
+
+    hits = SearchIndex(os.path.join(str(tmp_path), INDEX_NAME)).search("needle")
+    assert len(hits) == 1
+    with open(hits[0]["file"], "rb") as f:
+        f.seek(hits[0]["offset"])
+        data = f.read(hits[0]["length"]).decode("utf-8")
+    assert "needle" in data
+    assert "tools-schema" not in data and '"type":"tools"' not in data
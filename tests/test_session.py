@@ -0,0 +1,64 @@
+import glob
+import os
+
+from ai_chat_html_exporter import chat_session
+from ai_chat_html_exporter.html_generator import HtmlGenerator
+from ai_chat_html_exporter.session import SessionRouter
+
+
+class _Request:
+    def __init__(self):
+        self.headers = {}
+        self.content = b"{}"
+
+
+def _write(router, session_id, text):
+    with chat_session(session_id):
+        session = router.route(_Request())
+    with session.lock:
+        router.open(session)
+        session.generator.append_message("user", text)
+    return session
+
+
+def test_evicted_session_keeps_earlier_messages(tmp_path):
+    root = HtmlGenerator(output_dir=str(tmp_path))
+    root.create_html_file()
+    router = SessionRouter(root, max_sessions=2)
+
+    first = _write(router, "a", "first message of a").generator.html_file
+    _write(router, "b", "message of b")
+    _write(router, "c", "message of c")  # 回收会话 a
+    again = _write(router, "a", "second message of a").generator.html_file
+    router.close()
+    root.close_html_file()
+    root.close()
+
+    assert again != first
+    with open(first, encoding="utf-8") as f:
+        assert "first message of a" in f.read()
+    with open(again, encoding="utf-8") as f:
+        assert "second message of a" in f.read()
+    assert len(glob.glob(os.path.join(str(tmp_path), "*_a*.html"))) == 2
+
+
+def test_idle_sessions_release_handles(tmp_path):
+    root = HtmlGenerator(output_dir=str(tmp_path))
+    root.create_html_file()
+    router = SessionRouter(root, max_open_files=4)
+
+    before = len(os.listdir("/proc/self/fd"))
+    for round_number in range(2):
+        for i in range(40):
+            _write(router, f"s{i}", f"round {round_number} of s{i}")
+    assert len(os.listdir("/proc/self/fd")) - before <= 4
+    router.close()
+    root.close_html_file()
+    root.close()
+
+    for i in range(40):
+        (path,) = glob.glob(os.path.join(str(tmp_path), f"*_s{i}.html"))
+        with open(path, encoding="utf-8") as f:
+            page = f.read()
+        assert f"round 0 of s{i}" in page and f"round 1 of s{i}" in page
+        assert page.count("</html>") == 1
@@ -0,0 +1,50 @@
+import glob
+import json
+import os
+
+import httpx
+import pytest
+
+from ai_chat_html_exporter.compression import open_file
+from ai_chat_html_exporter.openai_chat_html_exporter import SyncChatLoggerTransport
+
+
+def _handler(request):
+    body = json.loads(request.content)
+    reply = {"role": "assistant", "content": "reply to " + body["messages"][-1]["content"]}
+    return httpx.Response(200, json={"choices": [{"message": reply}]})
+
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="需要 /proc 统计文件描述符")
+@pytest.mark.parametrize("options", [{}, {"compression": "gzip"}, {"compression": "gzip", "compress_mode": "close"}])
+def test_forks_do_not_keep_handles_open(tmp_path, options):
+    transport = SyncChatLoggerTransport(httpx.MockTransport(_handler), output_dir=str(tmp_path), **options)
+    client = httpx.Client(transport=transport, base_url="http://test")
+    history = [{"role": "system", "content": "sys"}, {"role": "user", "content": "question"}]
+    reply = client.post("/chat/completions", json={"model": "m", "messages": history}).json()
+    history.append(reply["choices"][0]["message"])
+
+    before = _open_fds()
+    for i in range(50):
+        # 每次重试都从同一条回复之后分叉，然后在分叉上继续一轮
+        fork = history + [{"role": "user", "content": f"retry {i}"}]
+        reply = client.post("/chat/completions", json={"model": "m", "messages": fork}).json()
+        fork = fork + [reply["choices"][0]["message"], {"role": "user", "content": f"follow {i}"}]
+        client.post("/chat/completions", json={"model": "m", "messages": fork})
+    assert _open_fds() - before < 5
+    client.close()
+    transport.close_logs()
+
+    forks = sorted(glob.glob(os.path.join(str(tmp_path), "*_fork*")))
+    # 第一次重试直接延续主对话，之后的每次重试各是一个分叉
+    assert len(forks) == 49
+    for path in forks:
+        with open_file(path, "r") as f:
+            page = f.read()
+        number = page.split("retry ", 1)[1].split("<", 1)[0]
+        assert f"follow {number}" in page
+        assert page.count("</html>") == 1
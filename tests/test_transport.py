@@ -0,0 +1,28 @@
+import glob
+import os
+
+import httpx
+
+from ai_chat_html_exporter.openai_chat_html_exporter import SyncChatLoggerTransport
+from ai_chat_html_exporter.sampling import SamplingPolicy
+
+
+def _bad_gateway(request):
+    return httpx.Response(502, text="<html><body>502 Bad Gateway</body></html>",
+                          headers={"content-type": "text/html"})
+
+
+def test_non_json_error_body_reaches_caller_and_is_kept(tmp_path):
+    sampling = SamplingPolicy(rate=0, keep_errors=True)
+    transport = SyncChatLoggerTransport(httpx.MockTransport(_bad_gateway), output_dir=str(tmp_path), sampling=sampling)
+    client = httpx.Client(transport=transport, base_url="http://test")
+    messages = [{"role": "user", "content": "question before the outage"}]
+    response = client.post("/chat/completions", json={"model": "m", "messages": messages})
+    client.close()
+    transport.close_logs()
+
+    assert response.status_code == 502
+    assert "Bad Gateway" in response.text
+    (path,) = glob.glob(os.path.join(str(tmp_path), "*.html"))
+    with open(path, encoding="utf-8") as f:
+        assert "question before the outage" in f.read()
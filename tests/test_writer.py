@@ -0,0 +1,58 @@
+import threading
+
+from ai_chat_html_exporter.writer import BackgroundWriter
+
+
+def _block_writer(writer):
+    """让写入线程停在一个任务上，返回放行用的事件"""
+    started, release = threading.Event(), threading.Event()
+    writer.submit(lambda: started.set() or release.wait(5))
+    started.wait(5)
+    return release
+
+
+def test_spill_overflow_is_bounded():
+    writer = BackgroundWriter(queue_size=2, full_policy="spill", max_spill=3)
+    release = _block_writer(writer)
+    try:
+        accepted = [writer.submit(lambda: None) for _ in range(20)]
+    finally:
+        release.set()
+    writer.close()
+    # 队列容纳 2 个，溢出区 3 个，其余被丢弃
+    assert accepted.count(True) == 5
+    assert writer.dropped == 15
+
+
+def test_close_after_timeout_keeps_spilled_tasks():
+    done = []
+    writer = BackgroundWriter(queue_size=2, full_policy="spill")
+    release = _block_writer(writer)
+    try:
+        for i in range(10):
+            writer.submit(done.append, i)
+        closer = threading.Thread(target=writer.close, args=(0.05,))
+        closer.start()
+        closer.join(5)
+        # 队列已满时放入结束标记不会阻塞 close
+        assert not closer.is_alive()
+    finally:
+        release.set()
+    writer._thread.join(5)
+    assert done == list(range(10))
+
+
+def test_required_task_after_spill_drains():
+    writer = BackgroundWriter(queue_size=1, full_policy="spill", max_spill=1)
+    for _ in range(20):
+        release = _block_writer(writer)
+        writer.submit(lambda: None)  # 队列
+        writer.submit(lambda: None)  # 溢出区
+        done = threading.Event()
+        waiter = threading.Thread(target=writer.submit_required, args=(done.set,))
+        waiter.start()
+        release.set()
+        waiter.join(5)
+        # 等待溢出区的任务在溢出区清空后放入队列，写入线程不会错过它
+        assert writer.flush(5) and done.is_set()
+    writer.close()